@@ -0,0 +1,9 @@
+-- Adds the slots of the consumers (see consumer/slots.py) to an existing database.
+-- Existing consumers get a single slot until they register again on their next start.
+--
+-- psql -h <host> -U docker -d producer -f add_consumer_slots.sql
+
+ALTER TABLE consumer ADD COLUMN IF NOT EXISTS slots INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE consumer ADD COLUMN IF NOT EXISTS running INTEGER NOT NULL DEFAULT 0;
+
+UPDATE consumer SET running = 1 WHERE status = 'busy';
@@ -0,0 +1,7 @@
+-- Adds the leases of the job chunks and the heartbeats of the consumers (see producer/views/job_chunk_heartbeat.py)
+-- to an existing database.
+--
+-- psql -h <host> -U docker -d producer -f add_job_chunk_leases.sql
+
+ALTER TABLE job_chunks ADD COLUMN IF NOT EXISTS lease_expires TIMESTAMP;
+ALTER TABLE consumer ADD COLUMN IF NOT EXISTS last_heartbeat TIMESTAMP;
@@ -0,0 +1,7 @@
+-- Adds the rank of the job chunks, the order in which the job chunks of a job are dispatched
+-- (see producer/chunk_sketches.py rank_databases), to an existing database.
+-- Existing job chunks get rank 0 and keep being dispatched in the order of their ids.
+--
+-- psql -h <host> -U docker -d producer -f add_job_chunk_rank.sql
+
+ALTER TABLE job_chunks ADD COLUMN IF NOT EXISTS rank INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,9 @@
+-- Adds the database file fingerprint used to reuse the results of job chunks
+-- (see db/job_chunks.py find_reusable_job_chunks) to an existing database.
+-- Existing job chunks have no fingerprint, so their results are never reused.
+--
+-- psql -h <host> -U docker -d producer -f add_job_chunk_release.sql
+
+ALTER TABLE job_chunks ADD COLUMN IF NOT EXISTS release VARCHAR(64);
+
+CREATE INDEX IF NOT EXISTS job_chunks_database_release_idx ON job_chunks (database, release);
@@ -0,0 +1,7 @@
+-- Adds the predicted runtime and the deadline of the job chunks (see producer/runtime_model.py)
+-- to an existing database.
+--
+-- psql -h <host> -U docker -d producer -f add_job_chunk_runtimes.sql
+
+ALTER TABLE job_chunks ADD COLUMN IF NOT EXISTS predicted_runtime FLOAT;
+ALTER TABLE job_chunks ADD COLUMN IF NOT EXISTS timeout INTEGER;
@@ -0,0 +1,28 @@
+-- Adds the digests used to find reusable jobs (see db/jobs.py find_reusable_job) to an existing database.
+-- Only the most recent job of each query and set of database files gets the digests,
+-- so that the unique index can be created.
+--
+-- psql -h <host> -U docker -d producer -f add_job_digests.sql
+
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS query_digest VARCHAR(32);
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS databases_digest VARCHAR(32);
+
+UPDATE jobs
+SET query_digest = digests.query_digest, databases_digest = digests.databases_digest
+FROM (
+  SELECT DISTINCT ON (query_digest, databases_digest) id, query_digest, databases_digest
+  FROM (
+    SELECT
+      jobs.id,
+      jobs.submitted,
+      md5(replace(upper(regexp_replace(jobs.query, '\s', '', 'g')), 'U', 'T')) AS query_digest,
+      md5(string_agg(job_chunks.database, ',' ORDER BY job_chunks.database COLLATE "C")) AS databases_digest
+    FROM jobs
+    JOIN job_chunks ON job_chunks.job_id = jobs.id
+    GROUP BY jobs.id
+  ) AS all_digests
+  ORDER BY query_digest, databases_digest, submitted DESC
+) AS digests
+WHERE jobs.id = digests.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_query_digest_databases_digest_idx ON jobs (query_digest, databases_digest);
@@ -0,0 +1,30 @@
+-- Recomputes the digests used to find reusable jobs (see db/jobs.py databases_digest) of an existing database,
+-- now that they cover the release of each database file (see add_job_chunk_release.sql).
+-- Jobs with a job chunk without a release get no digest, so they are never reused as a whole,
+-- and only the most recent job of each query and set of releases gets the digests.
+--
+-- psql -h <host> -U docker -d producer -f add_job_release_digests.sql
+
+UPDATE jobs SET databases_digest = NULL WHERE databases_digest IS NOT NULL;
+
+UPDATE jobs
+SET query_digest = digests.query_digest, databases_digest = digests.databases_digest
+FROM (
+  SELECT DISTINCT ON (query_digest, databases_digest) id, query_digest, databases_digest
+  FROM (
+    SELECT
+      jobs.id,
+      jobs.submitted,
+      md5(replace(upper(regexp_replace(jobs.query, '\s', '', 'g')), 'U', 'T')) AS query_digest,
+      md5(string_agg(
+        job_chunks.database || ':' || job_chunks.release, ','
+        ORDER BY job_chunks.database || ':' || job_chunks.release COLLATE "C"
+      )) AS databases_digest
+    FROM jobs
+    JOIN job_chunks ON job_chunks.job_id = jobs.id
+    GROUP BY jobs.id
+    HAVING bool_and(job_chunks.release IS NOT NULL)
+  ) AS all_digests
+  ORDER BY query_digest, databases_digest, submitted DESC
+) AS digests
+WHERE jobs.id = digests.id;
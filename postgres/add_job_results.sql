@@ -0,0 +1,35 @@
+-- Adds the top results of the finished jobs (see db/jobs.py, save_job_results) and the pruned flag
+-- of the job chunks (see db/job_chunk_results.py, top_results) to an existing database.
+-- The results of the jobs finished before are still read from job_chunk_results.
+--
+-- psql -h <host> -U docker -d producer -f add_job_results.sql
+
+ALTER TABLE job_chunks ADD COLUMN IF NOT EXISTS pruned BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE TABLE IF NOT EXISTS job_results (
+  id serial PRIMARY KEY,
+  job_id VARCHAR(36) references jobs(id) ON UPDATE CASCADE ON DELETE CASCADE,
+  rank INTEGER NOT NULL,
+  rnacentral_id VARCHAR(255) NOT NULL,
+  description TEXT,
+  score FLOAT NOT NULL,
+  bias FLOAT NOT NULL,
+  e_value FLOAT NOT NULL,
+  target_length INTEGER NOT NULL,
+  alignment TEXT NOT NULL,
+  alignment_length INTEGER NOT NULL,
+  gap_count INTEGER NOT NULL,
+  match_count INTEGER NOT NULL,
+  nts_count1 INTEGER NOT NULL,
+  nts_count2 INTEGER NOT NULL,
+  identity FLOAT NOT NULL,
+  query_coverage FLOAT NOT NULL,
+  target_coverage FLOAT NOT NULL,
+  gaps FLOAT NOT NULL,
+  query_length INTEGER NOT NULL,
+  alignment_start INTEGER NOT NULL,
+  alignment_stop INTEGER NOT NULL,
+  alignment_sequence TEXT NOT NULL,
+  result_id INTEGER NOT NULL);
+
+CREATE INDEX IF NOT EXISTS job_results_job_id_rank_idx ON job_results (job_id, rank);
@@ -0,0 +1,6 @@
+-- Adds the source of the jobs, used by the scheduling policies (see producer/scheduling.py),
+-- to an existing database. Jobs submitted before have no source and are scheduled as API jobs.
+--
+-- psql -h <host> -U docker -d producer -f add_job_source.sql
+
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS source VARCHAR(255);
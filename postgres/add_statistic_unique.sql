@@ -0,0 +1,24 @@
+-- Merges the duplicate statistics of a source and period and adds the unique constraint
+-- that the UPSERT of the statistics relies on (see db/statistic.py) to an existing database.
+--
+-- psql -h <host> -U docker -d producer -f add_statistic_unique.sql
+
+BEGIN;
+
+UPDATE statistic
+SET total = duplicates.total
+FROM (
+    SELECT min(id) AS id, sum(total) AS total
+    FROM statistic
+    GROUP BY source, period
+    HAVING count(*) > 1
+) AS duplicates
+WHERE statistic.id = duplicates.id;
+
+DELETE FROM statistic
+USING statistic AS first
+WHERE statistic.source = first.source AND statistic.period = first.period AND statistic.id > first.id;
+
+ALTER TABLE statistic ADD CONSTRAINT statistic_source_period_key UNIQUE (source, period);
+
+COMMIT;
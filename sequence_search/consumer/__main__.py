@@ -22,9 +22,16 @@ from aiohttp import web, web_middlewares
 
 from . import settings
 from ..db.models import close_pg, init_pg
-from ..db.consumers import register_consumer_in_the_database
+from ..db.consumers import register_consumer_in_the_database, get_ip
 from ..db.settings import get_postgres_credentials
+from .nhmmer_batch import NhmmerBatcher
+from .producer_client import ProducerClient
+from .pyhmmer_search import PyhmmerEngine
+from .query_profile import evict_query_profiles
+from .short_query_index import ShortQueryEngine
+from .slots import get_consumer_slots
 from .urls import setup_routes
+from .work_queue import WorkQueue
 
 """
 Run either of the following commands from the parent of current directory:
@@ -42,9 +49,23 @@ async def on_startup(app):
     # register self in the database
     app['register_consumer_task'] = asyncio.create_task(register_consumer_in_the_database(app))
 
+    # tell the producer when a job is done, so that it schedules the next one right away,
+    # and renew the leases of the running job chunks
+    app['producer_client'] = ProducerClient()
+    app['heartbeat_task'] = asyncio.create_task(app['producer_client'].send_heartbeats(get_ip(app)))
+
+    if settings.DISPATCH_MODE == 'pull':
+        # claim the work from the database whenever a slot is free
+        app['work_queue_task'] = asyncio.create_task(WorkQueue(app).run())
+
     # clear queries and results directories
     app['clear_directories_task'] = asyncio.create_task(clear_directories(app))
 
+    # load the database files into memory, while the consumer already accepts searches
+    if app.get('pyhmmer_engine') and settings.PYHMMER_DATABASES:
+        prefixes = [prefix.strip() for prefix in settings.PYHMMER_DATABASES.split(',') if prefix.strip()]
+        app['load_databases_task'] = asyncio.create_task(app['pyhmmer_engine'].load(prefixes))
+
 
 async def clear_directories(app):
     # clear results directories
@@ -60,6 +81,9 @@ async def clear_directories(app):
 
         for name in os.listdir(settings.INFERNAL_QUERY_DIR):
             os.remove(settings.INFERNAL_QUERY_DIR / name)
+
+        # query profiles can be shared with other consumers, delete only the expired ones
+        evict_query_profiles()
     except Exception as e:
         logging.error(f"Error clearing directories: {str(e)}")
 
@@ -74,6 +98,24 @@ async def on_cleanup(app):
         except asyncio.CancelledError:
             logging.info("Background task register_consumer_in_the_database was cancelled")
 
+    # stop sending heartbeats, the producer requeues the job chunks that are left
+    heartbeat_task = app.get('heartbeat_task')
+    if heartbeat_task:
+        heartbeat_task.cancel()
+        try:
+            await heartbeat_task
+        except asyncio.CancelledError:
+            logging.info("Background task send_heartbeats was cancelled")
+
+    # stop claiming work from the database
+    work_queue_task = app.get('work_queue_task')
+    if work_queue_task:
+        work_queue_task.cancel()
+        try:
+            await work_queue_task
+        except asyncio.CancelledError:
+            logging.info("Background task work_queue was cancelled")
+
     # cancel the directory cleaning task if still running
     clear_task = app.get('clear_directories_task')
     if clear_task:
@@ -83,6 +125,26 @@ async def on_cleanup(app):
         except asyncio.CancelledError:
             logging.info("Background task clear_directories was cancelled")
 
+    # cancel the database loading task and free the memory used by the pyhmmer engine
+    load_task = app.get('load_databases_task')
+    if load_task:
+        load_task.cancel()
+        try:
+            await load_task
+        except asyncio.CancelledError:
+            logging.info("Background task load_databases was cancelled")
+
+    if app.get('pyhmmer_engine'):
+        app['pyhmmer_engine'].close()
+
+    if app.get('short_query_engine'):
+        app['short_query_engine'].close()
+
+    # close the aiohttp session used to notify the producer
+    producer_client = app.get('producer_client')
+    if producer_client:
+        await producer_client.close_session()
+
     # Close the database connection
     await close_pg(app)
 
@@ -96,6 +158,21 @@ def create_app():
 
     app.update(name='consumer', settings=settings)
 
+    # number of searches that this consumer runs at the same time
+    app['slots'] = get_consumer_slots()
+
+    # search queries against the same database with a single nhmmer process
+    if settings.NHMMER_BATCH_SIZE > 1:
+        app['nhmmer_batcher'] = NhmmerBatcher(settings.NHMMER_BATCH_SIZE, settings.NHMMER_BATCH_WINDOW)
+
+    # search queries in-process against database files kept in memory
+    if settings.NHMMER_ENGINE == 'pyhmmer':
+        app['pyhmmer_engine'] = PyhmmerEngine(workers=app['slots'], cpus=settings.SEARCH_CPU)
+
+    # search short queries in the indexes of the database files and prefilter the targets of the other queries
+    if settings.SHORT_QUERY_LENGTH or settings.NHMMER_PREFILTER_SEEDS:
+        app['short_query_engine'] = ShortQueryEngine(workers=app['slots'])
+
     # setup Jinja2 template renderer
     aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader(str(settings.PROJECT_ROOT / 'templates')))
 
@@ -113,8 +190,8 @@ def create_app():
     # setup middlewares
     # setup_middlewares(app)
 
-    # setup aiojobs scheduler
-    setup_aiojobs(app)
+    # setup aiojobs scheduler, bounded by the number of slots so that extra searches wait for a free slot
+    setup_aiojobs(app, limit=app['slots'])
 
     return app
 
@@ -33,7 +33,7 @@ async def infernal_search(sequence, job_id):
         'tblout': os.path.join(INFERNAL_RESULTS_DIR, '%s.tblout' % job_id),
         'rfam_cm': settings.RFAM_CM,
         'cmscan': settings.CMSCAN_EXECUTABLE,
-        'cpu': 4,
+        'cpu': settings.SEARCH_CPU,
     }
 
     # write out query in fasta format
@@ -0,0 +1,100 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import logging
+import uuid
+
+from .nhmmer_parse import nhmmer_split
+from .nhmmer_search import SHORT_QUERY_F3_LENGTH, NhmmerError, nhmmer_batch_search
+from .rnacentral_databases import result_file_path
+from .settings import MAX_RUN_TIME
+
+
+class NhmmerBatcher(object):
+    """
+    Coalesces queries against the same database file into one multi-query nhmmer run.
+
+    The first query for a database opens a batch, which is started when it is full
+    or when the batch window is over. Short queries need different nhmmer options
+    (--F3), so they are batched separately from the longer ones.
+    """
+    def __init__(self, batch_size, window):
+        self.batch_size = batch_size
+        self.window = window
+        self.pending = {}  # (database, short query) -> list of (job_id, sequence, future)
+        self.timers = {}
+
+    async def search(self, job_id, sequence, database):
+        """
+        Waits until the batch with this query is searched.
+
+        :return: path to the nhmmer output of this query, same as in nhmmer_search
+        :raise: asyncio.TimeoutError or NhmmerError if the batch failed
+        """
+        loop = asyncio.get_event_loop()
+        key = (database, len(sequence) < SHORT_QUERY_F3_LENGTH)
+        future = loop.create_future()
+
+        self.pending.setdefault(key, []).append((job_id, sequence, future))
+        if len(self.pending[key]) >= self.batch_size:
+            self.flush(key)
+        elif key not in self.timers:
+            self.timers[key] = loop.call_later(self.window, self.flush, key)
+
+        return await future
+
+    def flush(self, key):
+        """Starts the search of the batch, even if it is not full"""
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+
+        batch = self.pending.pop(key, [])
+        if batch:
+            asyncio.ensure_future(self.run(key[0], batch))
+
+    async def run(self, database, batch):
+        batch_id = 'batch-%s' % uuid.uuid4()
+        filenames = [result_file_path(job_id, database) for job_id, sequence, future in batch]
+
+        logging.debug('Nhmmer batch %s started for %s queries in %s' % (batch_id, len(batch), database))
+
+        try:
+            process, filename = await nhmmer_batch_search(
+                sequences=[sequence for job_id, sequence, future in batch],
+                batch_id=batch_id,
+                database=database
+            )
+
+            try:
+                # nhmmer searches the queries one after another
+                task = asyncio.ensure_future(process.communicate())
+                await asyncio.wait_for(task, MAX_RUN_TIME * len(batch))
+            except asyncio.TimeoutError:
+                process.kill()
+                raise
+
+            if process.returncode != 0:
+                raise NhmmerError("Nhmmer process returned non-zero status code")
+
+            nhmmer_split(filename, filenames)
+        except Exception as e:
+            logging.debug('Nhmmer batch %s failed for %s: %s' % (batch_id, database, e))
+            for job_id, sequence, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (job_id, sequence, future), filename in zip(batch, filenames):
+                if not future.done():
+                    future.set_result(filename)
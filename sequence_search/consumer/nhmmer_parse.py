@@ -214,6 +214,49 @@ def nhmmer_parse(filename="", stats_text='Internal pipeline statistics summary')
             yield data
 
 
+def nhmmer_split(filename, filenames):
+    """
+    Split the output of a multi-query nhmmer search into one file per query.
+
+    Every query block starts with a 'Query:' line and ends with '//'. Each output file
+    gets the header of the search followed by one query block, so it looks exactly like
+    the output of a single-query search and can be read by nhmmer_parse and
+    parse_number_of_hits.
+
+    :param filename: output of nhmmer_batch_search
+    :param filenames: list of files to write, in the same order as the queries
+    """
+    header = []
+    outputs = iter(filenames)
+    output = None
+    blocks = 0
+
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith('Query:'):
+                if output:
+                    output.close()
+                try:
+                    output = open(next(outputs), 'w')
+                except StopIteration:
+                    raise ValueError("Nhmmer output %s has more query blocks than expected" % filename)
+                output.writelines(header)
+                blocks += 1
+            if output:
+                output.write(line)
+                if line.startswith('//'):
+                    output.close()
+                    output = None
+            elif not blocks:
+                header.append(line)
+
+    if output:
+        output.close()
+
+    if blocks != len(filenames):
+        raise ValueError("Nhmmer output %s has fewer query blocks than expected" % filename)
+
+
 def parse_number_of_hits(filename):
     command = "tail -n 10 %s | grep Total" % filename
     total = os.popen(command).read()
@@ -15,18 +15,28 @@ import shlex
 import asyncio.subprocess
 
 from . import settings
+from .query_profile import build_query_profile, copy_query_profile
+from .representatives import representative_file_path, uses_representatives
 from sequence_search.consumer.rnacentral_databases import query_file_path, result_file_path, database_file_path, \
     get_e_value
 
 
+# queries shorter than this are searched with a lower stage 3 (Fwd) threshold, nhmmer --F3 0.02
+SHORT_QUERY_F3_LENGTH = 50
+
+
 class NhmmerError(Exception):
     """Raise when nhmmer exits with a non-zero status"""
     pass
 
 
-async def nhmmer_search(sequence, job_id, database):
-    sequence = sequence.replace('T', 'U').upper()
+def normalize_sequence(sequence):
+    """Converts the query to upper-case RNA"""
+    return sequence.upper().replace('T', 'U')
+
 
+def get_database_e_value(database):
+    """Returns the database size (in Megabases) used for E-value calculations of a database file"""
     try:
         if database.startswith('all-except-rrna') or database.startswith('whitelist-rrna'):
             db_name = None
@@ -35,26 +45,67 @@ async def nhmmer_search(sequence, job_id, database):
     except ValueError:
         db_name = None
 
-    e_value = get_e_value(db_name) if db_name else 11827.54
+    return get_e_value(db_name) if db_name else 11827.54
+
+
+async def write_query(sequences, query):
+    """
+    Writes the query file of a search. With NHMMER_QUERY_PROFILES the query is made of the
+    prebuilt profiles of the sequences, otherwise of the sequences in fasta format.
+
+    :return: True if the query file contains profiles
+    """
+    if settings.NHMMER_QUERY_PROFILES:
+        profiles = [await build_query_profile(sequence) for sequence in sequences]
+        if len(profiles) == 1:
+            copy_query_profile(profiles[0], query)
+        else:
+            with open(query, 'w') as f:
+                for profile in profiles:
+                    with open(profile, 'r') as p:
+                        f.write(p.read())
+        return True
+
+    with open(query, 'w') as f:
+        for sequence in sequences:
+            f.write('>query\n')
+            f.write(sequence)
+            f.write('\n')
+    return False
+
+
+async def run_nhmmer(sequences, query, output, database, targets=None):
+    """
+    Writes the query file and starts nhmmer in the background.
+    All queries are named 'query', nhmmer reports their results in the same order.
+
+    :param sequences: list of query sequences, normalized with normalize_sequence
+    :param query: path to the query file
+    :param output: path to the nhmmer output file
+    :param database: name of the database file to search against
+    :param targets: fasta file with a subset of the database sequences to search instead (optional),
+        the E-values are still calculated for the size of the whole database
+    :return: nhmmer process
+    """
+    # search only the representatives of the clusters of near-identical sequences
+    if targets is None and uses_representatives(database):
+        targets = representative_file_path(database)
 
     params = {
-        'query': query_file_path(job_id, database),
-        'output': result_file_path(job_id, database),
+        'query': query,
+        'output': output,
         'nhmmer': settings.NHMMER_EXECUTABLE,
-        'db': database_file_path(database),
-        'e_value': e_value,
-        'cpu': 4,
-        'f3': '--F3 0.02' if len(sequence) < 50 else ''
+        'db': targets or database_file_path(database),
+        'e_value': get_database_e_value(database),
+        'cpu': settings.SEARCH_CPU,
+        'f3': '--F3 0.02' if min(len(sequence) for sequence in sequences) < SHORT_QUERY_F3_LENGTH else ''
     }
 
-    # write out query in fasta format
-    with open(params['query'], 'w') as f:
-        f.write('>query\n')
-        f.write(sequence)
-        f.write('\n')
+    # write out query, either as profiles or in fasta format
+    params['qformat'] = '' if await write_query(sequences, params['query']) else '--qfasta'
 
     command = ('{nhmmer} '
-               '--qfasta '         # query format
+               '{qformat} '        # query format
                '--tformat fasta '  # target format
                '-o {output} '      # direct main output to a file
                '-T 0 '             # report sequences >= this score threshold in output
@@ -72,4 +123,38 @@ async def nhmmer_search(sequence, job_id, database):
         stderr=asyncio.subprocess.PIPE
     )
 
-    return process, params['output']
+    return process
+
+
+async def nhmmer_search(sequence, job_id, database, targets=None):
+    output = result_file_path(job_id, database)
+    process = await run_nhmmer(
+        sequences=[normalize_sequence(sequence)],
+        query=query_file_path(job_id, database),
+        output=output,
+        database=database,
+        targets=targets
+    )
+
+    return process, output
+
+
+async def nhmmer_batch_search(sequences, batch_id, database):
+    """
+    Searches several queries against the same database with a single nhmmer process,
+    the output has to be split with nhmmer_split.
+
+    :param sequences: list of query sequences
+    :param batch_id: unique id of this batch, used to name the query and output files
+    :param database: name of the database file to search against
+    :return: nhmmer process and the path to its output file
+    """
+    output = result_file_path(batch_id, database)
+    process = await run_nhmmer(
+        sequences=[normalize_sequence(sequence) for sequence in sequences],
+        query=query_file_path(batch_id, database),
+        output=output,
+        database=database
+    )
+
+    return process, output
@@ -0,0 +1,94 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import json
+import logging
+
+import aiohttp
+
+from .settings import ENVIRONMENT, PRODUCER_PROTOCOL, PRODUCER_HOST, PRODUCER_PORT, PRODUCER_JOB_DONE_URL, \
+    PRODUCER_HEARTBEAT_URL, HEARTBEAT_INTERVAL, DISPATCH_MODE
+
+
+class ProducerClient(object):
+    def __init__(self):
+        self.session = None
+        self.job_chunks = set()  # (job_id, database) of the running job chunks, see heartbeat
+
+    async def init_session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+
+    async def close_session(self):
+        if self.session:
+            await self.session.close()
+
+    def job_started(self, job_id, database):
+        """Renews the lease of the job chunk with every heartbeat, until job_done"""
+        self.job_chunks.add((job_id, database))
+
+    async def job_done(self, job_id, database=None):
+        """
+        Tells the producer that this consumer has finished a job and freed its slot, so that
+        it can schedule the next one right away. The producer still checks the consumers periodically,
+        so a failed notification only delays the next job.
+        """
+        self.job_chunks.discard((job_id, database))
+
+        if DISPATCH_MODE == 'pull':
+            # the producer schedules nothing, consumers claim their work themselves
+            return
+
+        url = f"{PRODUCER_PROTOCOL}://{PRODUCER_HOST}:{PRODUCER_PORT}/{PRODUCER_JOB_DONE_URL}"
+        json_data = json.dumps({"job_id": job_id, "database": database})
+        headers = {"content-type": "application/json"}
+
+        logging.debug(f"Notifying producer of a finished job: url = {url}, json_data = {json_data}")
+
+        if ENVIRONMENT == "TEST":
+            return
+
+        await self.init_session()
+        try:
+            async with self.session.post(url, data=json_data, headers=headers, timeout=5) as response:
+                if response.status != 200:
+                    logging.warning(f"Producer returned status {response.status} to {url}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"Failed to notify producer at {url}: {str(e)}")
+
+    async def heartbeat(self, consumer_ip):
+        """
+        Tells the producer that this consumer is alive and still running its job chunks. The producer
+        requeues the job chunks whose lease is not renewed in time, e.g. because the consumer crashed.
+        """
+        url = f"{PRODUCER_PROTOCOL}://{PRODUCER_HOST}:{PRODUCER_PORT}/{PRODUCER_HEARTBEAT_URL}"
+        json_data = json.dumps({"consumer": consumer_ip, "job_chunks": sorted(self.job_chunks)})
+        headers = {"content-type": "application/json"}
+
+        if ENVIRONMENT == "TEST":
+            return
+
+        await self.init_session()
+        try:
+            async with self.session.post(url, data=json_data, headers=headers, timeout=5) as response:
+                if response.status != 200:
+                    logging.warning(f"Producer returned status {response.status} to {url}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"Failed to send a heartbeat to the producer at {url}: {str(e)}")
+
+    async def send_heartbeats(self, consumer_ip):
+        """Sends a heartbeat every HEARTBEAT_INTERVAL seconds"""
+        while True:
+            await self.heartbeat(consumer_ip)
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
@@ -0,0 +1,228 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import datetime
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .nhmmer_parse import parse_alignment
+from .nhmmer_search import SHORT_QUERY_F3_LENGTH, normalize_sequence, get_database_e_value
+from .rnacentral_databases import database_file_path, get_database_files
+
+try:
+    import pyhmmer
+except ImportError:
+    pyhmmer = None
+
+
+# number of alignment columns per block, when the alignment is formatted like in the nhmmer output
+ALIGNMENT_WIDTH = 100
+
+# number of target sequences searched at a time; a cancelled search stops after the block it is searching
+TARGET_BLOCK_SIZE = 20000
+
+
+class PyhmmerError(Exception):
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return str(self.text)
+
+
+class PyhmmerCancelled(PyhmmerError):
+    pass
+
+
+def text(value):
+    """pyhmmer returns names and descriptions as bytes in older versions"""
+    return value.decode() if isinstance(value, bytes) else (value or '')
+
+
+def alignment_lines(alignment, target_name):
+    """
+    Formats a pyhmmer alignment the same way as nhmmer does in its text output,
+    so that it can be read by nhmmer_parse.parse_alignment:
+
+          query  67 gagcggcggacgggugaguaaugccuaggaaucugccugguagugggggauaacgcucgg 126
+                    gagcggcggacgggugaguaaugccuaggaa  ugccu g  gugggggauaac  u gg
+    URS0000000013  41 GAGCGGCGGACGGGUGAGUAAUGCCUAGGAAAUUGCCUUGAUGUGGGGGAUAACCAUUGG 100
+                    789****************************************************** PP
+    """
+    name_width = max(len('query'), len(target_name))
+    number_width = len(str(max(alignment.hmm_to, alignment.target_to)))
+    prefix = 2 + name_width + 1 + number_width + 1
+
+    lines = []
+    query_start, target_start = alignment.hmm_from, alignment.target_from
+    for start in range(0, len(alignment.hmm_sequence), ALIGNMENT_WIDTH):
+        query = alignment.hmm_sequence[start:start + ALIGNMENT_WIDTH]
+        target = alignment.target_sequence[start:start + ALIGNMENT_WIDTH]
+        query_stop = query_start + len(re.sub(r'[.\-]', '', query)) - 1
+        target_stop = target_start + len(re.sub(r'[.\-]', '', target)) - 1
+
+        lines.append('  %s %s %s %s' % ('query'.rjust(name_width), str(query_start).rjust(number_width), query,
+                                        query_stop))
+        lines.append(' ' * prefix + alignment.identity_sequence[start:start + ALIGNMENT_WIDTH])
+        lines.append('  %s %s %s %s' % (target_name.rjust(name_width), str(target_start).rjust(number_width), target,
+                                        target_stop))
+        lines.append(' ' * prefix + (alignment.posterior_probabilities or '')[start:start + ALIGNMENT_WIDTH] + ' PP')
+        lines.append('')
+
+        query_start, target_start = query_stop + 1, target_stop + 1
+
+    return lines
+
+
+def hit_to_result(hit, query_length, result_id):
+    """Converts a pyhmmer hit to a dict with the same keys as nhmmer_parse"""
+    alignment = hit.best_domain.alignment
+    name = text(hit.name)
+
+    match = re.search(r'URS[0-9A-Fa-f]{10}(_\d+)?', name)
+    data = {
+        'rnacentral_id': match.group() if match else name,
+        'description': text(hit.description).replace(';', '').strip(),
+        'score': hit.score,
+        'bias': hit.bias,
+        'e_value': hit.evalue,
+        'alignment_start': float(alignment.target_from),
+        'alignment_stop': float(alignment.target_to),
+        'target_length': alignment.target_length,
+    }
+    data.update(parse_alignment(alignment_lines(alignment, name), data['target_length'], query_length))
+    data['query_length'] = query_length
+    data['result_id'] = result_id
+    return data
+
+
+def search_targets(sequence, targets, database, limit, alphabet, cpus=1, cancelled=None):
+    """
+    Searches a query against a block of digital sequences with the options of nhmmer_search.
+
+    The database size is fixed with Z, so the scores and e-values of the hits are those of a search
+    against the whole database file, even if targets is only a part of it.
+
+    :param cancelled: threading.Event, the search stops at the next block of targets once it is set
+    :return: list of results in the nhmmer_parse format, best hits first, and the total number of hits
+    """
+    query = pyhmmer.easel.TextSequence(name=b'query', sequence=sequence).digitize(alphabet)
+
+    options = {
+        'T': 0,                                          # report sequences >= this score threshold
+        'strand': 'watson',                              # search only top strand
+        'Z': get_database_e_value(database) * 1000000,  # database size; nhmmer -Z is in megabases
+    }
+    if len(sequence) < SHORT_QUERY_F3_LENGTH:
+        options['F3'] = 0.02                             # stage 3 (Fwd) threshold: promote hits w/ P <= F3
+
+    reported = []
+    for start in range(0, len(targets), TARGET_BLOCK_SIZE):
+        if cancelled is not None and cancelled.is_set():
+            raise PyhmmerCancelled("Search of {} cancelled".format(database))
+        block = targets[start:start + TARGET_BLOCK_SIZE]
+        hits = next(iter(pyhmmer.hmmer.nhmmer([query], block, cpus=cpus, **options)))
+        reported.extend(hit for hit in hits if hit.reported)
+
+    reported.sort(key=lambda hit: -hit.score)
+
+    results = []
+    for result_id, hit in enumerate(reported[:limit], start=1):
+        results.append(hit_to_result(hit, len(sequence), result_id))
+
+    return results, len(reported)
+
+
+class PyhmmerEngine(object):
+    """
+    Runs nhmmer searches in-process with pyhmmer.
+
+    Database files are digitized once and kept in memory, queries are searched
+    in a pool of worker threads and the hits are returned as python dicts, so
+    there is no nhmmer process, query file, output file or text parsing per search.
+    """
+    def __init__(self, workers, cpus):
+        if pyhmmer is None:
+            raise PyhmmerError("pyhmmer is not installed, it is required by NHMMER_ENGINE = 'pyhmmer'")
+
+        self.alphabet = pyhmmer.easel.Alphabet.rna()
+        self.cpus = cpus
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.databases = {}
+        self.locks = {}
+
+    def read_database(self, database):
+        """Reads a database file into a block of digital sequences"""
+        with pyhmmer.easel.SequenceFile(
+                str(database_file_path(database)), format='fasta', digital=True, alphabet=self.alphabet) as f:
+            return f.read_block()
+
+    async def get_database(self, database):
+        """Returns the digitized database, reading it only the first time it is used"""
+        if database not in self.databases:
+            lock = self.locks.setdefault(database, asyncio.Lock())
+            async with lock:
+                if database not in self.databases:
+                    t0 = datetime.datetime.now()
+                    loop = asyncio.get_event_loop()
+                    self.databases[database] = await loop.run_in_executor(self.pool, self.read_database, database)
+                    logging.debug("Time - loaded {} into memory in {} seconds".format(
+                        database, (datetime.datetime.now() - t0).total_seconds())
+                    )
+        return self.databases[database]
+
+    async def load(self, prefixes):
+        """
+        Loads the database files assigned to this consumer.
+
+        :param prefixes: list of database file prefixes, e.g. ['all-except-rrna', 'mirbase'];
+            databases that are not preloaded are read on their first search
+        """
+        for file in sorted(get_database_files()):
+            if any(file.name.startswith(prefix) for prefix in prefixes):
+                try:
+                    await self.get_database(file.name)
+                except Exception as e:
+                    logging.error(f"Error loading {file.name} into memory: {str(e)}")
+
+    def run(self, sequence, targets, database, limit, cancelled):
+        return search_targets(sequence, targets, database, limit, self.alphabet, self.cpus, cancelled)
+
+    async def search(self, sequence, database, limit):
+        """
+        Searches a query against a database file.
+
+        If the search is cancelled, e.g. by asyncio.wait_for when it times out, the worker
+        thread stops at the next block of targets and is free for the next search.
+
+        :param sequence: query sequence
+        :param database: name of the database file
+        :param limit: maximum number of results to return
+        :return: list of results in the nhmmer_parse format and the total number of hits
+        """
+        sequence = normalize_sequence(sequence)
+        targets = await self.get_database(database)
+        cancelled = threading.Event()
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self.pool, self.run, sequence, targets, database, limit, cancelled)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        self.databases = {}
@@ -0,0 +1,155 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio.subprocess
+import hashlib
+import logging
+import os
+import shlex
+import shutil
+import time
+import uuid
+
+from . import settings
+
+
+class QueryProfileError(Exception):
+    """Raise when hmmbuild exits with a non-zero status"""
+    pass
+
+
+# hmmbuild runs only once per profile, even if several job chunks ask for it at the same time
+locks = {}
+
+
+def sequence_digest(sequence):
+    """Returns the digest of a normalized query sequence, e.g. 'AAGU' and 'aagt' have the same digest"""
+    return hashlib.md5(sequence.upper().replace('T', 'U').encode()).hexdigest()
+
+
+def profile_file_path(sequence):
+    """Returns the path to the query profile of a sequence"""
+    return os.path.join(settings.PROFILES_DIR, '%s.hmm' % sequence_digest(sequence))
+
+
+async def run_hmmbuild(sequence, profile):
+    """
+    Builds a single-sequence profile with hmmbuild, the same way as nhmmer does for a --qfasta query.
+    The profile is written to a temporary file first and then renamed, so that other job chunks
+    (possibly on other consumers sharing PROFILES_DIR) never read a partially written profile.
+    """
+    os.makedirs(settings.PROFILES_DIR, exist_ok=True)
+    tmp = '%s.%s' % (profile, uuid.uuid4())
+
+    with open(tmp + '.fasta', 'w') as f:
+        f.write('>query\n')
+        f.write(sequence)
+        f.write('\n')
+
+    command = ('{hmmbuild} '
+               '-o /dev/null '     # we don't need the summary output
+               '-n query '         # name the profile 'query', as nhmmer does for a fasta query
+               '--rna '            # explicitly specify query alphabet
+               '--singlemx '       # use a substitution score matrix for a single sequence
+               '--informat afa '   # a single sequence in fasta format is a valid aligned fasta
+               '{profile} '        # output profile
+               '{query}').format(hmmbuild=settings.HMMBUILD_EXECUTABLE, profile=tmp + '.hmm', query=tmp + '.fasta')
+
+    try:
+        process = await asyncio.subprocess.create_subprocess_exec(
+            *shlex.split(command),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        try:
+            task = asyncio.ensure_future(process.communicate())
+            await asyncio.wait_for(task, settings.MAX_RUN_TIME)
+        except asyncio.TimeoutError:
+            process.kill()
+            raise
+
+        if process.returncode != 0:
+            raise QueryProfileError("Hmmbuild process returned non-zero status code")
+
+        os.replace(tmp + '.hmm', profile)
+    finally:
+        for name in (tmp + '.fasta', tmp + '.hmm'):
+            if os.path.isfile(name):
+                os.remove(name)
+
+
+async def build_query_profile(sequence):
+    """
+    Returns the path to the query profile of a sequence, building it only if
+    no other job chunk of the same query has done it yet.
+
+    :param sequence: query sequence, normalized with nhmmer_search.normalize_sequence
+    :return: path to the profile in PROFILES_DIR
+    """
+    profile = profile_file_path(sequence)
+
+    if not os.path.isfile(profile):
+        lock = locks.setdefault(profile, asyncio.Lock())
+        try:
+            async with lock:
+                if not os.path.isfile(profile):
+                    await run_hmmbuild(sequence, profile)
+                    logging.debug('Query profile built: %s' % profile)
+        finally:
+            if not lock.locked():
+                locks.pop(profile, None)
+
+    # mark the profile as used, so that it is not evicted as expired
+    try:
+        os.utime(profile)
+    except FileNotFoundError:
+        # evicted by a job with the same query in the meantime
+        return await build_query_profile(sequence)
+
+    return profile
+
+
+def copy_query_profile(profile, query):
+    """
+    Puts the profile in the query file of a job chunk. A hard link costs nothing and
+    keeps the query readable by nhmmer even if the profile is evicted in the meantime.
+    """
+    try:
+        os.link(profile, query)
+    except OSError:
+        # PROFILES_DIR is on a different file system
+        shutil.copyfile(profile, query)
+
+
+def evict_query_profiles(sequence=None):
+    """
+    Deletes the profile of a finished job and the profiles that have not been used
+    for PROFILE_EXPIRATION seconds, e.g. from jobs that finished on another consumer.
+
+    :param sequence: query sequence of the finished job (optional)
+    """
+    expired = time.time() - settings.PROFILE_EXPIRATION
+    finished = profile_file_path(sequence) if sequence else None
+
+    for name in os.listdir(settings.PROFILES_DIR):
+        if not name.endswith('.hmm'):
+            continue
+
+        path = os.path.join(settings.PROFILES_DIR, name)
+        try:
+            if path == finished or os.path.getmtime(path) < expired:
+                os.remove(path)
+        except FileNotFoundError:
+            # already evicted by another consumer
+            pass
@@ -0,0 +1,216 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import os
+import re
+import shlex
+import subprocess
+
+from . import settings
+from .rnacentral_databases import database_file_path
+
+
+"""
+Redundancy-collapsed databases.
+
+Near-identical sequences (e.g. SILVA/ENA rRNA) are clustered with cd-hit-est and nhmmer first
+searches the representative of each cluster. The members of the clusters of the representatives
+that have hits are then fetched from the database file with esl-sfetch and searched with nhmmer,
+so that every member hit has its own alignment, score and e-value.
+
+The representative files are kept in a subfolder of the databases folder, so that they are
+not picked up by get_database_files. Build them with:
+
+python3 -m sequence_search.consumer.representatives all-except-rrna-1.fasta whitelist-rrna-1.fasta
+"""
+
+
+# members of each representative: {database: {representative: [(member, identity, description)]}}
+members = {}
+
+
+def representative_file_path(database):
+    """Returns path to the fasta file with the representatives of a database file"""
+    return database_file_path(database).parent / 'representatives' / database
+
+
+def member_file_path(database):
+    """Returns path to the file with the cluster members of a database file"""
+    return database_file_path(database).parent / 'representatives' / ('%s.members' % database)
+
+
+def uses_representatives(database):
+    """Returns True if nhmmer searches the representatives instead of the whole database file"""
+    return settings.NHMMER_REPRESENTATIVES and os.path.isfile(representative_file_path(database)) \
+        and os.path.isfile(member_file_path(database))
+
+
+def parse_clusters(filename):
+    """
+    Parses a cd-hit .clstr file and yields (representative, [(member, identity)]) for every cluster.
+
+    Example:
+>Cluster 0
+0	1421nt, >URS0000000013_1234... *
+1	1400nt, >URS0000000014_5678... at +/98.50%
+    """
+    representative, cluster = None, []
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith('>Cluster'):
+                if representative:
+                    yield representative, cluster
+                representative, cluster = None, []
+                continue
+
+            match = re.search(r'>(\S+?)\.\.\. (\*|at (?:[+-]/)?([\d.]+)%)', line)
+            if not match:
+                continue
+            if match.group(2) == '*':
+                representative = match.group(1)
+            else:
+                cluster.append((match.group(1), float(match.group(3))))
+
+    if representative:
+        yield representative, cluster
+
+
+def read_descriptions(filename):
+    """Returns {name: description} of all sequences of a fasta file"""
+    descriptions = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith('>'):
+                header = line[1:].strip().split(None, 1)
+                if header:
+                    descriptions[header[0]] = header[1] if len(header) > 1 else ''
+    return descriptions
+
+
+def write_members(clusters, descriptions, filename):
+    """Writes one tab-separated line per member: representative, member, identity, description"""
+    with open(filename, 'w') as f:
+        for representative, cluster in clusters:
+            for member, identity in cluster:
+                f.write('%s\t%s\t%s\t%s\n' % (representative, member, identity, descriptions.get(member, '')))
+
+
+def build_representatives(database):
+    """Clusters a database file with cd-hit-est and writes the representatives and the member map"""
+    output = representative_file_path(database)
+    os.makedirs(output.parent, exist_ok=True)
+
+    command = ('{cd_hit} '
+               '-i {db} '          # input fasta file
+               '-o {output} '      # output fasta file with the representatives
+               '-c {identity} '    # sequence identity threshold
+               '-n 10 '            # word length, recommended for identity >= 0.95
+               '-d 0 '             # keep the full sequence names in the .clstr file
+               '-M 0 '             # no memory limit
+               '-T 0').format(     # use all CPUs
+        cd_hit=settings.CD_HIT_EXECUTABLE,
+        db=database_file_path(database),
+        output=output,
+        identity=settings.REPRESENTATIVE_IDENTITY
+    )
+    subprocess.run(shlex.split(command), check=True, stdout=subprocess.DEVNULL)
+
+    clusters = '%s.clstr' % output
+    write_members(parse_clusters(clusters), read_descriptions(database_file_path(database)), member_file_path(database))
+    os.remove(clusters)
+
+    # index the database file, so that the members can be fetched by name, see fetch_members
+    command = '{esl_sfetch} --index {db}'.format(
+        esl_sfetch=settings.ESL_SFETCH_EXECUTABLE,
+        db=database_file_path(database)
+    )
+    subprocess.run(shlex.split(command), check=True, stdout=subprocess.DEVNULL)
+
+
+def load_members(database):
+    """Returns the members of each representative of a database file, reading the member map only once"""
+    if database not in members:
+        data = {}
+        with open(member_file_path(database), 'r') as f:
+            for line in f:
+                representative, member, identity, description = line.rstrip('\n').split('\t', 3)
+                data.setdefault(representative, []).append((member, float(identity), description))
+        members[database] = data
+    return members[database]
+
+
+def cluster_members(database, results):
+    """Returns the names of the members of the clusters of the representatives found by nhmmer"""
+    clusters = load_members(database)
+    names = []
+    for result in results:
+        names.extend(member for member, identity, description in clusters.get(result['rnacentral_id'], []))
+    return names
+
+
+async def fetch_members(database, names, filename):
+    """Writes the given members of the clusters of a database file to a fasta file, to be searched by nhmmer"""
+    with open('%s.names' % filename, 'w') as f:
+        f.write(''.join('%s\n' % name for name in names))
+
+    command = '{esl_sfetch} -o {output} -f {db} {names}'.format(
+        esl_sfetch=settings.ESL_SFETCH_EXECUTABLE,
+        output=filename,
+        db=database_file_path(database),
+        names='%s.names' % filename
+    )
+    try:
+        process = await asyncio.subprocess.create_subprocess_exec(
+            *shlex.split(command),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError('esl-sfetch failed to fetch the members of %s: %s' % (database, stderr.decode()))
+    finally:
+        os.remove('%s.names' % filename)
+
+
+def merge_results(results, hits, member_results, member_hits):
+    """
+    Merges the results of the representatives with the results of the members of their clusters.
+
+    :param results: list of results of the representatives in the nhmmer_parse format
+    :param hits: total number of hits of the representatives reported by nhmmer
+    :param member_results: list of results of the members in the nhmmer_parse format
+    :param member_hits: total number of hits of the members reported by nhmmer
+    :return: results ordered by e-value (up to NHMMER_LIMIT) and total number of hits
+    """
+    merged = sorted(results + member_results, key=lambda result: result['e_value'])[:settings.NHMMER_LIMIT]
+    for result_id, result in enumerate(merged, start=1):
+        result['result_id'] = result_id
+
+    try:
+        hits = int(hits) + int(member_hits)
+    except (TypeError, ValueError):
+        pass
+
+    return merged, hits
+
+
+if __name__ == "__main__":
+    """Build the representatives of the given database files"""
+    import sys
+    if len(sys.argv) < 2:
+        print('Provide the names of the database files to cluster')
+        sys.exit(1)
+    for database in sys.argv[1:]:
+        build_representatives(database)
+        print('Clustered %s' % database)
@@ -127,6 +127,11 @@ def query_file_path(job_id, database):
     return os.path.join(QUERY_DIR, '%s_%s' % (job_id, database))
 
 
+def target_file_path(job_id, database):
+    """Returns path to the file with the prefiltered target sequences (or cluster members) of an nhmmer search"""
+    return os.path.join(QUERY_DIR, '%s_%s.targets' % (job_id, database))
+
+
 def result_file_path(job_id, database):
     """Returns path to the file with nhmmer search results"""
     return os.path.join(RESULTS_DIR, '%s_%s' % (job_id, database))
@@ -140,6 +145,19 @@ def database_file_path(database):
     return PROJECT_ROOT / 'databases' / database
 
 
+def database_release(database):
+    """
+    Returns a fingerprint of a database file (size and modification time) that changes
+    whenever the file is replaced, e.g. by a new RNAcentral release.
+    Returns None if the file does not exist.
+    """
+    try:
+        stat = os.stat(database_file_path(database))
+    except OSError:
+        return None
+    return '%s-%s' % (stat.st_size, int(stat.st_mtime))
+
+
 def get_e_value(database):
     """Return the e-value for a specific database"""
     e_value = None
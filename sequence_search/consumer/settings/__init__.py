@@ -40,6 +40,61 @@ EXPIRATION = 60 * 60 * 24 * 7  # seconds
 # maximum time to run nhmmer
 MAX_RUN_TIME = 5 * 60  # seconds
 
+# number of CPUs used by each nhmmer or cmscan process
+SEARCH_CPU = 4
+
+# memory reserved for each nhmmer or cmscan process
+SEARCH_MEMORY = 4 * 1024 ** 3  # bytes
+
+# number of searches the consumer runs concurrently; 0 means infer it from cores and memory
+CONSUMER_SLOTS = 0
+
+# maximum number of queries against the same database searched by one nhmmer process; 1 disables batching
+NHMMER_BATCH_SIZE = 1
+
+# how long a query waits for other queries against the same database before the batch is started
+NHMMER_BATCH_WINDOW = 0.5  # seconds
+
+# build the query profile with hmmbuild once per job and search all database chunks with it
+NHMMER_QUERY_PROFILES = False
+
+# query profiles that have not been used for this long are deleted
+PROFILE_EXPIRATION = 60 * 60  # seconds
+
+# queries shorter than this are searched only against the sequences that share a seed with them,
+# in the database files that have an index (see short_query_index)
+SHORT_QUERY_LENGTH = 50
+
+# search short queries against the whole database if the sequences selected by the index have no hits
+SHORT_QUERY_FALLBACK = True
+
+# nhmmer searches only the sequences that share at least this many seeds with the query,
+# in the databases that have an index (see short_query_index); 0 searches the whole database
+NHMMER_PREFILTER_SEEDS = 0
+
+# search the representatives of the clusters of near-identical sequences first, in the database files
+# that have them (see representatives), and then only the members of the clusters with hits
+NHMMER_REPRESENTATIVES = False
+
+# minimum identity of the members of a cluster to its representative
+REPRESENTATIVE_IDENTITY = 0.97
+
+# how nhmmer searches are run: 'nhmmer' starts a process per search, 'pyhmmer' searches in-process
+NHMMER_ENGINE = 'nhmmer'
+
+# comma-separated prefixes of the database files that the pyhmmer engine loads into memory on startup
+PYHMMER_DATABASES = ''
+
+# how the consumer gets its work: 'push' waits for the producer to submit it, 'pull' claims it from the database
+DISPATCH_MODE = 'push'
+
+# maximum number of seconds between two claims of a consumer in pull mode that finds nothing to do
+PULL_INTERVAL = 2.0
+
+# seconds between two heartbeats, that renew the leases of the running job chunks on the producer
+# (see the LEASE_DURATION of the producer)
+HEARTBEAT_INTERVAL = 15
+
 ENVIRONMENT = os.getenv('ENVIRONMENT', 'LOCAL')
 
 # add settings from environment-specific files
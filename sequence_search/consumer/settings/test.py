@@ -16,6 +16,9 @@ INFERNAL_RESULTS_DIR = PROJECT_ROOT / '.tmp' / 'infernal-results'
 # full path to infernal query files
 INFERNAL_QUERY_DIR = PROJECT_ROOT / '.tmp' / 'infernal-queries'
 
+# full path to query profiles, can be a scratch space shared by the consumers
+PROFILES_DIR = PROJECT_ROOT / '.tmp' / 'profiles'
+
 # full path to the rfam.cm
 RFAM_CM = PROJECT_ROOT / 'rfam' / 'Rfam.cm'
 
@@ -27,10 +30,20 @@ PRODUCER_PROTOCOL = 'http'
 PRODUCER_HOST = 'localhost'
 PRODUCER_PORT = '8002'
 PRODUCER_JOB_DONE_URL = 'api/job-done'
+PRODUCER_HEARTBEAT_URL = 'api/job-chunk-heartbeat'
 
 # full path to nhmmer executable
 NHMMER_EXECUTABLE = 'nhmmer'
 
+# full path to hmmbuild executable
+HMMBUILD_EXECUTABLE = 'hmmbuild'
+
+# full path to cd-hit-est executable, used to build the representative databases
+CD_HIT_EXECUTABLE = 'cd-hit-est'
+
+# full path to esl-sfetch executable, used to fetch the cluster members of the representative databases
+ESL_SFETCH_EXECUTABLE = 'esl-sfetch'
+
 # full path to cmscan executable
 CMSCAN_EXECUTABLE = 'cmscan'
 
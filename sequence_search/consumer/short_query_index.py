@@ -0,0 +1,329 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import bisect
+import datetime
+import logging
+import mmap
+import os
+import struct
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from . import settings
+from .nhmmer_search import normalize_sequence
+from .pyhmmer_search import pyhmmer, search_targets
+from .rnacentral_databases import database_file_path
+
+
+# length of the seeds (k-mers) stored in the index
+SEED_LENGTH = 10
+
+# 2-bit encoding of the nucleotides, seeds with any other character are not indexed
+ENCODING = {'A': 0, 'C': 1, 'G': 2, 'U': 3}
+
+# separates the database sequences in the concatenated text of the index
+SEPARATOR = '$'
+
+# index file header: magic, number of sequences, length of the text, length of the headers, number of positions
+HEADER = struct.Struct('<8sQQQQ')
+MAGIC = b'SQINDEX1'
+
+
+def index_file_path(database):
+    """Returns path to the short query index of a database file (e.g. mirbase.fasta.idx)"""
+    return str(database_file_path(database)) + '.idx'
+
+
+def read_fasta(filename):
+    """Yields (name, description, sequence) for every entry of a fasta file"""
+    name, description, sequence = None, '', []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('>'):
+                if name is not None:
+                    yield name, description, ''.join(sequence)
+                header = line[1:].split(None, 1)
+                name = header[0] if header else ''
+                description = header[1] if len(header) > 1 else ''
+                sequence = []
+            else:
+                sequence.append(line.strip())
+    if name is not None:
+        yield name, description, ''.join(sequence)
+
+
+def seeds(text):
+    """Yields (position, code) of every seed in the text that consists of A, C, G and U only"""
+    mask = 4 ** SEED_LENGTH
+    code, valid = 0, 0
+    for position, char in enumerate(text):
+        value = ENCODING.get(char)
+        if value is None:
+            code, valid = 0, 0
+            continue
+        code = (code * 4 + value) % mask
+        valid += 1
+        if valid >= SEED_LENGTH:
+            yield position - SEED_LENGTH + 1, code
+
+
+def padding(length):
+    """Number of bytes after a section of the index file so that the next one is 8-byte aligned"""
+    return -length % 8
+
+
+class ShortQueryIndex(object):
+    """
+    Seed index of a database file, that selects the database sequences worth searching for a query.
+
+    All database sequences are concatenated in a single text; for every seed code,
+    positions[offsets[code]:offsets[code + 1]] are the positions of that seed in the text.
+    headers[header_starts[entry]:header_starts[entry + 1]] is the fasta header of a sequence.
+
+    Short queries are searched with nhmmer (see pyhmmer_search.search_targets) only against the
+    sequences that share a seed with them, so their hits have the scores and e-values of nhmmer.
+    The same index selects the candidate targets of longer queries for nhmmer, see candidates.
+
+    The index file is memory-mapped: only the pages of the seeds and sequences of the searched
+    queries are read, and they are shared by all the processes that use the index.
+    """
+    def __init__(self, starts, text, header_starts, headers, offsets, positions):
+        self.starts = starts
+        self.text = text
+        self.header_starts = header_starts
+        self.headers = headers
+        self.offsets = offsets
+        self.positions = positions
+
+    @classmethod
+    def build(cls, filename):
+        starts, header_starts, sequences, headers = array('I'), array('I', [0]), [], []
+        length, headers_length = 0, 0
+        for name, description, sequence in read_fasta(filename):
+            header = ('%s %s' % (name, description)).strip().encode()
+            headers.append(header)
+            headers_length += len(header)
+            header_starts.append(headers_length)
+            sequences.append(normalize_sequence(sequence))
+            starts.append(length)
+            length += len(sequence) + 1
+        text = SEPARATOR.join(sequences) + SEPARATOR
+        if len(text) >= 2 ** 32:
+            raise ValueError('%s is too large for a short query index, split it in smaller files' % filename)
+
+        # counting sort of the seed positions by seed code
+        offsets = array('I', [0]) * (4 ** SEED_LENGTH + 1)
+        for position, code in seeds(text):
+            offsets[code + 1] += 1
+        for code in range(1, len(offsets)):
+            offsets[code] += offsets[code - 1]
+
+        positions = array('I', [0]) * offsets[-1]
+        fill = array('I', offsets)
+        for position, code in seeds(text):
+            positions[fill[code]] = position
+            fill[code] += 1
+
+        return cls(starts, text.encode(), header_starts, b''.join(headers), offsets, positions)
+
+    @classmethod
+    def load(cls, filename):
+        """Memory-maps an index file written by save"""
+        with open(filename, 'rb') as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        magic, entries, text_length, headers_length, positions_length = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError('%s is not a short query index, build it again' % filename)
+
+        sections = []
+        start = HEADER.size
+        for length, typecode in [(4 ** SEED_LENGTH + 1, 'I'), (positions_length, 'I'), (entries, 'I'),
+                                 (entries + 1, 'I'), (text_length, 'B'), (headers_length, 'B')]:
+            size = length * array(typecode).itemsize
+            sections.append(view[start:start + size].cast(typecode))
+            start += size + padding(size)
+
+        offsets, positions, starts, header_starts, text, headers = sections
+        return cls(starts, text, header_starts, headers, offsets, positions)
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self.starts), len(self.text), len(self.headers), len(self.positions)))
+            f.write(b'\0' * padding(HEADER.size))
+            for section in [self.offsets, self.positions, self.starts, self.header_starts]:
+                section.tofile(f)
+                f.write(b'\0' * padding(len(section) * section.itemsize))
+            for section in [self.text, self.headers]:
+                f.write(section)
+                f.write(b'\0' * padding(len(section)))
+
+    def entry_end(self, entry):
+        """Returns the position of the separator after a database sequence"""
+        return (self.starts[entry + 1] if entry + 1 < len(self.starts) else len(self.text)) - 1
+
+    def sequence(self, entry):
+        return bytes(self.text[self.starts[entry]:self.entry_end(entry)]).decode()
+
+    def header(self, entry):
+        """Returns the name and the description of a database sequence"""
+        header = bytes(self.headers[self.header_starts[entry]:self.header_starts[entry + 1]]).decode().split(' ', 1)
+        return header[0], header[1] if len(header) > 1 else ''
+
+    def candidates(self, query, min_seeds):
+        """
+        Returns the database sequences that share at least min_seeds distinct seeds with the query
+        (or all the seeds of the query, if it has fewer), in the database order.
+        Returns None if the query has no seeds, so that it is searched against all sequences.
+        """
+        codes = set(code for position, code in seeds(query))
+        if not codes:
+            return None
+
+        counts = {}
+        for code in codes:
+            entries = set(bisect.bisect_right(self.starts, position) - 1
+                          for position in self.positions[self.offsets[code]:self.offsets[code + 1]])
+            for entry in entries:
+                counts[entry] = counts.get(entry, 0) + 1
+
+        min_seeds = min(min_seeds, len(codes))
+        return sorted(entry for entry, count in counts.items() if count >= min_seeds)
+
+    def write_fasta(self, entries, filename):
+        """Writes the given database sequences to a fasta file"""
+        with open(filename, 'w') as f:
+            for entry in entries:
+                f.write('>%s %s\n' % self.header(entry))
+                f.write(self.sequence(entry))
+                f.write('\n')
+
+    def digital_block(self, entries, alphabet):
+        """Returns the given database sequences as a pyhmmer block of digital sequences"""
+        sequences = []
+        for entry in entries:
+            name, description = self.header(entry)
+            sequence = pyhmmer.easel.TextSequence(
+                name=name.encode(), description=description.encode(), sequence=self.sequence(entry)
+            )
+            sequences.append(sequence.digitize(alphabet))
+        return pyhmmer.easel.DigitalSequenceBlock(alphabet, sequences)
+
+    def search(self, sequence, database, limit, alphabet, cancelled=None):
+        """
+        Searches the query with nhmmer against the database sequences that share a seed with it.
+
+        :return: list of results in the nhmmer_parse format, best hits first, and the total number of hits
+        """
+        query = normalize_sequence(sequence)
+        entries = self.candidates(query, 1)
+        if not entries:
+            return [], 0
+        return search_targets(query, self.digital_block(entries, alphabet), database, limit, alphabet,
+                              cancelled=cancelled)
+
+
+class ShortQueryEngine(object):
+    """
+    Searches short queries in the precomputed indexes of the database files
+    and prefilters the targets of the other queries, see ShortQueryIndex.
+    Databases without an index are searched with nhmmer as usual.
+    """
+    def __init__(self, workers):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.alphabet = pyhmmer.easel.Alphabet.rna() if pyhmmer is not None else None
+        self.indexes = {}
+        self.locks = {}
+
+    def accepts(self, sequence, database):
+        """Returns True if the query is short enough and the database has been indexed"""
+        return self.alphabet is not None and len(sequence) < settings.SHORT_QUERY_LENGTH \
+            and os.path.isfile(index_file_path(database))
+
+    async def get_index(self, database):
+        """Returns the index of a database, loading it only the first time it is used"""
+        if database not in self.indexes:
+            lock = self.locks.setdefault(database, asyncio.Lock())
+            async with lock:
+                if database not in self.indexes:
+                    t0 = datetime.datetime.now()
+                    loop = asyncio.get_event_loop()
+                    self.indexes[database] = await loop.run_in_executor(
+                        self.pool, ShortQueryIndex.load, index_file_path(database)
+                    )
+                    logging.debug("Time - loaded the index of {} in {} seconds".format(
+                        database, (datetime.datetime.now() - t0).total_seconds())
+                    )
+        return self.indexes[database]
+
+    def prefilters(self, database):
+        """Returns True if the targets of nhmmer searches against the database can be prefiltered"""
+        return settings.NHMMER_PREFILTER_SEEDS > 0 and os.path.isfile(index_file_path(database))
+
+    async def prefilter(self, sequence, database, filename):
+        """
+        Writes the database sequences that share at least NHMMER_PREFILTER_SEEDS seeds with
+        the query to a fasta file, to be searched by nhmmer instead of the whole database.
+
+        :return: number of candidate sequences, None if the query can't be prefiltered
+        """
+        index = await self.get_index(database)
+        loop = asyncio.get_event_loop()
+
+        def write_candidates():
+            entries = index.candidates(normalize_sequence(sequence), settings.NHMMER_PREFILTER_SEEDS)
+            if entries is None:
+                return None
+            index.write_fasta(entries, filename)
+            return len(entries)
+
+        return await loop.run_in_executor(self.pool, write_candidates)
+
+    async def search(self, sequence, database, limit):
+        """
+        Searches a query against the database sequences selected by the index of a database file.
+
+        :param sequence: query sequence
+        :param database: name of the database file
+        :param limit: maximum number of results to return
+        :return: list of results in the nhmmer_parse format and the total number of hits
+        """
+        index = await self.get_index(database)
+        cancelled = threading.Event()
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(
+                self.pool, index.search, sequence, database, limit, self.alphabet, cancelled
+            )
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        self.indexes = {}
+
+
+if __name__ == "__main__":
+    """Precompute the indexes, e.g. python3 -m sequence_search.consumer.short_query_index mirbase.fasta"""
+    import sys
+    if len(sys.argv) < 2:
+        print('Provide the names of the database files to index')
+        sys.exit(1)
+    for database in sys.argv[1:]:
+        ShortQueryIndex.build(database_file_path(database)).save(index_file_path(database))
+        print('Indexed %s' % database)
@@ -0,0 +1,44 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+
+from . import settings
+
+
+def get_total_memory():
+    """Returns the physical memory of this machine in bytes, or None if it can't be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_consumer_slots(cpu_count=None, memory=None):
+    """
+    Number of nhmmer/cmscan processes this consumer can run at the same time.
+
+    Uses CONSUMER_SLOTS if it is set, otherwise each slot needs SEARCH_CPU cores
+    and SEARCH_MEMORY bytes of memory. A consumer always has at least one slot.
+    """
+    if settings.CONSUMER_SLOTS:
+        return settings.CONSUMER_SLOTS
+
+    cpu_count = cpu_count if cpu_count is not None else os.cpu_count() or 1
+    memory = memory if memory is not None else get_total_memory()
+
+    slots = cpu_count // settings.SEARCH_CPU
+    if memory:
+        slots = min(slots, memory // settings.SEARCH_MEMORY)
+
+    return max(1, slots)
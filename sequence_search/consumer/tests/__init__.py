@@ -15,3 +15,9 @@ from sequence_search.consumer.tests.test_submit_infernal_job import SubmitInfern
 from sequence_search.consumer.tests.test_infernal_parse import InfernalParseTestCase
 from sequence_search.consumer.tests.test_infernal_deoverlap import InfernalDeoverlapTestCase
 from sequence_search.consumer.tests.test_rnacentral_databases import TestProducerToConsumersDatabases
+from sequence_search.consumer.tests.test_slots import GetConsumerSlotsTestCase
+from sequence_search.consumer.tests.test_nhmmer_parse import NhmmerSplitTestCase
+from sequence_search.consumer.tests.test_pyhmmer_search import AlignmentLinesTestCase, PyhmmerEngineTestCase
+from sequence_search.consumer.tests.test_query_profile import QueryProfileTestCase
+from sequence_search.consumer.tests.test_short_query_index import ShortQueryIndexTestCase
+from sequence_search.consumer.tests.test_representatives import RepresentativesTestCase
@@ -0,0 +1,49 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import tempfile
+import unittest
+
+from sequence_search.consumer.nhmmer_parse import nhmmer_parse, nhmmer_split, parse_number_of_hits
+from sequence_search.consumer.settings.__init__ import PROJECT_ROOT
+
+
+class NhmmerSplitTestCase(unittest.TestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.consumer.tests.test_nhmmer_parse
+    """
+    def setUp(self):
+        self.filename = PROJECT_ROOT / 'tests' / 'nhmmer_batch_file'
+        self.directory = tempfile.TemporaryDirectory()
+        self.filenames = [os.path.join(self.directory.name, name) for name in ('job1', 'job2')]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_nhmmer_split(self):
+        nhmmer_split(self.filename, self.filenames)
+
+        results = list(nhmmer_parse(filename=self.filenames[0]))
+        assert len(results) == 1
+        assert results[0]['rnacentral_id'] == 'URS000075A546_9606'
+        assert results[0]['query_length'] == 22
+        assert 'Total number of hits:                      1' in parse_number_of_hits(self.filenames[0])
+
+        assert list(nhmmer_parse(filename=self.filenames[1])) == []
+        assert 'Total number of hits:                      0' in parse_number_of_hits(self.filenames[1])
+
+    def test_nhmmer_split_missing_query(self):
+        with self.assertRaises(ValueError):
+            nhmmer_split(self.filename, self.filenames + [os.path.join(self.directory.name, 'job3')])
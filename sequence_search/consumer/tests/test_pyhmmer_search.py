@@ -0,0 +1,93 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import threading
+import unittest
+from collections import namedtuple
+
+from sequence_search.consumer.nhmmer_parse import parse_alignment
+from sequence_search.consumer.pyhmmer_search import alignment_lines, pyhmmer, PyhmmerCancelled, PyhmmerEngine
+
+Alignment = namedtuple('Alignment', [
+    'hmm_from', 'hmm_to', 'hmm_sequence', 'target_from', 'target_to', 'target_sequence',
+    'identity_sequence', 'posterior_probabilities'
+])
+
+
+class AlignmentLinesTestCase(unittest.TestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.consumer.tests.test_pyhmmer_search
+    """
+    def setUp(self):
+        self.alignment = Alignment(
+            hmm_from=1,
+            hmm_to=12,
+            hmm_sequence='gagcgg.cggacg',
+            target_from=41,
+            target_to=53,
+            target_sequence='GAGCGGACGGAUG',
+            identity_sequence='gagcgg cggacg',
+            posterior_probabilities='789**********',
+        )
+
+    def test_alignment_lines(self):
+        lines = alignment_lines(self.alignment, 'URS0000000013')
+        assert lines[0] == '          query  1 gagcgg.cggacg 12'
+        assert lines[2] == '  URS0000000013 41 GAGCGGACGGAUG 53'
+        assert lines[3].endswith(' 789********** PP')
+        assert lines[4] == ''
+
+    def test_alignment_lines_are_parsed_as_nhmmer_output(self):
+        data = parse_alignment(alignment_lines(self.alignment, 'URS0000000013'), 100, 12)
+        assert data['alignment_length'] == 13
+        assert data['nts_count1'] == 12
+        assert data['nts_count2'] == 13
+        assert data['gap_count'] == 1
+        assert data['match_count'] == 12
+        assert data['alignment_sequence'] == 'GAGCGGACGGAUG'
+
+    def test_long_alignment_is_split_in_blocks(self):
+        alignment = self.alignment._replace(
+            hmm_to=240, hmm_sequence='a' * 240, target_to=280, target_sequence='A' * 240,
+            identity_sequence='a' * 240, posterior_probabilities='*' * 240
+        )
+        lines = alignment_lines(alignment, 'URS0000000013')
+        assert len(lines) == 15
+        assert lines[5].split()[:2] == ['query', '101']
+        assert lines[7].split()[:2] == ['URS0000000013', '141']
+        assert lines[12].split()[-1] == '280'
+
+
+@unittest.skipIf(pyhmmer is None, 'pyhmmer is not installed')
+class PyhmmerEngineTestCase(unittest.TestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.consumer.tests.test_pyhmmer_search.PyhmmerEngineTestCase
+    """
+    def setUp(self):
+        self.engine = PyhmmerEngine(workers=1, cpus=1)
+        sequence = pyhmmer.easel.TextSequence(name=b'URS0000000013', sequence='GAGCGGCGGACGGGUGAGUAAUGCCUAGGAA')
+        self.targets = pyhmmer.easel.DigitalSequenceBlock(
+            self.engine.alphabet, [sequence.digitize(self.engine.alphabet)]
+        )
+
+    def tearDown(self):
+        self.engine.close()
+
+    def test_cancelled_search_stops(self):
+        cancelled = threading.Event()
+        cancelled.set()
+        with self.assertRaises(PyhmmerCancelled):
+            self.engine.run('GAGCGGCGGACGGGUGAGUAAUGCCUAGGAA', self.targets, 'mirbase-1.fasta', 10, cancelled)
@@ -0,0 +1,65 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import tempfile
+import time
+import unittest
+
+from sequence_search.consumer import settings
+from sequence_search.consumer.query_profile import sequence_digest, profile_file_path, evict_query_profiles
+
+
+class QueryProfileTestCase(unittest.TestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.consumer.tests.test_query_profile
+    """
+    def setUp(self):
+        self.profiles_dir = settings.PROFILES_DIR
+        self.tmp = tempfile.TemporaryDirectory()
+        settings.PROFILES_DIR = self.tmp.name
+
+    def tearDown(self):
+        settings.PROFILES_DIR = self.profiles_dir
+        self.tmp.cleanup()
+
+    def touch(self, path, age=0):
+        with open(path, 'w') as f:
+            f.write('HMMER3/f\n')
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+    def test_sequence_digest_of_normalized_sequence(self):
+        assert sequence_digest('aagtc') == sequence_digest('AAGUC')
+        assert sequence_digest('AAGUC') != sequence_digest('AAGUCA')
+
+    def test_evict_finished_job_profile(self):
+        finished = profile_file_path('AAGUC')
+        running = profile_file_path('CCGUA')
+        self.touch(finished)
+        self.touch(running)
+
+        evict_query_profiles('AAGUC')
+        assert not os.path.exists(finished)
+        assert os.path.exists(running)
+
+    def test_evict_expired_profiles(self):
+        expired = profile_file_path('AAGUC')
+        self.touch(expired, age=settings.PROFILE_EXPIRATION + 60)
+        other = os.path.join(self.tmp.name, '.gitignore')
+        self.touch(other, age=settings.PROFILE_EXPIRATION + 60)
+
+        evict_query_profiles()
+        assert not os.path.exists(expired)
+        assert os.path.exists(other)
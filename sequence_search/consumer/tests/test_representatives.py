@@ -0,0 +1,85 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import tempfile
+import unittest
+
+from sequence_search.consumer import representatives
+from sequence_search.consumer.representatives import parse_clusters, write_members, cluster_members, merge_results
+
+CLUSTERS = """>Cluster 0
+0	1421nt, >URS0000000013_1234... *
+1	1400nt, >URS0000000014_5678... at +/98.50%
+2	1380nt, >URS0000000015_5678... at +/97.10%
+>Cluster 1
+0	900nt, >URS0000000016_9606... *
+"""
+
+
+class RepresentativesTestCase(unittest.TestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.consumer.tests.test_representatives
+    """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.clusters = os.path.join(self.tmp.name, 'all-except-rrna-1.fasta.clstr')
+        with open(self.clusters, 'w') as f:
+            f.write(CLUSTERS)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        representatives.members.pop('all-except-rrna-1.fasta', None)
+
+    def test_parse_clusters(self):
+        assert list(parse_clusters(self.clusters)) == [
+            ('URS0000000013_1234', [('URS0000000014_5678', 98.5), ('URS0000000015_5678', 97.1)]),
+            ('URS0000000016_9606', []),
+        ]
+
+    def test_cluster_members(self):
+        filename = os.path.join(self.tmp.name, 'all-except-rrna-1.fasta.members')
+        descriptions = {'URS0000000014_5678': 'Vibrio sp. 16S rRNA', 'URS0000000015_5678': 'Vibrio sp.; 16S rRNA'}
+        write_members(parse_clusters(self.clusters), descriptions, filename)
+
+        representatives.members.pop('all-except-rrna-1.fasta', None)
+        original = representatives.member_file_path
+        representatives.member_file_path = lambda database: filename
+        try:
+            names = cluster_members('all-except-rrna-1.fasta', [
+                {'rnacentral_id': 'URS0000000016_9606'},
+                {'rnacentral_id': 'URS0000000013_1234'},
+            ])
+        finally:
+            representatives.member_file_path = original
+
+        assert names == ['URS0000000014_5678', 'URS0000000015_5678']
+
+    def test_merge_results(self):
+        results, hits = merge_results(
+            [
+                {'rnacentral_id': 'URS0000000016_9606', 'e_value': 1e-30, 'result_id': 1},
+                {'rnacentral_id': 'URS0000000013_1234', 'e_value': 1e-20, 'result_id': 2},
+            ], '2',
+            [
+                {'rnacentral_id': 'URS0000000015_5678', 'e_value': 1e-10, 'result_id': 1},
+                {'rnacentral_id': 'URS0000000014_5678', 'e_value': 1e-25, 'result_id': 2},
+            ], '2'
+        )
+
+        assert hits == 4
+        assert [result['rnacentral_id'] for result in results] == [
+            'URS0000000016_9606', 'URS0000000014_5678', 'URS0000000013_1234', 'URS0000000015_5678'
+        ]
+        assert [result['result_id'] for result in results] == [1, 2, 3, 4]
@@ -0,0 +1,89 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import tempfile
+import unittest
+
+from sequence_search.consumer.pyhmmer_search import pyhmmer
+from sequence_search.consumer.short_query_index import ShortQueryIndex
+
+DATABASE = """>URS0000000001_9606 Homo sapiens hsa-mir-1
+AAAAGGTCGGAGCGAGGCAAAATTGGCTTTC
+AAACTAGGTTCTGGGTTCACATAAGACCT
+>URS0000000002_10090 Mus musculus mmu-mir-2
+GGGGCCCCAAAAGGTCGGAGCGAGGCAAAATTGGCTTTCAAA
+>URS0000000003_7227 Drosophila melanogaster dme-mir-3
+CCCCCCCCCCGGGGGGGGGGUUUUUUUUUU
+"""
+
+
+class ShortQueryIndexTestCase(unittest.TestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.consumer.tests.test_short_query_index
+    """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        filename = os.path.join(self.tmp.name, 'mirbase-1.fasta')
+        with open(filename, 'w') as f:
+            f.write(DATABASE)
+        self.index = ShortQueryIndex.build(filename)
+        self.alphabet = pyhmmer.easel.Alphabet.rna() if pyhmmer is not None else None
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @unittest.skipIf(pyhmmer is None, 'pyhmmer is not installed')
+    def test_exact_hits(self):
+        results, hits = self.index.search('aaaaggtcggagcgaggcaaaattggc', 'mirbase-1.fasta', 10, self.alphabet)
+        assert hits == 2
+        assert sorted(result['rnacentral_id'] for result in results) == ['URS0000000001_9606', 'URS0000000002_10090']
+        assert results[0]['score'] == results[1]['score']
+        assert results[0]['identity'] == 100.0
+        assert [result['result_id'] for result in results] == [1, 2]
+
+    @unittest.skipIf(pyhmmer is None, 'pyhmmer is not installed')
+    def test_hits_are_scored_by_nhmmer(self):
+        exact, hits = self.index.search('AAAAGGTCGGAGCGAGGCAAAATTGGCTTTC', 'mirbase-1.fasta', 10, self.alphabet)
+        mismatch, hits = self.index.search('AAAAGGTCGGAGCGAGGCAAGATTGGCTTTC', 'mirbase-1.fasta', 10, self.alphabet)
+        assert hits == 2
+        assert mismatch[0]['score'] < exact[0]['score']
+        assert mismatch[0]['e_value'] > exact[0]['e_value']
+        assert mismatch[0]['identity'] < 100.0
+        assert mismatch[0]['description'] == 'Homo sapiens hsa-mir-1'
+
+    @unittest.skipIf(pyhmmer is None, 'pyhmmer is not installed')
+    def test_hits_do_not_span_sequences(self):
+        results, hits = self.index.search('ACATAAGACCTGGGGCCCC', 'mirbase-1.fasta', 10, self.alphabet)
+        assert hits == 0
+
+    def test_candidates(self):
+        query = 'AAAAGGUCGGAGCGAGGCAAAAUUGGCUUUCAAACUAGGUUCUGGG'
+        assert self.index.candidates(query, 20) == [0, 1]
+        assert self.index.candidates(query, 30) == [0]
+        assert self.index.candidates('NNNNNNNNNNNN', 1) is None
+
+    def test_write_fasta(self):
+        filename = os.path.join(self.tmp.name, 'targets.fasta')
+        self.index.write_fasta([1], filename)
+        with open(filename, 'r') as f:
+            assert f.read() == '>URS0000000002_10090 Mus musculus mmu-mir-2\nGGGGCCCCAAAAGGUCGGAGCGAGGCAAAAUUGGCUUUCAAA\n'
+
+    def test_save_and_load(self):
+        filename = os.path.join(self.tmp.name, 'mirbase-1.fasta.idx')
+        self.index.save(filename)
+        index = ShortQueryIndex.load(filename)
+        assert index.candidates('GGGGCCCCAAAAGGUCGG', 1) == [0, 1]
+        assert index.header(2) == ('URS0000000003_7227', 'Drosophila melanogaster dme-mir-3')
+        assert index.sequence(2) == 'CCCCCCCCCCGGGGGGGGGGUUUUUUUUUU'
@@ -0,0 +1,33 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import unittest
+
+from sequence_search.consumer.slots import get_consumer_slots
+
+GB = 1024 ** 3
+
+
+class GetConsumerSlotsTestCase(unittest.TestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.consumer.tests.test_slots
+    """
+    def test_slots_limited_by_cores(self):
+        assert get_consumer_slots(cpu_count=16, memory=128 * GB) == 4
+
+    def test_slots_limited_by_memory(self):
+        assert get_consumer_slots(cpu_count=32, memory=16 * GB) == 4
+
+    def test_at_least_one_slot(self):
+        assert get_consumer_slots(cpu_count=2, memory=1 * GB) == 1
@@ -21,10 +21,11 @@ from ..infernal_search import infernal_search
 from ..infernal_deoverlap import infernal_deoverlap
 from ..settings import MAX_RUN_TIME
 from ...db import DatabaseConnectionError, SQLError
-from ...db.consumers import get_ip, set_consumer_fields
-from ...db.models import CONSUMER_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES
-from ...db.infernal_job import set_infernal_job_status, set_consumer_to_infernal_job
+from ...db.consumers import get_ip
+from ...db.models import JOB_CHUNK_STATUS_CHOICES
+from ...db.infernal_job import start_infernal_job, finish_infernal_job
 from ...db.infernal_results import set_infernal_job_results, get_infernal_result_id, save_alignment
+from ...db.session import Session
 
 logger = logging.Logger('aiohttp.web')
 
@@ -37,7 +38,7 @@ class InfernalError(Exception):
         return str(self.text)
 
 
-async def infernal(engine, job_id, sequence, consumer_ip):
+async def infernal(engine, job_id, sequence, consumer_ip, producer_client=None):
     process, filename = await infernal_search(sequence=sequence, job_id=job_id)
 
     try:
@@ -49,14 +50,16 @@ async def infernal(engine, job_id, sequence, consumer_ip):
         logger.warning('Infernal timeout for: job_id = %s' % job_id)
         process.kill()
         # TODO: what do we do in case we lost the database connection here?
-        await set_infernal_job_status(engine, job_id, status=JOB_CHUNK_STATUS_CHOICES.timeout)
-        await set_consumer_fields(engine, consumer_ip, CONSUMER_STATUS_CHOICES.available, job_chunk_id=None)
+        await finish_infernal_job(engine, job_id, consumer_ip, status=JOB_CHUNK_STATUS_CHOICES.timeout)
+        if producer_client:
+            await producer_client.job_done(job_id)
         return
     except Exception as e:
         logger.error('Infernal error for job_id: %s - Message: %s' % (job_id, e))
         # TODO: what do we do in case we lost the database connection here?
-        await set_infernal_job_status(engine, job_id, status=JOB_CHUNK_STATUS_CHOICES.error)
-        await set_consumer_fields(engine, consumer_ip, CONSUMER_STATUS_CHOICES.available, job_chunk_id=None)
+        await finish_infernal_job(engine, job_id, consumer_ip, status=JOB_CHUNK_STATUS_CHOICES.error)
+        if producer_client:
+            await producer_client.job_done(job_id)
         return
     else:
         logger.debug('Infernal search success for: job_id = %s' % job_id)
@@ -71,34 +74,41 @@ async def infernal(engine, job_id, sequence, consumer_ip):
     except asyncio.TimeoutError:
         logging.debug('Deoverlap timeout for: job_id = %s' % job_id)
         process_deoverlap.kill()
-        await set_infernal_job_status(engine, job_id, status=JOB_CHUNK_STATUS_CHOICES.timeout)
-        await set_consumer_fields(engine, consumer_ip, CONSUMER_STATUS_CHOICES.available, job_chunk_id=None)
+        await finish_infernal_job(engine, job_id, consumer_ip, status=JOB_CHUNK_STATUS_CHOICES.timeout)
     except Exception as e:
         logging.debug('Deoverlap error for job_id: %s - Message: %s' % (job_id, e))
-        await set_infernal_job_status(engine, job_id, status=JOB_CHUNK_STATUS_CHOICES.error)
-        await set_consumer_fields(engine, consumer_ip, CONSUMER_STATUS_CHOICES.available, job_chunk_id=None)
+        await finish_infernal_job(engine, job_id, consumer_ip, status=JOB_CHUNK_STATUS_CHOICES.error)
     else:
         logging.debug('Deoverlap success for: job_id = %s' % job_id)
 
-        # save results of the infernal job to the database
-        infernal_job_id = None
         results = infernal_parse(file_deoverlap)
-        if results:
-            infernal_job_id = await set_infernal_job_results(engine, job_id, results)
-
-        # save the alignment
         output = alignment(filename)
-        if output and infernal_job_id:
-            for item in output:
-                infernal_result_id = await get_infernal_result_id(engine, infernal_job_id, item)
-                if infernal_result_id:
-                    await save_alignment(engine, infernal_result_id, item['alignment'])
-
-        # update infernal status
-        await set_infernal_job_status(engine, job_id, status=JOB_CHUNK_STATUS_CHOICES.success)
 
-        # update consumer fields
-        await set_consumer_fields(engine, consumer_ip, CONSUMER_STATUS_CHOICES.available, job_chunk_id=None)
+        # the results, their alignments and the infernal job are saved together with a single connection
+        async with Session(engine) as session:
+            try:
+                async with session.begin():
+                    # save results of the infernal job to the database
+                    infernal_job_id = None
+                    if results:
+                        infernal_job_id = await set_infernal_job_results(session, job_id, results)
+
+                    # save the alignment
+                    if output and infernal_job_id:
+                        for item in output:
+                            infernal_result_id = await get_infernal_result_id(session, infernal_job_id, item)
+                            if infernal_result_id:
+                                await save_alignment(session, infernal_result_id, item['alignment'])
+
+                    # update infernal status and free the consumer slot used by this infernal job
+                    await finish_infernal_job(session, job_id, consumer_ip, status=JOB_CHUNK_STATUS_CHOICES.success)
+            except (DatabaseConnectionError, SQLError) as e:
+                logging.debug('Error saving infernal results for job_id: %s - Message: %s' % (job_id, e))
+                await finish_infernal_job(session, job_id, consumer_ip, status=JOB_CHUNK_STATUS_CHOICES.error)
+
+    # let the producer use the free slot right away
+    if producer_client:
+        await producer_client.job_done(job_id)
 
 
 async def submit_infernal_job(request):
@@ -117,15 +127,13 @@ async def submit_infernal_job(request):
     # if request was successful, save the consumer state and infernal_job state to the database
     if engine and job_id and sequence:
         try:
-            await set_consumer_fields(engine, consumer_ip, CONSUMER_STATUS_CHOICES.busy, job_chunk_id='infernal-job')
-            await set_infernal_job_status(engine, job_id, status=JOB_CHUNK_STATUS_CHOICES.started)
-            await set_consumer_to_infernal_job(engine, job_id, consumer_ip)
+            await start_infernal_job(engine, job_id, consumer_ip)
         except (DatabaseConnectionError, SQLError) as e:
             logger.error(e)
             raise web.HTTPBadRequest(text=str(e)) from e
 
         # spawn cmscan job in the background and return 201
-        await spawn(request, infernal(engine, job_id, sequence, consumer_ip))
+        await spawn(request, infernal(engine, job_id, sequence, consumer_ip, request.app.get('producer_client')))
         return web.HTTPCreated()
     else:
         raise web.HTTPBadRequest(text='Invalid data. Engine, job_id and sequence not found.')
@@ -23,15 +23,18 @@ from itertools import islice
 
 from ..nhmmer_parse import nhmmer_parse, parse_number_of_hits
 from ..nhmmer_search import nhmmer_search
-from ..rnacentral_databases import query_file_path, result_file_path, consumer_validator
-from ..settings import MAX_RUN_TIME, NHMMER_LIMIT
+from ..query_profile import evict_query_profiles
+from ..representatives import uses_representatives, cluster_members, fetch_members, merge_results
+from ..rnacentral_databases import query_file_path, result_file_path, target_file_path, consumer_validator
+from ..settings import MAX_RUN_TIME, NHMMER_LIMIT, NHMMER_QUERY_PROFILES, SHORT_QUERY_FALLBACK
 from ...db import DatabaseConnectionError, SQLError
-from ...db.models import CONSUMER_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES
+from ...db.models import JOB_CHUNK_STATUS_CHOICES
 from ...db.job_chunk_results import set_job_chunk_results
-from ...db.job_chunks import get_consumer_ip_from_job_chunk, get_job_chunk_from_job_and_database, \
-    set_job_chunk_status, set_job_chunk_consumer
-from ...db.jobs import update_job_status_from_job_chunks_status
-from ...db.consumers import set_consumer_status, set_consumer_job_chunk_id, get_ip
+from ...db.jobs import save_job_results
+from ...db.job_chunks import get_job_chunk_from_job_and_database, get_job_chunk_timeout, start_job_chunk, \
+    finish_job_chunk
+from ...db.consumers import get_ip
+from ...db.session import Session
 
 
 class NhmmerError(Exception):
@@ -45,7 +48,109 @@ class NhmmerError(Exception):
 logger = logging.Logger('aiohttp.web')
 
 
-async def nhmmer(engine, job_id, sequence, database):
+async def run_nhmmer_search(job_id, sequence, database, targets=None):
+    """Runs nhmmer for a single query and returns the path to its output file"""
+    # I assume, subprocess creation can't raise exceptions
+    process, filename = await nhmmer_search(sequence=sequence, job_id=job_id, database=database, targets=targets)
+
+    try:
+        task = asyncio.ensure_future(process.communicate())
+        await asyncio.wait_for(task, MAX_RUN_TIME)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # also stop nhmmer when the job chunk runs past its deadline, see nhmmer
+        process.kill()
+        raise
+
+    if process.returncode != 0:
+        raise NhmmerError("Nhmmer process returned non-zero status code")
+
+    return filename
+
+
+def read_nhmmer_output(filename):
+    """Returns the results of an nhmmer output file (up to the limit set in NHMMER_LIMIT) and the total number of hits"""
+    hits = 0
+    try:
+        line = parse_number_of_hits(filename)
+        hits = re.split("[: ]+", line)[4]
+    except (TypeError, ValueError):
+        pass
+
+    results = list(islice((record for record in nhmmer_parse(filename=filename)), NHMMER_LIMIT))
+    return results, hits
+
+
+async def search_cluster_members(job_id, sequence, database, results, hits):
+    """
+    Searches the query against the members of the clusters of the representatives found by nhmmer,
+    and adds their hits to the results of the representatives, see representatives
+    """
+    if not uses_representatives(database):
+        return results, hits
+
+    names = cluster_members(database, results)
+    if not names:
+        return results, hits
+
+    targets = '%s.members' % target_file_path(job_id, database)
+    try:
+        await fetch_members(database, names, targets)
+        filename = await run_nhmmer_search(job_id, sequence, database, targets)
+        member_results, member_hits = read_nhmmer_output(filename)
+        logging.debug('Nhmmer searched %s cluster members for: job_id = %s, database = %s' % (
+            len(names), job_id, database))
+    finally:
+        if os.path.isfile(targets):
+            os.remove(targets)
+
+    return merge_results(results, hits, member_results, member_hits)
+
+
+async def prefiltered_nhmmer_search(short_query_engine, job_id, sequence, database):
+    """Runs nhmmer only against the database sequences that share enough seeds with the query"""
+    targets = target_file_path(job_id, database)
+    try:
+        candidates = await short_query_engine.prefilter(sequence, database, targets)
+        logging.debug('Nhmmer prefilter selected %s sequences for: job_id = %s, database = %s' % (
+            candidates, job_id, database))
+
+        if candidates == 0:
+            return [], 0
+        if candidates is None:
+            # the query has no seeds, search the whole database
+            results, hits = read_nhmmer_output(await run_nhmmer_search(job_id, sequence, database))
+            return await search_cluster_members(job_id, sequence, database, results, hits)
+        return read_nhmmer_output(await run_nhmmer_search(job_id, sequence, database, targets))
+    finally:
+        if os.path.isfile(targets):
+            os.remove(targets)
+
+
+async def search_job_chunk(job_id, sequence, database, batcher=None, search_engine=None, short_query_engine=None):
+    """Searches the query in a database file with the first engine that accepts it, see nhmmer"""
+    results = None
+    if short_query_engine and short_query_engine.accepts(sequence, database):
+        results, hits = await short_query_engine.search(sequence, database, NHMMER_LIMIT)
+        if not results and SHORT_QUERY_FALLBACK:
+            # no exact or near-exact hits, look for more distant ones with nhmmer
+            results = None
+
+    if results is None and search_engine:
+        results, hits = await asyncio.wait_for(search_engine.search(sequence, database, NHMMER_LIMIT), MAX_RUN_TIME)
+    elif results is None and batcher:
+        results, hits = read_nhmmer_output(await batcher.search(job_id, sequence, database))
+        results, hits = await search_cluster_members(job_id, sequence, database, results, hits)
+    elif results is None and short_query_engine and short_query_engine.prefilters(database):
+        results, hits = await prefiltered_nhmmer_search(short_query_engine, job_id, sequence, database)
+    elif results is None:
+        results, hits = read_nhmmer_output(await run_nhmmer_search(job_id, sequence, database))
+        results, hits = await search_cluster_members(job_id, sequence, database, results, hits)
+
+    return results, hits
+
+
+async def nhmmer(engine, job_id, sequence, database, consumer_ip, batcher=None, search_engine=None,
+                 short_query_engine=None, producer_client=None):
     """
     Function that performs nhmmer search and then reports the result to provider API.
 
@@ -53,75 +158,85 @@ async def nhmmer(engine, job_id, sequence, database):
     :param sequence: string, e.g. AAAAGGTCGGAGCGAGGCAAAATTGGCTTTCAAACTAGGTTCTGGGTTCACATAAGACCT
     :param job_id: id of this job, generated by producer
     :param database: name of the database to search against
+    :param consumer_ip: IP of this consumer, that started the job chunk
+    :param batcher: NhmmerBatcher that searches this query together with others against the same database (optional)
+    :param search_engine: PyhmmerEngine that searches this query in-process (optional)
+    :param short_query_engine: ShortQueryEngine that searches short queries in the database index (optional)
+    :param producer_client: ProducerClient that tells the producer when the job chunk is done (optional)
     :return:
     """
-    job_chunk_id = await get_job_chunk_from_job_and_database(engine, job_id, database)
+    # the producer sets a deadline on the job chunks with a predicted runtime, see producer/runtime_model.py;
+    # without one, each search engine stops after MAX_RUN_TIME on its own
+    async with Session(engine) as session:
+        job_chunk_id = await get_job_chunk_from_job_and_database(session, job_id, database)
+        timeout = await get_job_chunk_timeout(session, job_chunk_id)
 
     logging.debug('Nhmmer search started for: job_id = %s, database = %s' % (job_id, database))
 
-    # I assume, subprocess creation can't raise exceptions
-    process, filename = await nhmmer_search(sequence=sequence, job_id=job_id, database=database)
-
+    status, results, hits = None, None, None
     try:
         t0 = datetime.datetime.now()
-        task = asyncio.ensure_future(process.communicate())
-        await asyncio.wait_for(task, MAX_RUN_TIME)
+        results, hits = await asyncio.wait_for(
+            search_job_chunk(job_id, sequence, database, batcher, search_engine, short_query_engine),
+            min(timeout, MAX_RUN_TIME) if timeout else None
+        )
         logging.debug("Time - Nhmmer searched for sequences in {} for {} seconds".format(
             database, (datetime.datetime.now() - t0).total_seconds())
         )
-
-        return_code = process.returncode
-        if return_code != 0:
-            raise NhmmerError("Nhmmer process returned non-zero status code")
     except asyncio.TimeoutError as e:
         logging.debug('Nhmmer job chunk timeout out: job_id = %s, database = %s' % (job_id, database))
-        process.kill()
-
-        # TODO: what do we do in case we lost the database connection here?
-        await set_job_chunk_status(engine, job_id, database, status=JOB_CHUNK_STATUS_CHOICES.timeout)
+        status = JOB_CHUNK_STATUS_CHOICES.timeout
     except Exception as e:
         logging.debug('Nhmmer search error for: job_id = %s, database = %s' % (job_id, database))
-        # TODO: what do we do in case we lost the database connection here?
-        await set_job_chunk_status(engine, job_id, database, status=JOB_CHUNK_STATUS_CHOICES.error)
+        status = JOB_CHUNK_STATUS_CHOICES.error
     else:
         logging.debug('Nhmmer search success for: job_id = %s, database = %s' % (job_id, database))
 
-        # check the total number of hits
-        hits = 0
-        try:
-            line = parse_number_of_hits(filename)
-            hits = re.split("[: ]+", line)[4]
-        except (TypeError, ValueError):
-            pass
-
+    # TODO: what do we do in case we lost the database connection here?
+    # finish_job_chunk updates the job chunk, the job and the consumer slot at once, see db/job_chunks.py
+    finished = None
+    async with Session(engine) as session:
+        if status is None:
+            try:
+                # save results and status of the job_chunk together, so that a job chunk never succeeds without them
+                async with session.begin():
+                    finished = await finish_job_chunk(
+                        session, job_id, database, consumer_ip, JOB_CHUNK_STATUS_CHOICES.success, hits=hits
+                    )
+                    # a job chunk that was requeued in the meantime gets its results from the consumer running it
+                    if finished and results:
+                        # logs the number and the size of the saved results, the time and the memory used
+                        await set_job_chunk_results(
+                            session, job_id, database, results, job_chunk_id=finished.job_chunk_id
+                        )
+            except (DatabaseConnectionError, SQLError) as e:
+                # TODO: probably, clean the nhmmer query and result files?
+                logging.debug('Error saving job chunk results = %s' % e)
+                status = JOB_CHUNK_STATUS_CHOICES.error
+
+        if status is not None:
+            finished = await finish_job_chunk(session, job_id, database, consumer_ip, status)
+
+    if finished is None:
+        logging.debug('Job chunk was requeued before it finished: job_id = %s, database = %s' % (job_id, database))
+
+    # the last job chunk of a job saves its top results, see db/jobs.py
+    if finished and finished.job_finished:
         try:
-            # parse nhmmer results to python (up to the limit set in NHMMER_LIMIT)
-            results = list(islice((record for record in nhmmer_parse(filename=filename)), NHMMER_LIMIT))
-
-            # save results of the job_chunk to the database
-            if results:
-                t0 = datetime.datetime.now()
-                await set_job_chunk_results(engine, job_id, database, results)
-                logging.debug("Time - saving {} results in {} seconds".format(
-                    len(results), (datetime.datetime.now() - t0).total_seconds())
-                )
-            # set status of the job_chunk to the database
-            await set_job_chunk_status(engine, job_id, database, status=JOB_CHUNK_STATUS_CHOICES.success, hits=hits)
+            await save_job_results(engine, job_id)
         except (DatabaseConnectionError, SQLError) as e:
-            # TODO: what do we do in case we lost the database connection here?
-            # TODO: probably, clean the nhmmer query and result files?
-            logging.debug('Error saving job chunk results = %s' % e)
-            await set_job_chunk_status(engine, job_id, database, status=JOB_CHUNK_STATUS_CHOICES.error)
+            logging.debug('Error saving the results of job_id = %s: %s' % (job_id, e))
 
-    # TODO: what do we do in case we lost the database connection here?
-    # update job in the database (maybe the whole job is done)
-    await update_job_status_from_job_chunks_status(engine, job_id)
+    # the query profile is not needed by any other job chunk once the whole job is done
+    if finished and finished.job_finished and NHMMER_QUERY_PROFILES and not search_engine:
+        try:
+            evict_query_profiles(sequence)
+        except OSError as e:
+            logging.debug('Error evicting query profile of job_id = %s: %s' % (job_id, e))
 
-    # TODO: what do we do in case we lost the database connection here?
-    # update consumer status and
-    consumer_ip = await get_consumer_ip_from_job_chunk(engine, job_chunk_id)
-    await set_consumer_status(engine, consumer_ip, CONSUMER_STATUS_CHOICES.available)
-    await set_consumer_job_chunk_id(engine, consumer_ip, None, None)
+    # let the producer use the free slot right away
+    if producer_client:
+        await producer_client.job_done(job_id, database)
 
 
 def serialize(request, data):
@@ -167,12 +282,9 @@ async def submit_job(request):
     database = data["database"]
     consumer_ip = get_ip(request.app)  # 'host.docker.internal'
 
-    # if request was successful, save the consumer state and job_chunk state to the database
+    # if request was successful, save the job_chunk state and take one of the consumer slots, in a single statement
     try:
-        await set_consumer_status(engine, consumer_ip, CONSUMER_STATUS_CHOICES.busy)
-        await set_consumer_job_chunk_id(engine, consumer_ip, job_id, database)
-        await set_job_chunk_status(engine, job_id, database, status=JOB_CHUNK_STATUS_CHOICES.started)
-        await set_job_chunk_consumer(engine, job_id, database, consumer_ip)
+        job_chunk_id = await start_job_chunk(engine, job_id, database, consumer_ip)
     except (DatabaseConnectionError, SQLError) as e:
         logging.error(f"Database error for job_id={job_id}, consumer={consumer_ip}, database={database}: {e}")
         raise web.HTTPBadRequest(text=f"Database error: {e}")
@@ -180,6 +292,20 @@ async def submit_job(request):
         logging.error(f"Unexpected error while processing job_id={job_id}, consumer_ip={consumer_ip}: {e}")
         raise web.HTTPInternalServerError(text=f"Unexpected error occurred: {e}")
 
-    # spawn nhmmer job in the background and return 201
-    await spawn(request, nhmmer(engine, job_id, sequence, database))
+    if job_chunk_id is None:
+        raise web.HTTPNotFound(text=f"Job chunk with job_id={job_id} and database={database} does not exist "
+                                    f"or was already started")
+
+    # renew the lease of the job_chunk while it waits for a free slot and while it runs
+    if request.app.get('producer_client'):
+        request.app['producer_client'].job_started(job_id, database)
+
+    # spawn nhmmer job in the background and return 201; aiojobs runs at most as many jobs as the consumer has slots
+    await spawn(request, nhmmer(
+        engine, job_id, sequence, database, consumer_ip,
+        batcher=request.app.get('nhmmer_batcher'),
+        search_engine=request.app.get('pyhmmer_engine'),
+        short_query_engine=request.app.get('short_query_engine'),
+        producer_client=request.app.get('producer_client')
+    ))
     return web.HTTPCreated()
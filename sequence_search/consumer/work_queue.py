@@ -0,0 +1,91 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import logging
+
+from aiojobs.aiohttp import get_scheduler_from_app
+
+from . import settings
+from .views.submit_job import nhmmer
+from .views.submit_infernal_job import infernal
+from ..db import DatabaseConnectionError, SQLError
+from ..db.consumers import claim_next_job, get_ip
+
+
+"""
+Pull mode (DISPATCH_MODE = 'pull').
+
+Instead of waiting for the producer to submit job chunks over HTTP, the consumer claims
+the next pending job chunk or infernal job from the database whenever one of its slots
+is free. Dispatch then scales with the number of consumers rather than with the single
+scheduler loop of the producer.
+"""
+
+# seconds before the first retry of a consumer that finds nothing to do, doubled up to PULL_INTERVAL
+PULL_MIN_INTERVAL = 0.1
+
+
+class WorkQueue(object):
+    def __init__(self, app):
+        self.app = app
+        self.slots = asyncio.Semaphore(app['slots'])
+
+    async def run(self):
+        """Claims work while there are free slots, backing off while there is nothing to do"""
+        delay = PULL_MIN_INTERVAL
+        while True:
+            await self.slots.acquire()
+            try:
+                claimed = await claim_next_job(self.app['engine'], get_ip(self.app))
+            except (DatabaseConnectionError, SQLError) as e:
+                logging.error(f"Error claiming a job: {str(e)}")
+                claimed = None
+
+            if claimed is None:
+                self.slots.release()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, settings.PULL_INTERVAL)
+                continue
+
+            delay = PULL_MIN_INTERVAL
+            scheduler = get_scheduler_from_app(self.app)
+            await scheduler.spawn(self.process(claimed))
+
+    async def process(self, claimed):
+        """Runs a claimed job chunk or infernal job and frees its slot of the queue"""
+        producer_client = self.app.get('producer_client')
+        if producer_client and claimed.database is not None:
+            producer_client.job_started(claimed.job_id, claimed.database)
+
+        try:
+            if claimed.database is None:
+                await infernal(
+                    self.app['engine'], claimed.job_id, claimed.query, get_ip(self.app),
+                    producer_client=producer_client
+                )
+            else:
+                await nhmmer(
+                    self.app['engine'], claimed.job_id, claimed.query, claimed.database, get_ip(self.app),
+                    batcher=self.app.get('nhmmer_batcher'),
+                    search_engine=self.app.get('pyhmmer_engine'),
+                    short_query_engine=self.app.get('short_query_engine'),
+                    producer_client=producer_client
+                )
+        except Exception as e:
+            logging.error(f"Error running job_id = {claimed.job_id}, database = {claimed.database}: {str(e)}")
+        finally:
+            if producer_client:
+                # stop renewing the lease even if the search failed before reporting it
+                producer_client.job_chunks.discard((claimed.job_id, claimed.database))
+            self.slots.release()
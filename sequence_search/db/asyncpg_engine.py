@@ -0,0 +1,344 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import re
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import psycopg2
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import text
+from sqlalchemy.sql.elements import TextClause
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+
+"""
+Engine with the same interface as the aiopg.sa engine, on top of an asyncpg pool.
+
+The db functions build their queries with SQLAlchemy core and run them with
+engine.acquire() and connection.execute(), so they work with both engines. Here
+the queries are compiled to SQL with $1, $2... placeholders, the compiled SQL is
+cached, and each connection keeps the prepared statements it has executed, so a
+hot query is compiled and parsed by the server only once per connection. The
+results are decoded from the binary protocol of asyncpg.
+
+Errors of asyncpg are raised as psycopg2 errors, so that the error handling of
+the db functions (DatabaseConnectionError/SQLError) is the same for both engines.
+
+Select the engine with POSTGRES_BACKEND, see settings.py and models.init_pg.
+"""
+
+
+# SQLAlchemy renders the bind parameters as %s (and a literal % as %%), they are numbered afterwards
+dialect = postgresql.dialect(paramstyle='format')
+
+PLACEHOLDER = re.compile(r'%%|%s')
+
+# number of compiled queries kept in memory, e.g. the sa.text() queries built on every call of a db function
+COMPILED_CACHE_SIZE = 512
+
+# postgres types of the parameters that are converted from python values of another type,
+# like psycopg2 does by sending them as literals
+TEXT_TYPES = {'text', 'varchar', 'bpchar', 'name'}
+INTEGER_TYPES = {'int2', 'int4', 'int8'}
+FLOAT_TYPES = {'float4', 'float8', 'numeric'}
+
+
+class CompiledQuery(object):
+    """SQL of a query with numbered placeholders and the names of its parameters, in order"""
+    def __init__(self, query):
+        self.compiled = query.compile(dialect=dialect)
+        self.positions = self.compiled.positiontup or []
+        self.processors = self.compiled._bind_processors
+
+        count = iter(range(1, len(self.positions) + 1))
+        self.sql = PLACEHOLDER.sub(lambda match: '%' if match.group(0) == '%%' else '$%d' % next(count),
+                                   self.compiled.string)
+
+    def arguments(self, params):
+        values = self.compiled.construct_params(params)
+        arguments = []
+        for name in self.positions:
+            value = values[name]
+            if name in self.processors and value is not None:
+                value = self.processors[name](value)
+            arguments.append(value)
+        return arguments
+
+
+text_cache = OrderedDict()
+construct_cache = weakref.WeakKeyDictionary()
+
+
+def compile_query(query):
+    """
+    Compiles a query once: sa.text() queries are cached by their SQL, because most db functions build
+    them on every call, other SQLAlchemy constructs as long as they exist (e.g. module-level queries).
+    """
+    if isinstance(query, str):
+        query = text(query)
+
+    if isinstance(query, TextClause) and all(bind.value is None for bind in query._bindparams.values()):
+        compiled = text_cache.get(query.text)
+        if compiled is None:
+            compiled = text_cache[query.text] = CompiledQuery(query)
+            if len(text_cache) > COMPILED_CACHE_SIZE:
+                text_cache.popitem(last=False)
+        else:
+            text_cache.move_to_end(query.text)
+        return compiled
+
+    compiled = construct_cache.get(query)
+    if compiled is None:
+        compiled = construct_cache[query] = CompiledQuery(query)
+    return compiled
+
+
+def coerce_arguments(arguments, parameters):
+    """Converts the arguments to the types of the statement parameters where asyncpg would reject them"""
+    output = []
+    for value, parameter in zip(arguments, parameters):
+        if value is not None and not isinstance(value, bool):
+            if parameter.name in TEXT_TYPES and not isinstance(value, str):
+                value = str(value)
+            elif parameter.name in INTEGER_TYPES and isinstance(value, str):
+                value = int(value)
+            elif parameter.name in FLOAT_TYPES and isinstance(value, str):
+                value = float(value)
+        output.append(value)
+    return output
+
+
+def rowcount(status):
+    """Number of rows of a command status, e.g. 'UPDATE 3' or 'INSERT 0 5'"""
+    try:
+        return int(status.split()[-1])
+    except (AttributeError, IndexError, ValueError):
+        return -1
+
+
+def as_psycopg2_error(e):
+    if isinstance(e, asyncpg.PostgresError):
+        return psycopg2.DatabaseError(str(e))
+    return psycopg2.OperationalError(str(e))
+
+
+class Row(object):
+    """Row of a result, accessed like the rows of aiopg: row.name, row['name'] or row[0]"""
+    __slots__ = ('_record',)
+
+    def __init__(self, record):
+        self._record = record
+
+    def __getattr__(self, name):
+        try:
+            return self._record[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __getitem__(self, key):
+        return self._record[key]
+
+    def __iter__(self):
+        return iter(self._record.values())
+
+    def __len__(self):
+        return len(self._record)
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return repr(tuple(self))
+
+    def keys(self):
+        return list(self._record.keys())
+
+    def values(self):
+        return list(self._record.values())
+
+    def items(self):
+        return list(self._record.items())
+
+
+class Result(object):
+    """Rows of an executed query, with the interface of the aiopg ResultProxy"""
+    def __init__(self, records, rowcount):
+        self._rows = [Row(record) for record in records]
+        self._index = 0
+        self.rowcount = rowcount
+
+    @property
+    def returns_rows(self):
+        return bool(self._rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        row = await self.fetchone()
+        if row is None:
+            raise StopAsyncIteration
+        return row
+
+    async def fetchone(self):
+        if self._index >= len(self._rows):
+            return None
+        self._index += 1
+        return self._rows[self._index - 1]
+
+    async def fetchall(self):
+        rows, self._index = self._rows[self._index:], len(self._rows)
+        return rows
+
+    async def first(self):
+        row = await self.fetchone()
+        self.close()
+        return row
+
+    async def scalar(self):
+        row = await self.first()
+        return row[0] if row is not None else None
+
+    def close(self):
+        self._index = len(self._rows)
+
+
+class ExecuteContext(object):
+    """Return value of Connection.execute, that can be awaited or iterated like the one of aiopg"""
+    def __init__(self, coro):
+        self._coro = coro
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aiter__(self):
+        async for row in await self._coro:
+            yield row
+
+    async def __aenter__(self):
+        return await self._coro
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+def connection_class():
+    """Class of the connections of the pool, that keep the statements prepared by Connection.prepare"""
+    class PreparingConnection(asyncpg.Connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared_statements = OrderedDict()
+
+    return PreparingConnection
+
+
+class Connection(object):
+    """Connection of the pool, with the interface of the aiopg SAConnection"""
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, *multiparams, **params):
+        for multiparam in multiparams:
+            params.update(multiparam)
+        return ExecuteContext(self._execute(query, params))
+
+    async def _execute(self, query, params):
+        try:
+            if isinstance(query, str) and not params:
+                # e.g. DELETE FROM jobs or several statements at once: no parameters, nothing to prepare
+                return Result([], rowcount(await self.connection.execute(query)))
+
+            compiled = compile_query(query)
+            statement = await self.prepare(compiled.sql)
+            arguments = coerce_arguments(compiled.arguments(params), statement.get_parameters())
+            records = await statement.fetch(*arguments)
+            return Result(records, rowcount(statement.get_statusmsg()))
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            raise as_psycopg2_error(e) from e
+
+    async def prepare(self, sql):
+        """Returns the prepared statement of the sql, preparing it only the first time on this connection"""
+        statements = self.connection.prepared_statements
+        statement = statements.get(sql)
+        if statement is None:
+            statement = statements[sql] = await self.connection.prepare(sql)
+            if len(statements) > COMPILED_CACHE_SIZE:
+                statements.popitem(last=False)
+        else:
+            statements.move_to_end(sql)
+        return statement
+
+    async def scalar(self, query, *multiparams, **params):
+        result = await self.execute(query, *multiparams, **params)
+        return await result.scalar()
+
+    async def copy_records(self, table, columns, records):
+        """Streams records (tuples in the order of columns) into a table with the binary COPY protocol"""
+        try:
+            return rowcount(await self.connection.copy_records_to_table(table, columns=columns, records=records))
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            raise as_psycopg2_error(e) from e
+
+    def begin(self):
+        """Transaction to use as 'async with connection.begin()', nested transactions are savepoints"""
+        return self.connection.transaction()
+
+    @property
+    def in_transaction(self):
+        return self.connection.is_in_transaction()
+
+
+class Engine(object):
+    """Pool of asyncpg connections, with the interface of the aiopg.sa Engine"""
+    def __init__(self, pool):
+        self.pool = pool
+        self._closing = None
+
+    @asynccontextmanager
+    async def acquire(self):
+        try:
+            connection = await self.pool.acquire()
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError) as e:
+            raise as_psycopg2_error(e) from e
+
+        try:
+            yield Connection(connection)
+        finally:
+            await self.pool.release(connection)
+
+    def close(self):
+        self._closing = asyncio.ensure_future(self.pool.close())
+
+    async def wait_closed(self):
+        if self._closing:
+            await self._closing
+
+
+async def create_engine(user, database, host, password, port=5432, minsize=1, maxsize=10):
+    """Same as aiopg.sa.create_engine, but with an asyncpg pool"""
+    if asyncpg is None:
+        raise RuntimeError("asyncpg is not installed, it is required by POSTGRES_BACKEND = 'asyncpg'")
+
+    try:
+        pool = await asyncpg.create_pool(user=user, database=database, host=host, password=password, port=port,
+                                         min_size=minsize, max_size=maxsize, connection_class=connection_class())
+    except (asyncpg.PostgresError, OSError) as e:
+        raise as_psycopg2_error(e) from e
+    return Engine(pool)
@@ -0,0 +1,158 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import datetime
+import os
+import sys
+import time
+import uuid
+
+import sqlalchemy as sa
+from aiopg.sa import create_engine
+
+from .asyncpg_engine import create_engine as asyncpg_create_engine
+from .job_chunks import set_job_chunk_status
+from .jobs import find_highest_priority_jobs, get_job_results
+from .models import Job, JobChunk, JobChunkResult, JOB_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES
+from .settings import get_postgres_credentials, POSTGRES_POOL_MIN, POSTGRES_POOL_MAX
+
+
+"""
+Compares the aiopg and the asyncpg engines on the hot queries of the producer and the consumers.
+
+A job with DATABASES job chunks and RESULTS results per job chunk is created, each query is run
+REPEAT times one after the other and REPEAT times concurrently, then the job is deleted.
+Use a test database, e.g.:
+
+ENVIRONMENT=TEST python3 -m sequence_search.db.benchmark 1000
+"""
+
+
+DATABASES = 20
+
+RESULTS = 50
+
+
+async def create_benchmark_job(engine):
+    job_id = str(uuid.uuid4())
+    async with engine.acquire() as connection:
+        await connection.execute(Job.insert().values(
+            id=job_id,
+            query='AAAAGGUCGGAGCGAGGCAAAAUUGGCUUUCAAACUAGGUUCUGGGUUCACAUAAGACCU',
+            submitted=datetime.datetime.now(),
+            status=JOB_STATUS_CHOICES.started,
+            priority='low'
+        ))
+
+        for index in range(DATABASES):
+            result = await connection.execute(JobChunk.insert().values(
+                job_id=job_id,
+                database='benchmark-%d.fasta' % index,
+                status=JOB_CHUNK_STATUS_CHOICES.pending,
+                rank=index
+            ).returning(JobChunk.c.id))
+            job_chunk_id = (await result.fetchone())[0]
+
+            await connection.execute(JobChunkResult.insert().values([{
+                'job_chunk_id': job_chunk_id,
+                'rnacentral_id': 'URS%010d_9606' % (index * RESULTS + result_id),
+                'description': 'Benchmark result',
+                'score': float(result_id),
+                'bias': 0.7,
+                'e_value': 1.0 / (result_id + 1),
+                'target_length': 98,
+                'alignment': '',
+                'alignment_length': 22,
+                'gap_count': 0,
+                'match_count': 18,
+                'nts_count1': 22,
+                'nts_count2': 0,
+                'identity': 81.8,
+                'query_coverage': 73.3,
+                'target_coverage': 0.0,
+                'gaps': 0.0,
+                'query_length': 60,
+                'alignment_start': 8,
+                'alignment_stop': 29,
+                'alignment_sequence': 'GAGUUUGAGACCAGCCUGGCCA',
+                'result_id': result_id
+            } for result_id in range(RESULTS)]))
+    return job_id
+
+
+async def delete_benchmark_job(engine, job_id):
+    async with engine.acquire() as connection:
+        await connection.execute(sa.text('''
+            DELETE FROM job_chunk_results
+            WHERE job_chunk_id IN (SELECT id FROM job_chunks WHERE job_id = :job_id)
+        '''), job_id=job_id)
+        await connection.execute(sa.text('DELETE FROM job_chunks WHERE job_id = :job_id'), job_id=job_id)
+        await connection.execute(sa.text('DELETE FROM jobs WHERE id = :job_id'), job_id=job_id)
+
+
+def benchmarks(engine, job_id):
+    """Returns {name: function that runs the query i once}"""
+    async def update_status(i):
+        status = JOB_CHUNK_STATUS_CHOICES.started if i % 2 else JOB_CHUNK_STATUS_CHOICES.pending
+        await set_job_chunk_status(engine, job_id, 'benchmark-%d.fasta' % (i % DATABASES), status)
+
+    return {
+        'find_highest_priority_jobs': lambda i: find_highest_priority_jobs(engine),
+        'get_job_results': lambda i: get_job_results(engine, job_id),
+        'set_job_chunk_status': update_status,
+    }
+
+
+async def run(name, engine, job_id, repeat):
+    """Prints the mean time per query, sequential and concurrent"""
+    for query, function in benchmarks(engine, job_id).items():
+        await function(0)  # warm up the pool and the caches
+
+        t0 = time.perf_counter()
+        for i in range(repeat):
+            await function(i)
+        sequential = (time.perf_counter() - t0) / repeat
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*[function(i) for i in range(repeat)])
+        concurrent = (time.perf_counter() - t0) / repeat
+
+        print('%-8s %-28s %10.3f ms %10.3f ms' % (name, query, sequential * 1000, concurrent * 1000))
+
+
+async def main(repeat):
+    settings = get_postgres_credentials(os.getenv('ENVIRONMENT', 'LOCAL'))
+    credentials = dict(user=settings.POSTGRES_USER, database=settings.POSTGRES_DATABASE,
+                       host=settings.POSTGRES_HOST, password=settings.POSTGRES_PASSWORD,
+                       minsize=POSTGRES_POOL_MIN, maxsize=POSTGRES_POOL_MAX)
+
+    engines = [
+        ('aiopg', await create_engine(**credentials)),
+        ('asyncpg', await asyncpg_create_engine(**credentials)),
+    ]
+
+    job_id = await create_benchmark_job(engines[0][1])
+    try:
+        print('%-8s %-28s %13s %13s' % ('engine', 'query', 'sequential', 'concurrent'))
+        for name, engine in engines:
+            await run(name, engine, job_id, repeat)
+    finally:
+        await delete_benchmark_job(engines[0][1], job_id)
+        for name, engine in engines:
+            engine.close()
+            await engine.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
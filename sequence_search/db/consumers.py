@@ -11,6 +11,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import datetime
 import logging
 import sqlalchemy as sa
 import psycopg2
@@ -23,8 +24,9 @@ from tenacity import retry, stop_after_attempt, wait_fixed
 
 from . import DatabaseConnectionError, SQLError
 from .job_chunks import get_job_chunk_from_job_and_database
+from .session import Session
 from ..consumer.settings import PORT
-from .models import CONSUMER_STATUS_CHOICES
+from .models import CONSUMER_STATUS_CHOICES, JOB_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES
 
 
 class ConsumerConnectionError(Exception):
@@ -36,20 +38,87 @@ class ConsumerConnectionError(Exception):
 
 
 async def find_available_consumers(engine):
-    """Returns a list of available consumers that can be used to run."""
-    Consumer = namedtuple('Consumer', ['ip', 'status', 'port', 'job_chunk_id'])
+    """Returns a list of available consumers that have at least one free slot."""
+    Consumer = namedtuple('Consumer', ['ip', 'status', 'port', 'job_chunk_id', 'slots', 'running'])
 
     try:
         async with engine.acquire() as connection:
             query = sa.text('''
-                SELECT ip, status, port, job_chunk_id
+                SELECT ip, status, port, job_chunk_id, slots, running
                 FROM consumer
-                WHERE status=:status
+                WHERE status=:status AND running < slots
+                ORDER BY running, ip
             ''')
 
             results = await connection.execute(query, status=CONSUMER_STATUS_CHOICES.available)
             rows = await results.fetchall()
-            return [Consumer(row[0], row[1], row[2], row[3]) for row in rows]
+            return [Consumer(row[0], row[1], row[2], row[3], row[4], row[5]) for row in rows]
+
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError(str(e)) from e
+
+
+async def find_available_consumer_slots(engine):
+    """
+    Returns one entry per free slot of the available consumers. Consumers are
+    interleaved, so that job chunks taken in order are spread across machines.
+    """
+    consumers = await find_available_consumers(engine)
+
+    slots = []
+    free_slots = [consumer.slots - consumer.running for consumer in consumers]
+    for index in range(max(free_slots, default=0)):
+        slots.extend(consumer for consumer, free in zip(consumers, free_slots) if free > index)
+
+    return slots
+
+
+async def find_cached_databases(engine, since, limit):
+    """
+    Returns the database files that each consumer searched most recently, that are likely
+    to still be in its page cache. Job chunks copied from another job have no consumer.
+
+    :param engine: params to connect to the db
+    :param since: datetime of the oldest job chunk
+    :param limit: maximum number of database files per consumer
+    :return: dict {consumer ip: set of database files}
+    """
+    try:
+        async with engine.acquire() as connection:
+            try:
+                query = sa.text('''
+                    SELECT consumer.ip, job_chunks.database, max(job_chunks.submitted) AS last_used
+                    FROM job_chunks
+                    JOIN consumer ON consumer.ip = job_chunks.consumer
+                    WHERE job_chunks.submitted >= :since
+                    GROUP BY consumer.ip, job_chunks.database
+                    ORDER BY consumer.ip, last_used DESC
+                ''')
+
+                result = {}
+                async for row in await connection.execute(query, since=since):
+                    databases = result.setdefault(row.ip, [])
+                    if len(databases) < limit:
+                        databases.append(row.database)
+                return {ip: set(databases) for ip, databases in result.items()}
+            except Exception as e:
+                raise SQLError("Failed to find the cached databases of the consumers") from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError(str(e)) from e
+
+
+async def count_consumer_slots(engine):
+    """Returns the total number of slots of the consumers that are up, either available or busy."""
+    try:
+        async with engine.acquire() as connection:
+            query = sa.text('''
+                SELECT coalesce(sum(slots), 0)
+                FROM consumer
+                WHERE status IN (:available, :busy)
+            ''')
+            return await connection.scalar(
+                query, available=CONSUMER_STATUS_CHOICES.available, busy=CONSUMER_STATUS_CHOICES.busy
+            )
 
     except psycopg2.Error as e:
         raise DatabaseConnectionError(str(e)) from e
@@ -82,13 +151,13 @@ async def get_consumers_statuses(engine):
     try:
         async with engine.acquire() as connection:
             query = sa.text('''
-                SELECT ip, status
+                SELECT ip, status, slots, running
                 FROM consumer
             ''')
 
             result = []
             async for row in await connection.execute(query):
-                result.append({"ip": row.ip, "status": row.status})
+                result.append({"ip": row.ip, "status": row.status, "slots": row.slots, "running": row.running})
             return result
     except psycopg2.Error as e:
         raise DatabaseConnectionError(str(e)) from e
@@ -151,12 +220,13 @@ async def set_consumer_job_chunk_id(engine, consumer_ip, job_id=None, database=N
     :return: None
     """
     try:
-        async with engine.acquire() as connection:
+        # get_job_chunk_from_job_and_database shares the connection, instead of taking a second one from the pool
+        async with Session(engine) as session:
             job_chunk_id = None
 
             if job_id is not None:
                 try:
-                    job_chunk_id = await get_job_chunk_from_job_and_database(engine, job_id, database)
+                    job_chunk_id = await get_job_chunk_from_job_and_database(session, job_id, database)
                 except Exception as e:
                     logging.error(f"Error fetching job_chunk_id for job_id={job_id} and database={database}: {e}")
                     raise SQLError(f"Failed to fetch job_chunk_id for job_id={job_id} and database={database}") from e
@@ -166,7 +236,7 @@ async def set_consumer_job_chunk_id(engine, consumer_ip, job_id=None, database=N
                 SET job_chunk_id=:job_chunk_id
                 WHERE ip=:consumer_ip
             ''')
-            await connection.execute(query, consumer_ip=consumer_ip, job_chunk_id=job_chunk_id)
+            await session.connection.execute(query, consumer_ip=consumer_ip, job_chunk_id=job_chunk_id)
 
     except psycopg2.Error as e:
         logging.error(f"Database error while updating job_chunk_id for consumer_ip={consumer_ip}: {str(e)}")
@@ -176,6 +246,247 @@ async def set_consumer_job_chunk_id(engine, consumer_ip, job_id=None, database=N
         logging.error(f"Unexpected error while updating job_chunk_id for consumer_ip={consumer_ip}: {e}")
         raise SQLError(f"Failed to update job_chunk_id for consumer_ip={consumer_ip}") from e
 
+
+def pop_consumer_slot(slots, consumer_ip=None):
+    """
+    Takes a free slot from the list returned by find_available_consumer_slots.
+    A slot of consumer_ip is preferred, e.g. to send job chunks against the same database
+    to one consumer, that can search them with a single nhmmer process.
+    """
+    for index, consumer in enumerate(slots):
+        if consumer.ip == consumer_ip:
+            return slots.pop(index)
+    return slots.pop(0)
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(3))
+async def acquire_consumer_slot(engine, consumer_ip, job_chunk_id):
+    """
+    Takes one slot of the consumer for a job chunk (or an infernal job) that has just started.
+    The consumer is marked as busy once all of its slots are taken.
+    Retry up to 3 times with a 3-second wait
+
+    :param engine: params to connect to the db
+    :param consumer_ip: IP address of the consumer
+    :param job_chunk_id: id of the job chunk started on the consumer or 'infernal-job'
+    :return: None
+    """
+    try:
+        async with engine.acquire() as connection:
+            query = sa.text('''
+                UPDATE consumer
+                SET running = running + 1,
+                    status = CASE WHEN running + 1 >= slots THEN :busy ELSE :available END,
+                    job_chunk_id = :job_chunk_id
+                WHERE ip=:consumer_ip
+            ''')
+            await connection.execute(
+                query,
+                consumer_ip=consumer_ip,
+                job_chunk_id=job_chunk_id,
+                busy=CONSUMER_STATUS_CHOICES.busy,
+                available=CONSUMER_STATUS_CHOICES.available
+            )
+
+    except psycopg2.Error as e:
+        logging.error(f"Database error while acquiring a slot for consumer_ip={consumer_ip}: {str(e)}")
+        raise DatabaseConnectionError(f"Failed to acquire a slot for consumer_ip={consumer_ip}") from e
+
+    except Exception as e:
+        logging.error(f"Unexpected error while acquiring a slot for consumer_ip={consumer_ip}: {e}")
+        raise SQLError(f"Failed to acquire a slot for consumer_ip={consumer_ip}") from e
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(3))
+async def release_consumer_slot(engine, consumer_ip):
+    """
+    Frees one slot of the consumer after a job chunk (or an infernal job) is finished.
+    Retry up to 3 times with a 3-second wait
+
+    :param engine: params to connect to the db
+    :param consumer_ip: IP address of the consumer
+    :return: None
+    """
+    try:
+        async with engine.acquire() as connection:
+            query = sa.text('''
+                UPDATE consumer
+                SET running = GREATEST(running - 1, 0),
+                    status = CASE WHEN status = :suspect THEN status
+                                  WHEN running - 1 >= slots THEN :busy ELSE :available END,
+                    job_chunk_id = CASE WHEN running <= 1 THEN NULL ELSE job_chunk_id END
+                WHERE ip=:consumer_ip
+            ''')
+            await connection.execute(
+                query,
+                consumer_ip=consumer_ip,
+                available=CONSUMER_STATUS_CHOICES.available,
+                busy=CONSUMER_STATUS_CHOICES.busy,
+                suspect=CONSUMER_STATUS_CHOICES.suspect
+            )
+
+    except psycopg2.Error as e:
+        logging.error(f"Database error while releasing a slot for consumer_ip={consumer_ip}: {str(e)}")
+        raise DatabaseConnectionError(f"Failed to release a slot for consumer_ip={consumer_ip}") from e
+
+    except Exception as e:
+        logging.error(f"Unexpected error while releasing a slot for consumer_ip={consumer_ip}: {e}")
+        raise SQLError(f"Failed to release a slot for consumer_ip={consumer_ip}") from e
+
+
+async def sync_consumer_slots(engine):
+    """
+    Recounts the running searches of each consumer from the started job chunks and infernal jobs.
+    This fixes slots that were not released, e.g. because the database connection was lost.
+    Consumers in any other status than available/busy (e.g. unreachable) are left untouched.
+    """
+    try:
+        async with engine.acquire() as connection:
+            query = sa.text('''
+                UPDATE consumer
+                SET running = started.running,
+                    status = CASE WHEN started.running >= consumer.slots THEN :busy ELSE :available END,
+                    job_chunk_id = CASE WHEN started.running = 0 THEN NULL ELSE consumer.job_chunk_id END
+                FROM (
+                    SELECT c.ip, (
+                        (SELECT count(*) FROM job_chunks WHERE job_chunks.consumer=c.ip AND job_chunks.status=:started) +
+                        (SELECT count(*) FROM infernal_job WHERE infernal_job.consumer=c.ip AND infernal_job.status=:started)
+                    ) AS running
+                    FROM consumer AS c
+                ) AS started
+                WHERE consumer.ip = started.ip
+                AND consumer.status IN (:available, :busy)
+                AND consumer.running <> started.running
+            ''')
+            await connection.execute(
+                query,
+                started=JOB_CHUNK_STATUS_CHOICES.started,
+                busy=CONSUMER_STATUS_CHOICES.busy,
+                available=CONSUMER_STATUS_CHOICES.available
+            )
+
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError(str(e)) from e
+
+
+async def record_consumer_heartbeat(engine, consumer_ip, now):
+    """
+    Saves the time of the last heartbeat of a consumer. A suspect consumer, whose job chunk leases
+    expired, is alive after all: it gets work again.
+    """
+    try:
+        async with engine.acquire() as connection:
+            query = sa.text('''
+                UPDATE consumer
+                SET last_heartbeat = :now,
+                    status = CASE
+                        WHEN status <> :suspect THEN status
+                        WHEN running >= slots THEN :busy
+                        ELSE :available
+                    END
+                WHERE ip=:consumer_ip
+            ''')
+            await connection.execute(
+                query,
+                now=now,
+                consumer_ip=consumer_ip,
+                suspect=CONSUMER_STATUS_CHOICES.suspect,
+                busy=CONSUMER_STATUS_CHOICES.busy,
+                available=CONSUMER_STATUS_CHOICES.available
+            )
+
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError(str(e)) from e
+
+
+async def claim_next_job(engine, consumer_ip):
+    """
+    Claims the next pending job chunk or infernal job for a consumer that pulls its work from the database,
+    in the same order as find_highest_priority_jobs, and takes one of the consumer slots.
+
+    Candidates are locked with FOR UPDATE SKIP LOCKED, so consumers that claim at the same time
+    never get the same job and never wait for each other.
+
+    :param engine: params to connect to the db
+    :param consumer_ip: IP address of the consumer
+    :return: (job_id, database, query) namedtuple, database is None for an infernal job;
+        None if there is nothing to do
+    """
+    ClaimedJob = namedtuple('ClaimedJob', ['job_id', 'database', 'query'])
+
+    try:
+        async with engine.acquire() as connection:
+            async with connection.begin():
+                job_chunk = None
+                query = sa.text('''
+                    SELECT job_chunks.id, job_chunks.job_id, job_chunks.database, job_chunks.rank,
+                           jobs.priority, jobs.submitted, jobs.query
+                    FROM job_chunks
+                    JOIN jobs ON jobs.id = job_chunks.job_id
+                    WHERE jobs.status = :started AND job_chunks.status = :pending
+                    ORDER BY jobs.priority, jobs.submitted, job_chunks.rank
+                    LIMIT 1
+                    FOR UPDATE OF job_chunks SKIP LOCKED
+                ''')
+                async for row in await connection.execute(
+                        query, started=JOB_STATUS_CHOICES.started, pending=JOB_CHUNK_STATUS_CHOICES.pending):
+                    job_chunk = row
+
+                infernal_job = None
+                query = sa.text('''
+                    SELECT infernal_job.id, infernal_job.job_id, infernal_job.priority, infernal_job.submitted,
+                           jobs.query
+                    FROM infernal_job
+                    JOIN jobs ON jobs.id = infernal_job.job_id
+                    WHERE infernal_job.status = :pending
+                    ORDER BY infernal_job.priority, infernal_job.submitted
+                    LIMIT 1
+                    FOR UPDATE OF infernal_job SKIP LOCKED
+                ''')
+                async for row in await connection.execute(query, pending=JOB_CHUNK_STATUS_CHOICES.pending):
+                    infernal_job = row
+
+                def key(row, rank):
+                    return row.priority or '', row.submitted or datetime.datetime.min, rank
+
+                now = datetime.datetime.now()
+                if job_chunk and (not infernal_job or key(job_chunk, job_chunk.rank) < key(infernal_job, 0)):
+                    await connection.execute(sa.text('''
+                        UPDATE job_chunks SET status = :started, consumer = :consumer_ip, submitted = :now
+                        WHERE id = :id
+                    '''), started=JOB_CHUNK_STATUS_CHOICES.started, consumer_ip=consumer_ip, now=now,
+                        id=job_chunk.id)
+                    claimed = ClaimedJob(job_chunk.job_id, job_chunk.database, job_chunk.query)
+                    slot = job_chunk.id
+                elif infernal_job:
+                    await connection.execute(sa.text('''
+                        UPDATE infernal_job SET status = :started, consumer = :consumer_ip, submitted = :now
+                        WHERE id = :id
+                    '''), started=JOB_CHUNK_STATUS_CHOICES.started, consumer_ip=consumer_ip, now=now,
+                        id=infernal_job.id)
+                    claimed = ClaimedJob(infernal_job.job_id, None, infernal_job.query)
+                    slot = 'infernal-job'
+                else:
+                    return None
+
+                # same as acquire_consumer_slot, in the same transaction as the claim
+                await connection.execute(sa.text('''
+                    UPDATE consumer
+                    SET running = running + 1,
+                        status = CASE WHEN running + 1 >= slots THEN :busy ELSE :available END,
+                        job_chunk_id = :job_chunk_id
+                    WHERE ip=:consumer_ip
+                '''), consumer_ip=consumer_ip, job_chunk_id=slot, busy=CONSUMER_STATUS_CHOICES.busy,
+                    available=CONSUMER_STATUS_CHOICES.available)
+
+                return claimed
+
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError(f"Failed to claim a job for consumer_ip={consumer_ip}") from e
+    except Exception as e:
+        raise SQLError(f"Failed to claim a job for consumer_ip={consumer_ip}") from e
+
+
 async def delegate_job_chunk_to_consumer(engine, consumer_ip, consumer_port, job_id, database, query, consumer_client):
     """
     This function calls submit_job to submit a job_chunk to a consumer
@@ -186,15 +497,16 @@ async def delegate_job_chunk_to_consumer(engine, consumer_ip, consumer_port, job
     :param database: an all-except-rrna- or whitelist-rrna-* file
     :param query: the sequence that the user wants to search
     :param consumer_client: the client initialized in on_startup
-    :return: None (if there are no errors)
+    :return: True if the consumer accepted the job, False otherwise
     """
     try:
-        async with engine.acquire() as connection:
-            response = await consumer_client.submit_job(consumer_ip, consumer_port, job_id, database, query)
+        # no database connection is held during the request, so that many requests can run at the same time
+        response = await consumer_client.submit_job(consumer_ip, consumer_port, job_id, database, query)
 
-            if response is None or response.status >= 400:
-                text = await response.text() if response else "No response from consumer"
-                raise ConsumerConnectionError(f"Error from consumer: {text}")
+        if response is None or response.status >= 400:
+            text = await response.text() if response else "No response from consumer"
+            raise ConsumerConnectionError(f"Error from consumer: {text}")
+        return True
     except ClientConnectionError:
         logging.error(f"Connection error while submitting job {job_id} to {consumer_ip}:{consumer_port}.")
     except ClientResponseError as e:
@@ -205,6 +517,7 @@ async def delegate_job_chunk_to_consumer(engine, consumer_ip, consumer_port, job
         logging.error(f"Database error: {str(e)}")
     except Exception as e:
         logging.error(f"Unexpected error: {str(e)}")
+    return False
 
 
 
@@ -217,15 +530,16 @@ async def delegate_infernal_job_to_consumer(engine, consumer_ip, consumer_port,
     :param job_id: id of the job
     :param query: the sequence that the user wants to search
     :param consumer_client: the client initialized in on_startup
-    :return: None (if there are no errors)
+    :return: True if the consumer accepted the job, False otherwise
     """
     try:
-        async with engine.acquire() as connection:
-            response = await consumer_client.submit_infernal_job(consumer_ip, consumer_port, job_id, query)
+        # no database connection is held during the request, so that many requests can run at the same time
+        response = await consumer_client.submit_infernal_job(consumer_ip, consumer_port, job_id, query)
 
-            if response is None or response.status >= 400:
-                text = await response.text() if response else "No response from consumer"
-                raise ConsumerConnectionError(f"Error from consumer: {text}")
+        if response is None or response.status >= 400:
+            text = await response.text() if response else "No response from consumer"
+            raise ConsumerConnectionError(f"Error from consumer: {text}")
+        return True
     except ClientConnectionError:
         logging.error(f"Connection error while submitting job {job_id} to {consumer_ip}:{consumer_port}.")
     except ClientResponseError as e:
@@ -236,6 +550,7 @@ async def delegate_infernal_job_to_consumer(engine, consumer_ip, consumer_port,
         logging.error(f"Database error: {str(e)}")
     except Exception as e:
         logging.error(f"Unexpected error: {str(e)}")
+    return False
 
 
 def get_ip(app):
@@ -289,14 +604,18 @@ async def register_consumer_in_the_database(app):
     try:
         async with app['engine'].acquire() as connection:
             sql_query = sa.text('''
-                INSERT INTO consumer(ip, status, port)
-                VALUES (:consumer_ip, :status, :port)
+                INSERT INTO consumer(ip, status, port, slots, running)
+                VALUES (:consumer_ip, :status, :port, :slots, 0)
+                ON CONFLICT (ip) DO UPDATE
+                SET slots = EXCLUDED.slots, port = EXCLUDED.port, running = 0,
+                    status = EXCLUDED.status, job_chunk_id = NULL
             ''')
             await connection.execute(
                 sql_query,
                 consumer_ip=get_ip(app), # 'host.docker.internal',
                 status=CONSUMER_STATUS_CHOICES.available,
-                port=PORT
+                port=PORT,
+                slots=app.get('slots', 1)
             )
     except psycopg2.IntegrityError as e:
         pass  # this is usually a duplicate key error - which is acceptable
@@ -16,7 +16,7 @@ import psycopg2
 
 from . import DatabaseConnectionError, SQLError
 
-from .models import InfernalJob, JOB_CHUNK_STATUS_CHOICES
+from .models import InfernalJob, JOB_CHUNK_STATUS_CHOICES, CONSUMER_STATUS_CHOICES
 
 
 async def save_infernal_job(engine, job_id, priority):
@@ -138,3 +138,97 @@ async def set_consumer_to_infernal_job(engine, job_id, consumer_ip):
     except psycopg2.Error as e:
         raise DatabaseConnectionError("Failed to open connection to the database in set_consumer_to_infernal_job, "
                                       "job_id = %s" % job_id) from e
+
+
+async def start_infernal_job(engine, job_id, consumer_ip):
+    """
+    Starts the infernal job on a consumer and takes one of the consumer slots, in a single statement.
+    Same as set_infernal_job_status(started), set_consumer_to_infernal_job and acquire_consumer_slot together.
+
+    :param engine: params to connect to the db
+    :param job_id: id of the job
+    :param consumer_ip: ip address of the consumer
+    :return: id of the infernal job, or None if it does not exist (no slot is taken then)
+    """
+    try:
+        async with engine.acquire() as connection:
+            try:
+                query = sa.text('''
+                    WITH infernal AS (
+                        UPDATE infernal_job
+                        SET status = :started, consumer = :consumer_ip, submitted = :now
+                        WHERE job_id = :job_id
+                        RETURNING id
+                    ), slot AS (
+                        UPDATE consumer
+                        SET running = running + 1,
+                            status = CASE WHEN running + 1 >= slots THEN :busy ELSE :available END,
+                            job_chunk_id = 'infernal-job'
+                        WHERE ip = :consumer_ip AND EXISTS (SELECT 1 FROM infernal)
+                    )
+                    SELECT id FROM infernal
+                ''')
+                async for row in await connection.execute(
+                        query,
+                        job_id=job_id,
+                        consumer_ip=consumer_ip,
+                        now=datetime.datetime.now(),
+                        started=JOB_CHUNK_STATUS_CHOICES.started,
+                        busy=CONSUMER_STATUS_CHOICES.busy,
+                        available=CONSUMER_STATUS_CHOICES.available):
+                    return row.id
+                return None
+            except Exception as e:
+                raise SQLError("Failed to start_infernal_job in the database, job_id = %s" % job_id) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open connection to the database in start_infernal_job, "
+                                      "job_id = %s" % job_id) from e
+
+
+async def finish_infernal_job(engine, job_id, consumer_ip, status):
+    """
+    Finishes the infernal job and frees the consumer slot, in a single statement.
+    Same as set_infernal_job_status and release_consumer_slot together.
+
+    :param engine: params to connect to the db
+    :param job_id: id of the job
+    :param consumer_ip: ip address of the consumer
+    :param status: success, error or timeout
+    :return: id of the infernal job or None
+    """
+    try:
+        async with engine.acquire() as connection:
+            try:
+                query = sa.text('''
+                    WITH infernal AS (
+                        UPDATE infernal_job
+                        SET status = :status, finished = :now
+                        WHERE job_id = :job_id
+                        RETURNING id
+                    ), slot AS (
+                        UPDATE consumer
+                        SET running = GREATEST(running - 1, 0),
+                            status = CASE WHEN status = :suspect THEN status
+                                          WHEN running - 1 >= slots THEN :busy ELSE :available END,
+                            job_chunk_id = CASE WHEN running <= 1 THEN NULL ELSE job_chunk_id END
+                        WHERE ip = :consumer_ip
+                    )
+                    SELECT id FROM infernal
+                ''')
+                async for row in await connection.execute(
+                        query,
+                        job_id=job_id,
+                        consumer_ip=consumer_ip,
+                        status=status,
+                        now=datetime.datetime.now(),
+                        available=CONSUMER_STATUS_CHOICES.available,
+                        busy=CONSUMER_STATUS_CHOICES.busy,
+                        suspect=CONSUMER_STATUS_CHOICES.suspect):
+                    return row.id
+                return None
+            except Exception as e:
+                raise SQLError("Failed to finish_infernal_job in the database, job_id = %s, "
+                               "status = %s" % (job_id, status)) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open connection to the database in finish_infernal_job, "
+                                      "job_id = %s" % job_id) from e
@@ -11,31 +11,175 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import datetime
+import logging
+import resource
+
 import sqlalchemy as sa
 import psycopg2
 
 from . import DatabaseConnectionError, SQLError
-from .models import JobChunkResult
+from .models import JobChunk, JobChunkResult
+
+
+# number of results kept for each job: the rows of a job chunk that are not among them are never saved
+TOP_RESULTS = 1000
+
+# rows per INSERT statement when the engine can't COPY, so that the SQL of a job chunk never gets huge
+INSERT_BATCH_SIZE = 100
+
+# columns of the results, in the order of the COPY rows
+COLUMNS = [column for column in JobChunkResult.columns if column.name != 'id']
+
+
+def converter(column):
+    """COPY sends the values in binary, they have to be of the python type of the column"""
+    if isinstance(column.type, sa.Integer):
+        return int
+    elif isinstance(column.type, sa.Float):
+        return float
+    return str
+
+
+CONVERTERS = [(column.name, converter(column)) for column in COLUMNS if column.name != 'job_chunk_id']
+
+
+def result_rows(job_chunk_id, results):
+    """Yields the results as tuples in the order of COLUMNS"""
+    for result in results:
+        row = [job_chunk_id]
+        for name, convert in CONVERTERS:
+            value = result.get(name)
+            row.append(convert(value) if value is not None else None)
+        yield tuple(row)
+
+
+def text_size(results):
+    """Returns the number of characters of the text values (alignments, descriptions...) of the results"""
+    return sum(len(value) for result in results for value in result.values() if isinstance(value, str))
 
 
-async def set_job_chunk_results(engine, job_id, database, results):
+def top_results(rows, limit):
+    """
+    Selects the top results of a job: the best scoring row of each rnacentral_id (the same sequence
+    can be found in the database files of overlapping databases), and only the limit best of those.
+
+    :param rows: list of (key, job_chunk_id, rnacentral_id, score), on equal scores the first row wins
+    :param limit: maximum number of selected rows
+    :return: (set of the keys of the selected rows, set of the job_chunk_ids that lost some of their rnacentral_ids)
+    """
+    selected, found = set(), set()
+    rnacentral_ids = set()
+    for key, job_chunk_id, rnacentral_id, score in sorted(rows, key=lambda row: -row[3]):
+        if rnacentral_id in rnacentral_ids or len(rnacentral_ids) >= limit:
+            continue
+        rnacentral_ids.add(rnacentral_id)
+        selected.add(key)
+        found.add((job_chunk_id, rnacentral_id))
+
+    pruned = set(job_chunk_id for key, job_chunk_id, rnacentral_id, score in rows
+                 if (job_chunk_id, rnacentral_id) not in found)
+    return selected, pruned
+
+
+async def merge_top_results(connection, job_id, rows, limit=TOP_RESULTS):
+    """
+    Merges new rows into the top results of a job, see top_results: deletes the saved results of the job
+    that drop out of them and flags the job_chunks that lost some results as pruned, so that they are
+    not reused (see job_chunks.find_reusable_job_chunks). The caller locks the job row.
+
+    :param connection: connection in a transaction
+    :param job_id: id of the job
+    :param rows: list of (key, job_chunk_id, rnacentral_id, score) of the new rows, their keys are not ids of saved rows
+    :param limit: number of top results of the job
+    :return: set of the keys of the new rows to save
+    """
+    # the rows already saved come first, so that they are kept on equal scores
+    query = sa.text('''
+        SELECT job_chunk_results.id, job_chunk_results.job_chunk_id, rnacentral_id, score
+        FROM job_chunk_results
+        JOIN job_chunks ON job_chunks.id = job_chunk_results.job_chunk_id
+        WHERE job_chunks.job_id = :job_id
+        ORDER BY job_chunk_results.id
+    ''')
+    saved = []
+    async for row in await connection.execute(query, job_id=job_id):
+        saved.append((row.id, row.job_chunk_id, row.rnacentral_id, row.score))
+    selected, pruned = top_results(saved + list(rows), limit)
+
+    dropped = [key for key, _, _, _ in saved if key not in selected]
+    if dropped:
+        await connection.execute(JobChunkResult.delete().where(JobChunkResult.c.id.in_(dropped)))
+    if pruned:
+        await connection.execute(JobChunk.update().where(JobChunk.c.id.in_(sorted(pruned))).values(pruned=True))
+
+    return selected
+
+
+async def set_job_chunk_results(engine, job_id, database, results, job_chunk_id=None, limit=TOP_RESULTS):
+    """
+    Merges the results of a job chunk into the top results of its job, see merge_top_results.
+    Only the results that make it to the top are saved. The job row is locked, so that the
+    job chunks of a job are merged one at a time.
+
+    With the asyncpg engine the rows are streamed with the binary COPY protocol, so the server
+    doesn't parse any SQL with the (multi-kilobyte) alignments. psycopg2 can't COPY on an
+    asynchronous connection, so with the aiopg engine they are inserted INSERT_BATCH_SIZE at a time.
+
+    :param engine: params to connect to the db
+    :param job_id: id of the job
+    :param database: database file of the job chunk
+    :param results: list of results in the nhmmer_parse format
+    :param job_chunk_id: id of the job chunk, looked up from job_id and database if None
+    :param limit: number of top results of the job
+    :return: number of saved results
+    """
     try:
         async with engine.acquire() as connection:
             try:
-                query = sa.text('''
-                    SELECT id
-                    FROM job_chunks
-                    WHERE job_id=:job_id AND database=:database
-                ''')
+                async with connection.begin():
+                    await connection.execute(
+                        sa.text('''SELECT id FROM jobs WHERE id = :job_id FOR UPDATE'''), job_id=job_id
+                    )
+
+                    if job_chunk_id is None:
+                        query = sa.text('''
+                            SELECT id
+                            FROM job_chunks
+                            WHERE job_id=:job_id AND database=:database
+                        ''')
+
+                        async for row in await connection.execute(query, job_id=job_id, database=database):
+                            job_chunk_id = row.id
+                            break
 
-                async for row in await connection.execute(query, job_id=job_id, database=database):
-                    job_chunk_id = row.id
-                    break
+                    # the new results are keyed by negative indexes, so that they never clash with the ids
+                    selected = await merge_top_results(connection, job_id, [
+                        (-index, job_chunk_id, result['rnacentral_id'], result['score'])
+                        for index, result in enumerate(results, start=1)
+                    ], limit)
+                    results = [result for index, result in enumerate(results, start=1) if -index in selected]
 
-                for result in results:
-                    result['job_chunk_id'] = job_chunk_id
+                    t0 = datetime.datetime.now()
+                    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                    if hasattr(connection, 'copy_records'):
+                        saved = await connection.copy_records(
+                            JobChunkResult.name, [column.name for column in COLUMNS], result_rows(job_chunk_id, results)
+                        )
+                    else:
+                        names = [column.name for column in COLUMNS]
+                        rows = [dict(zip(names, row)) for row in result_rows(job_chunk_id, results)]
+                        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                            await connection.execute(
+                                JobChunkResult.insert().values(rows[start:start + INSERT_BATCH_SIZE])
+                            )
+                        saved = len(rows)
 
-                await connection.execute(JobChunkResult.insert().values(results))
+                    logging.debug("Time - saving {} results ({} KB of text) in {} seconds, peak memory grew by {} KB"
+                                  .format(saved, text_size(results) // 1024,
+                                          (datetime.datetime.now() - t0).total_seconds(),
+                                          resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - maxrss))
+                    return saved
             except Exception as e:
                 raise SQLError("Failed to set_job_chunk_results in the database, "
                                "job_id = %s, database = %s" % (job_id, database)) from e
@@ -16,9 +16,13 @@ import logging
 import sqlalchemy as sa
 import psycopg2
 
+from collections import namedtuple
 from tenacity import retry, stop_after_attempt, wait_fixed
 from . import DatabaseConnectionError, SQLError, DoesNotExist
-from .models import JobChunk, JOB_CHUNK_STATUS_CHOICES
+from .job_chunk_results import merge_top_results
+from .jobs import query_digest
+from .models import Job, JobChunk, JobChunkResult, JobResult, Consumer, JOB_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES, \
+    CONSUMER_STATUS_CHOICES
 
 
 async def get_job_chunk(engine, job_chunk_id):
@@ -60,13 +64,17 @@ async def get_job_chunk_from_job_and_database(engine, job_id, database):
                                       "for job_id = %s, database = %s" % (job_id, database)) from e
 
 
-async def save_job_chunk(engine, job_id, database):
+async def save_job_chunk(engine, job_id, database, rank=0, release=None, predicted_runtime=None, timeout=None):
     """
     Jobs are divided into chunks and each chunk searches for sequences in a piece of the database.
     Here we are saving a job chunk for a specific fasta file.
     :param engine: params to connect to the db
     :param job_id: id of the job
     :param database: fasta file with RNAcentral data
+    :param rank: job chunks with a lower rank are dispatched first
+    :param release: fingerprint of the fasta file, see rnacentral_databases.database_release
+    :param predicted_runtime: expected runtime in seconds, see producer.runtime_model
+    :param timeout: seconds after which the consumer gives up the job chunk, MAX_RUN_TIME if None
     :return: id of the job chunk
     """
     try:
@@ -76,7 +84,11 @@ async def save_job_chunk(engine, job_id, database):
                     JobChunk.insert().values(
                         job_id=job_id,
                         database=database,
-                        status=JOB_CHUNK_STATUS_CHOICES.created
+                        status=JOB_CHUNK_STATUS_CHOICES.created,
+                        rank=rank,
+                        release=release,
+                        predicted_runtime=predicted_runtime,
+                        timeout=timeout
                     )
                 )
                 return job_chunk_id
@@ -87,6 +99,185 @@ async def save_job_chunk(engine, job_id, database):
                                       "for job_id = %s, database = %s" % (job_id, database)) from e
 
 
+async def get_job_chunk_timeout(engine, job_chunk_id):
+    """Returns the timeout in seconds set by the producer for the job chunk, or None"""
+    try:
+        async with engine.acquire() as connection:
+            return await connection.scalar(sa.select([JobChunk.c.timeout]).where(JobChunk.c.id == job_chunk_id))
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open database connection in get_job_chunk_timeout "
+                                      "for job_chunk_id = %s" % job_chunk_id) from e
+
+
+async def get_job_chunk_runtimes(engine, since):
+    """
+    Returns the runtimes of the job chunks searched by a consumer since the given time,
+    for the runtime model of the producer. Job chunks with results copied from another job
+    or skipped without a search have no consumer or no start time and are left out.
+
+    :param engine: params to connect to the db
+    :param since: datetime of the oldest job chunk
+    :return: list of (database, query length, seconds)
+    """
+    try:
+        async with engine.acquire() as connection:
+            try:
+                query = sa.text('''
+                    SELECT job_chunks.database, length(jobs.query) AS query_length,
+                           EXTRACT(EPOCH FROM job_chunks.finished - job_chunks.submitted) AS runtime
+                    FROM job_chunks
+                    JOIN jobs ON jobs.id = job_chunks.job_id
+                    WHERE job_chunks.status = :success
+                    AND job_chunks.consumer IS NOT NULL
+                    AND job_chunks.submitted IS NOT NULL
+                    AND job_chunks.finished >= :since
+                ''')
+
+                output = []
+                async for row in await connection.execute(query, success=JOB_CHUNK_STATUS_CHOICES.success, since=since):
+                    output.append((row.database, row.query_length, float(row.runtime)))
+                return output
+            except Exception as e:
+                raise SQLError("Failed to get job_chunk runtimes") from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open database connection in get_job_chunk_runtimes") from e
+
+
+async def get_job_runtimes(engine, job_id):
+    """Returns the predicted and actual runtimes in seconds of the job chunks of a job"""
+    try:
+        async with engine.acquire() as connection:
+            try:
+                query = (
+                    sa.select([JobChunk.c.database, JobChunk.c.status, JobChunk.c.submitted, JobChunk.c.finished,
+                               JobChunk.c.predicted_runtime, JobChunk.c.timeout])
+                    .where(JobChunk.c.job_id == job_id)
+                    .order_by(JobChunk.c.rank, JobChunk.c.id)
+                )
+
+                output = []
+                async for row in await connection.execute(query):
+                    runtime = None
+                    if row.submitted and row.finished:
+                        runtime = (row.finished - row.submitted).total_seconds()
+                    output.append({
+                        'database': row.database,
+                        'status': row.status,
+                        'predicted_runtime': row.predicted_runtime,
+                        'runtime': runtime,
+                        'timeout': row.timeout
+                    })
+                return output
+            except Exception as e:
+                raise SQLError("Failed to get job runtimes for job_id = %s" % job_id) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open database connection in get_job_runtimes "
+                                      "for job_id = %s" % job_id) from e
+
+
+async def find_reusable_job_chunks(engine, query, releases):
+    """
+    Finds finished job_chunks of other jobs that searched the same query against the same database files.
+    A job_chunk is only reusable if its database file has not changed since, i.e. if it has the same release,
+    and if all its results were saved, i.e. none of them were left out of the top results of its job.
+
+    :param engine: params to connect to the db
+    :param query: query sequence
+    :param releases: dict {database: release} of the database files to search
+    :return: dict {database: (job_chunk_id, hits)} with the most recent reusable job_chunk of each database
+    """
+    releases = {database: release for database, release in releases.items() if release}
+    if not releases:
+        return {}
+
+    try:
+        async with engine.acquire() as connection:
+            try:
+                sql = (
+                    sa.select([JobChunk.c.database, JobChunk.c.id, JobChunk.c.hits])
+                    .select_from(sa.join(JobChunk, Job, JobChunk.c.job_id == Job.c.id))
+                    .where(sa.and_(
+                        Job.c.query_digest == query_digest(query),
+                        JobChunk.c.status == JOB_CHUNK_STATUS_CHOICES.success,
+                        JobChunk.c.pruned.isnot(True),
+                        sa.tuple_(JobChunk.c.database, JobChunk.c.release).in_(list(releases.items()))
+                    ))
+                    .order_by(JobChunk.c.finished.asc())
+                )
+
+                job_chunks = {}
+                async for row in await connection.execute(sql):
+                    job_chunks[row.database] = (row.id, row.hits)
+                return job_chunks
+            except Exception as e:
+                raise SQLError("Failed to find reusable job_chunks for query = %s" % query) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open database connection in find_reusable_job_chunks "
+                                      "for query = %s" % query) from e
+
+
+async def copy_job_chunk_results(engine, job_id, database, job_chunk_id, hits):
+    """
+    Copies the results of a finished job_chunk of another job to the job_chunk of this job
+    and marks it as finished, so that it doesn't have to be searched again. Like the results
+    of a search, only those that make it to the top results of the job are saved.
+    The results are copied rather than referenced, because old jobs are deleted with their results.
+
+    :param engine: params to connect to the db
+    :param job_id: id of the job
+    :param database: fasta file of the job_chunk
+    :param job_chunk_id: id of the finished job_chunk, as returned by find_reusable_job_chunks
+    :param hits: total number of hits of the finished job_chunk
+    :return: None
+    """
+    columns = [column.name for column in JobChunkResult.c if column.name not in ('id', 'job_chunk_id')]
+
+    try:
+        async with engine.acquire() as connection:
+            try:
+                async with connection.begin():
+                    await connection.execute(
+                        sa.text('''SELECT id FROM jobs WHERE id = :job_id FOR UPDATE'''), job_id=job_id
+                    )
+
+                    new_job_chunk_id = await connection.scalar(
+                        sa.select([JobChunk.c.id])
+                        .where(sa.and_(JobChunk.c.job_id == job_id, JobChunk.c.database == database))
+                    )
+
+                    # only the results that make it to the top results of the job are copied
+                    rows = []
+                    async for row in await connection.execute(
+                            sa.select([JobChunkResult.c.id, JobChunkResult.c.rnacentral_id, JobChunkResult.c.score])
+                            .where(JobChunkResult.c.job_chunk_id == job_chunk_id)
+                            .order_by(JobChunkResult.c.id)):
+                        rows.append((row.id, new_job_chunk_id, row.rnacentral_id, row.score))
+                    selected = await merge_top_results(connection, job_id, rows)
+
+                    if selected:
+                        await connection.execute(
+                            JobChunkResult.insert().from_select(
+                                ['job_chunk_id'] + columns,
+                                sa.select(
+                                    [sa.literal(new_job_chunk_id)] + [JobChunkResult.c[column] for column in columns]
+                                ).where(JobChunkResult.c.id.in_(sorted(selected)))
+                            )
+                        )
+
+                    now = datetime.datetime.now()
+                    await connection.execute(
+                        JobChunk.update()
+                        .where(JobChunk.c.id == new_job_chunk_id)
+                        .values(status=JOB_CHUNK_STATUS_CHOICES.success, submitted=now, finished=now, hits=hits)
+                    )
+            except Exception as e:
+                raise SQLError("Failed to copy job_chunk results for job_id = %s, database = %s" %
+                               (job_id, database)) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open database connection in copy_job_chunk_results "
+                                      "for job_id = %s, database = %s" % (job_id, database)) from e
+
+
 async def get_consumer_ip_from_job_chunk(engine, job_chunk_id):
     try:
         async with engine.acquire() as connection:
@@ -162,6 +353,308 @@ async def set_job_chunk_status(engine, job_id, database, status, hits=None):
         raise SQLError(f"Failed to update job chunk status for job_id={job_id}, database={database}") from e
 
 
+async def start_job_chunk(engine, job_id, database, consumer_ip):
+    """
+    Starts a job_chunk on a consumer and takes one of the consumer slots, in a single statement.
+    Same as set_job_chunk_status(started), set_job_chunk_consumer and acquire_consumer_slot together.
+
+    :param engine: params to connect to the db
+    :param job_id: id of the job
+    :param database: an all-except-rrna- or whitelist-rrna-* file
+    :param consumer_ip: IP of the consumer that runs the job chunk
+    :return: id of the job_chunk, or None if it does not exist or is neither created nor pending,
+        e.g. a late or duplicate start of a job_chunk that was already started or finished (no slot is taken then)
+    """
+    try:
+        async with engine.acquire() as connection:
+            try:
+                query = sa.text('''
+                    WITH chunk AS (
+                        UPDATE job_chunks
+                        SET status = :started, consumer = :consumer_ip, submitted = :now
+                        WHERE job_id = :job_id AND database = :database AND status IN (:created, :pending)
+                        RETURNING id
+                    ), slot AS (
+                        UPDATE consumer
+                        SET running = running + 1,
+                            status = CASE WHEN running + 1 >= slots THEN :busy ELSE :available END,
+                            job_chunk_id = CAST(chunk.id AS VARCHAR)
+                        FROM chunk
+                        WHERE ip = :consumer_ip
+                    )
+                    SELECT id FROM chunk
+                ''')
+                async for row in await connection.execute(
+                        query,
+                        job_id=job_id,
+                        database=database,
+                        consumer_ip=consumer_ip,
+                        now=datetime.datetime.now(),
+                        created=JOB_CHUNK_STATUS_CHOICES.created,
+                        pending=JOB_CHUNK_STATUS_CHOICES.pending,
+                        started=JOB_CHUNK_STATUS_CHOICES.started,
+                        busy=CONSUMER_STATUS_CHOICES.busy,
+                        available=CONSUMER_STATUS_CHOICES.available):
+                    return row.id
+                return None
+            except Exception as e:
+                raise SQLError("Failed to start job_chunk, job_id = %s, database = %s, consumer = %s" %
+                               (job_id, database, consumer_ip)) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open database connection in start_job_chunk for job_id = %s, "
+                                      "database = %s" % (job_id, database)) from e
+
+
+FinishedJobChunk = namedtuple('FinishedJobChunk', ['job_chunk_id', 'job_finished'])
+
+
+async def finish_job_chunk(engine, job_id, database, consumer_ip, status, hits=None):
+    """
+    Finishes a job_chunk, frees the consumer slot and, if it was the last unfinished job_chunk,
+    finishes the job with the total number of hits. Same as set_job_chunk_status, release_consumer_slot
+    and update_job_status_from_job_chunks_status together.
+
+    The job row is locked first, so that the last two job_chunks of a job finishing at the same time
+    see each other and one of them finishes the job. The job_chunk is only finished if it is still
+    started on this consumer: if its lease expired and it was requeued (see requeue_expired_job_chunks),
+    it belongs to another consumer now and only the slot is freed.
+
+    :param engine: params to connect to the db
+    :param job_id: id of the job
+    :param database: an all-except-rrna- or whitelist-rrna-* file
+    :param consumer_ip: IP of the consumer that ran the job chunk
+    :param status: success, error or timeout
+    :param hits: total number of hits (optional)
+    :return: FinishedJobChunk(job_chunk_id, job_finished), or None if the job_chunk was not started on this consumer
+    """
+    try:
+        async with engine.acquire() as connection:
+            try:
+                async with connection.begin():
+                    await connection.execute(
+                        sa.text('''SELECT id FROM jobs WHERE id = :job_id FOR UPDATE'''), job_id=job_id
+                    )
+
+                    query = sa.text('''
+                        WITH chunk AS (
+                            UPDATE job_chunks
+                            SET status = :status, finished = :now, hits = :hits, lease_expires = NULL
+                            WHERE job_id = :job_id AND database = :database
+                            AND status = :started AND consumer = :consumer_ip
+                            RETURNING id, status, hits
+                        ), slot AS (
+                            UPDATE consumer
+                            SET running = GREATEST(running - 1, 0),
+                                status = CASE WHEN status = :suspect THEN status
+                                              WHEN running - 1 >= slots THEN :busy ELSE :available END,
+                                job_chunk_id = CASE WHEN running <= 1 THEN NULL ELSE job_chunk_id END
+                            WHERE ip = :consumer_ip
+                        ), others AS (
+                            SELECT count(*) FILTER (WHERE status IN (:created, :pending, :started)) AS unfinished,
+                                   count(*) FILTER (WHERE status IN (:error, :timeout)) AS errors,
+                                   COALESCE(sum(hits), 0) AS hits
+                            FROM job_chunks
+                            WHERE job_id = :job_id AND id NOT IN (SELECT id FROM chunk)
+                        ), job AS (
+                            UPDATE jobs
+                            SET status = CASE WHEN others.errors = 0 AND chunk.status = :success
+                                              THEN :job_success ELSE :partial_success END,
+                                finished = :now,
+                                hits = others.hits + COALESCE(chunk.hits, 0)
+                            FROM chunk, others
+                            WHERE jobs.id = :job_id AND others.unfinished = 0
+                            RETURNING jobs.id
+                        )
+                        SELECT chunk.id, EXISTS (SELECT 1 FROM job) AS job_finished FROM chunk
+                    ''')
+                    async for row in await connection.execute(
+                            query,
+                            job_id=job_id,
+                            database=database,
+                            consumer_ip=consumer_ip,
+                            status=status,
+                            hits=hits,
+                            now=datetime.datetime.now(),
+                            created=JOB_CHUNK_STATUS_CHOICES.created,
+                            pending=JOB_CHUNK_STATUS_CHOICES.pending,
+                            started=JOB_CHUNK_STATUS_CHOICES.started,
+                            success=JOB_CHUNK_STATUS_CHOICES.success,
+                            error=JOB_CHUNK_STATUS_CHOICES.error,
+                            timeout=JOB_CHUNK_STATUS_CHOICES.timeout,
+                            job_success=JOB_STATUS_CHOICES.success,
+                            partial_success=JOB_STATUS_CHOICES.partial_success,
+                            available=CONSUMER_STATUS_CHOICES.available,
+                            busy=CONSUMER_STATUS_CHOICES.busy,
+                            suspect=CONSUMER_STATUS_CHOICES.suspect):
+                        return FinishedJobChunk(row.id, row.job_finished)
+                    return None
+            except Exception as e:
+                raise SQLError("Failed to finish job_chunk, job_id = %s, database = %s, status = %s" %
+                               (job_id, database, status)) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open database connection in finish_job_chunk for job_id = %s, "
+                                      "database = %s" % (job_id, database)) from e
+
+
+async def requeue_job_chunks(engine, job_chunks):
+    """
+    Changes the status of the job_chunks that no consumer has started to pending, with a single query,
+    so that check_chunks_and_consumers dispatches them later.
+    Job chunks that a consumer has already started in the meantime are left untouched.
+
+    :param engine: params to connect to the db
+    :param job_chunks: list of (job_id, database)
+    :return: None
+    """
+    job_chunks = list(job_chunks)
+    if not job_chunks:
+        return
+
+    try:
+        async with engine.acquire() as connection:
+            try:
+                await connection.execute(
+                    JobChunk.update()
+                    .where(sa.and_(
+                        sa.tuple_(JobChunk.c.job_id, JobChunk.c.database).in_(job_chunks),
+                        JobChunk.c.status == JOB_CHUNK_STATUS_CHOICES.created
+                    ))
+                    .values(status=JOB_CHUNK_STATUS_CHOICES.pending)
+                )
+            except Exception as e:
+                raise SQLError("Failed to requeue job_chunks = %s" % job_chunks) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open database connection in requeue_job_chunks "
+                                      "for job_chunks = %s" % job_chunks) from e
+
+
+async def renew_job_chunk_leases(engine, consumer_ip, job_chunks, expires):
+    """
+    Extends the leases of the job_chunks that a consumer is still running, see views/job_chunk_heartbeat.
+    Job chunks that were requeued in the meantime belong to no consumer and are left untouched.
+
+    :param engine: params to connect to the db
+    :param consumer_ip: IP of the consumer that sent the heartbeat
+    :param job_chunks: list of (job_id, database)
+    :param expires: datetime of the new end of the leases
+    :return: number of renewed leases
+    """
+    job_chunks = [tuple(job_chunk) for job_chunk in job_chunks]
+    if not job_chunks:
+        return 0
+
+    try:
+        async with engine.acquire() as connection:
+            try:
+                result = await connection.execute(
+                    JobChunk.update()
+                    .where(sa.and_(
+                        sa.tuple_(JobChunk.c.job_id, JobChunk.c.database).in_(job_chunks),
+                        JobChunk.c.consumer == consumer_ip,
+                        JobChunk.c.status == JOB_CHUNK_STATUS_CHOICES.started
+                    ))
+                    .values(lease_expires=expires)
+                )
+                return result.rowcount
+            except Exception as e:
+                raise SQLError("Failed to renew the leases of consumer_ip = %s" % consumer_ip) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open database connection in renew_job_chunk_leases "
+                                      "for consumer_ip = %s" % consumer_ip) from e
+
+
+async def requeue_expired_job_chunks(engine, now, lease_duration, created_timeout):
+    """
+    Changes the status of the job_chunks that are stuck back to pending, so that another consumer runs them:
+     - started job_chunks whose lease has expired, i.e. the consumer stopped sending heartbeats for them.
+       A job_chunk without a lease (e.g. started before its first heartbeat) expires lease_duration
+       seconds after it was started. Their consumers are marked as suspect and get no more work
+       until they send a heartbeat again.
+     - created job_chunks of jobs submitted more than created_timeout seconds ago, e.g. because
+       the producer failed while submitting the job. Their jobs are started again if they were
+       already considered finished.
+
+    :param engine: params to connect to the db
+    :param now: current datetime
+    :param lease_duration: seconds
+    :param created_timeout: seconds
+    :return: list of (job_id, database, consumer) of the requeued job_chunks, consumer is None for created ones
+    """
+    try:
+        async with engine.acquire() as connection:
+            try:
+                async with connection.begin():
+                    query = sa.text('''
+                        WITH expired AS (
+                            SELECT id, consumer
+                            FROM job_chunks
+                            WHERE status = :started
+                            AND (lease_expires < :now OR (lease_expires IS NULL AND submitted < :started_before))
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        UPDATE job_chunks
+                        SET status = :pending, consumer = NULL, lease_expires = NULL
+                        FROM expired
+                        WHERE job_chunks.id = expired.id
+                        RETURNING job_chunks.job_id, job_chunks.database, expired.consumer
+                    ''')
+                    expired = []
+                    async for row in await connection.execute(
+                            query,
+                            started=JOB_CHUNK_STATUS_CHOICES.started,
+                            pending=JOB_CHUNK_STATUS_CHOICES.pending,
+                            now=now,
+                            started_before=now - datetime.timedelta(seconds=lease_duration)):
+                        expired.append((row.job_id, row.database, row.consumer))
+
+                    consumers = set(consumer for job_id, database, consumer in expired if consumer)
+                    if consumers:
+                        await connection.execute(
+                            Consumer.update()
+                            .where(sa.and_(
+                                Consumer.c.ip.in_(consumers),
+                                Consumer.c.status.in_([CONSUMER_STATUS_CHOICES.available,
+                                                       CONSUMER_STATUS_CHOICES.busy])
+                            ))
+                            .values(status=CONSUMER_STATUS_CHOICES.suspect)
+                        )
+
+                    query = sa.text('''
+                        UPDATE job_chunks
+                        SET status = :pending
+                        FROM jobs
+                        WHERE jobs.id = job_chunks.job_id
+                        AND job_chunks.status = :created
+                        AND jobs.submitted < :submitted_before
+                        RETURNING job_chunks.job_id, job_chunks.database
+                    ''')
+                    created = []
+                    async for row in await connection.execute(
+                            query,
+                            created=JOB_CHUNK_STATUS_CHOICES.created,
+                            pending=JOB_CHUNK_STATUS_CHOICES.pending,
+                            submitted_before=now - datetime.timedelta(seconds=created_timeout)):
+                        created.append((row.job_id, row.database, None))
+
+                    jobs = set(job_id for job_id, database, consumer in created)
+                    if jobs:
+                        await connection.execute(
+                            Job.update()
+                            .where(sa.and_(
+                                Job.c.id.in_(jobs),
+                                Job.c.status.in_([JOB_STATUS_CHOICES.success, JOB_STATUS_CHOICES.partial_success])
+                            ))
+                            .values(status=JOB_STATUS_CHOICES.started, finished=None)
+                        )
+                        await connection.execute(JobResult.delete().where(JobResult.c.job_id.in_(jobs)))
+
+                    return expired + created
+            except Exception as e:
+                raise SQLError("Failed to requeue the expired job_chunks") from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open database connection in requeue_expired_job_chunks") from e
+
+
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(3))
 async def set_job_chunk_consumer(engine, job_id, database, consumer_ip):
     """
@@ -12,18 +12,28 @@ limitations under the License.
 """
 
 import datetime
+import hashlib
+import re
 import uuid
 
 import sqlalchemy as sa
 import psycopg2
-from collections import Counter
+from collections import Counter, namedtuple
 from operator import itemgetter
 
 from . import DatabaseConnectionError, SQLError
-from .models import Job, InfernalJob, InfernalResult, JobChunk, JobChunkResult, JOB_STATUS_CHOICES, \
+from .job_chunk_results import TOP_RESULTS, merge_top_results
+from .models import Job, InfernalJob, InfernalResult, JobChunk, JobChunkResult, JobResult, JOB_STATUS_CHOICES, \
     JOB_CHUNK_STATUS_CHOICES
 
 
+"""Work of a job that is waiting for a consumer, see find_pending_jobs"""
+PendingJob = namedtuple('PendingJob', ['job_id', 'priority', 'submitted', 'source', 'chunks', 'infernal'])
+
+# queued job chunks and infernal jobs of a priority, see get_queue_depth
+QueueDepth = namedtuple('QueueDepth', ['tasks', 'predicted_runtime', 'unpredicted'])
+
+
 class JobNotFound(Exception):
     def __init__(self, job_id):
         self.job_id = job_id
@@ -32,6 +42,64 @@ class JobNotFound(Exception):
         return "Job '%s' not found" % self.job_id
 
 
+def query_digest(query):
+    """
+    Canonical digest of a query sequence, independent of case, whitespace and T/U:
+    md5 of the upper-case DNA sequence, the same as the md5 of RNAcentral sequences.
+    """
+    return hashlib.md5(re.sub(r'\s', '', query).upper().replace('U', 'T').encode()).hexdigest()
+
+
+def databases_digest(releases):
+    """
+    Digest of the database files searched by a job and of their releases, independent of their order,
+    so that a new release of a database file gives a new digest and a new job.
+    None if the release of a file is not known, such a job is never reused as a whole.
+    :param releases: dict {database: release}, see rnacentral_databases.database_release
+    """
+    if not releases or any(release is None for release in releases.values()):
+        return None
+    return hashlib.md5(','.join(sorted('%s:%s' % item for item in releases.items())).encode()).hexdigest()
+
+
+async def find_reusable_job(engine, query, releases):
+    """
+    Find a job that has already searched this query against the same releases of the same database files.
+    Jobs searched against an older release of any of the files are not reused, their job_chunks
+    are left to find_reusable_job_chunks.
+    :param engine: params to connect to the db
+    :param query: the sequence that the user wants to search
+    :param releases: dict {database: release} of the database files returned by producer_to_consumers_databases
+    :return: job_id or None
+    """
+    digest = databases_digest(releases)
+    if digest is None:
+        return None
+
+    try:
+        async with engine.acquire() as connection:
+            try:
+                # the digest covers the releases, but the job_chunks are checked as well
+                outdated = sa.select([JobChunk.c.id]).where(sa.and_(
+                    JobChunk.c.job_id == Job.c.id,
+                    sa.or_(
+                        JobChunk.c.release.is_(None),
+                        ~sa.tuple_(JobChunk.c.database, JobChunk.c.release).in_(list(releases.items()))
+                    )
+                ))
+                sql_query = sa.select([Job.c.id]).select_from(Job).where(sa.and_(
+                    Job.c.query_digest == query_digest(query),
+                    Job.c.databases_digest == digest,
+                    ~sa.exists(outdated)
+                ))
+                return await connection.scalar(sql_query)
+            except Exception as e:
+                raise SQLError("Failed to find a reusable job for query = %s" % query) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open connection to the database in find_reusable_job() for "
+                                      "sequence with query = %s" % query) from e
+
+
 async def sequence_exists(engine, query):
     """
     Check if this query has already been searched
@@ -110,7 +178,20 @@ async def get_job(engine, job_id):
                                       "get_job() for job with job_id = %s" % job_id) from e
 
 
-async def save_job(engine, query, description, url, priority):
+async def save_job(engine, query, description, url, priority, releases=None, source=None):
+    """
+    Save a new job
+    :param engine: params to connect to the db
+    :param query: the sequence that the user wants to search
+    :param description: description of the query
+    :param url: url of the website that submitted the query
+    :param priority: priority of the job
+    :param releases: dict {database: release} of the database files searched by this job,
+        stored as a digest to find reusable jobs
+    :param source: who submitted the job, e.g. RNAcentral, Rfam or API (used by the scheduling policies)
+    :return: id of the job
+    :raise: SQLError if a job with the same query and releases of the databases already exists
+    """
     try:
         async with engine.acquire() as connection:
             try:
@@ -125,7 +206,10 @@ async def save_job(engine, query, description, url, priority):
                         submitted=datetime.datetime.now(),
                         status=JOB_STATUS_CHOICES.started,
                         url=url,
-                        priority=priority
+                        priority=priority,
+                        source=source,
+                        query_digest=query_digest(query),
+                        databases_digest=databases_digest(releases)
                     )
                 )
 
@@ -138,6 +222,133 @@ async def save_job(engine, query, description, url, priority):
                                       "job_id = %s" % job_id) from e
 
 
+async def create_job(engine, query, description, url, priority, databases, source, job_chunks, reused=None,
+                     skipped=(), queued=True):
+    """
+    Saves a new job with its job_chunks and its infernal_job in a single transaction,
+    with one multi-row INSERT per table, so that the number of queries doesn't grow with the number of job_chunks
+    and a job is never saved without its job_chunks.
+
+    :param engine: params to connect to the db
+    :param query: the sequence that the user wants to search
+    :param description: description of the query
+    :param url: url of the website that submitted the query
+    :param priority: priority of the job
+    :param databases: list of database files searched by this job, stored with the releases of their job_chunks
+        as a digest to find reusable jobs
+    :param source: who submitted the job, e.g. RNAcentral, Rfam or API (used by the scheduling policies)
+    :param job_chunks: list of dicts with the database, rank, release, predicted_runtime and timeout of each job_chunk
+    :param reused: dict {database: (job_chunk_id, hits)} of the finished job_chunks of other jobs whose results
+        are copied, see job_chunks.find_reusable_job_chunks
+    :param skipped: databases that are not searched, their job_chunks are finished without hits
+    :param queued: the other job_chunks are saved as pending if True, so that the consumers get them
+        from the scheduler, or as created if the caller dispatches them itself (see job_chunks.requeue_job_chunks)
+    :return: id of the job
+    :raise: SQLError if a job with the same query and releases of the databases already exists
+    """
+    reused = reused or {}
+    releases = {job_chunk['database']: job_chunk['release'] for job_chunk in job_chunks}
+    columns = [column.name for column in JobChunkResult.c if column.name not in ('id', 'job_chunk_id')]
+    now = datetime.datetime.now()
+    job_id = str(uuid.uuid4())
+
+    rows = []
+    for job_chunk in job_chunks:
+        row = dict(job_chunk, job_id=job_id, submitted=None, finished=None, hits=None,
+                   status=JOB_CHUNK_STATUS_CHOICES.pending if queued else JOB_CHUNK_STATUS_CHOICES.created)
+        if row['database'] in reused:
+            row.update(status=JOB_CHUNK_STATUS_CHOICES.success, submitted=now, finished=now,
+                       hits=reused[row['database']][1])
+        elif row['database'] in skipped:
+            row.update(status=JOB_CHUNK_STATUS_CHOICES.success, finished=now, hits=0)
+        rows.append(row)
+
+    # a job whose job_chunks are all finished already is done
+    finished = bool(rows) and all(row['status'] == JOB_CHUNK_STATUS_CHOICES.success for row in rows)
+
+    try:
+        async with engine.acquire() as connection:
+            try:
+                async with connection.begin():
+                    await connection.execute(
+                        Job.insert().values(
+                            id=job_id,
+                            query=query,
+                            description=description,
+                            ordering='e_value',
+                            submitted=now,
+                            finished=now if finished else None,
+                            hits=sum(row['hits'] for row in rows) if finished else None,
+                            status=JOB_STATUS_CHOICES.success if finished else JOB_STATUS_CHOICES.started,
+                            url=url,
+                            priority=priority,
+                            source=source,
+                            query_digest=query_digest(query),
+                            databases_digest=databases_digest(
+                                {database: releases.get(database) for database in databases})
+                        )
+                    )
+
+                    job_chunk_ids = {}
+                    if rows:
+                        async for row in await connection.execute(
+                                JobChunk.insert().values(rows).returning(JobChunk.c.id, JobChunk.c.database)):
+                            job_chunk_ids[row.database] = row.id
+
+                    copies = [(reused[database][0], job_chunk_id) for database, job_chunk_id in job_chunk_ids.items()
+                              if database in reused]
+                    if copies:
+                        # only the top results of the reused job_chunks are copied, see merge_top_results
+                        query = sa.text('''
+                            SELECT job_chunk_results.id, reused.new_id, rnacentral_id, score
+                            FROM job_chunk_results
+                            JOIN unnest(CAST(:old_ids AS INTEGER[]), CAST(:new_ids AS INTEGER[])) AS reused(old_id, new_id)
+                            ON job_chunk_results.job_chunk_id = reused.old_id
+                            ORDER BY job_chunk_results.id
+                        ''')
+                        rows = []
+                        async for row in await connection.execute(
+                                query,
+                                old_ids=[old_id for old_id, new_id in copies],
+                                new_ids=[new_id for old_id, new_id in copies]):
+                            rows.append((row.id, row.new_id, row.rnacentral_id, row.score))
+                        selected = await merge_top_results(connection, job_id, rows)
+
+                        await connection.execute(
+                            sa.text('''
+                                INSERT INTO job_chunk_results (job_chunk_id, {columns})
+                                SELECT reused.new_id, {columns}
+                                FROM job_chunk_results
+                                JOIN unnest(CAST(:old_ids AS INTEGER[]), CAST(:new_ids AS INTEGER[])) AS reused(old_id, new_id)
+                                ON job_chunk_results.job_chunk_id = reused.old_id
+                                WHERE job_chunk_results.id = ANY(CAST(:ids AS INTEGER[]))
+                            '''.format(columns=', '.join(columns))),
+                            old_ids=[old_id for old_id, new_id in copies],
+                            new_ids=[new_id for old_id, new_id in copies],
+                            ids=list(selected)
+                        )
+
+                    if finished:
+                        await connection.execute(SAVE_JOB_RESULTS, job_id=job_id, limit=TOP_RESULTS)
+
+                    await connection.execute(
+                        InfernalJob.insert().values(
+                            job_id=job_id,
+                            submitted=now,
+                            priority=priority,
+                            status=JOB_CHUNK_STATUS_CHOICES.pending
+                        )
+                    )
+
+                return job_id
+            except Exception as e:
+                raise SQLError("Failed to create job for query = %s, description = %s, priority = %s, url = %s "
+                               "in the database" % (query, description, priority, url)) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open connection to the database in create_job() for job with "
+                                      "job_id = %s" % job_id) from e
+
+
 async def set_job_status(engine, job_id, status, hits=None):
     if status == JOB_CHUNK_STATUS_CHOICES.success or \
        status == JOB_CHUNK_STATUS_CHOICES.error or \
@@ -273,7 +484,11 @@ async def get_job_chunks_status(engine, job_id):
 
 
 async def update_job_status_from_job_chunks_status(engine, job_id):
-    """Infer job status for the statuses of all chunks that constitute it"""
+    """
+    Infer job status for the statuses of all chunks that constitute it
+
+    :return: True if all job chunks are finished
+    """
     try:
         async with engine.acquire() as connection:
             try:
@@ -285,7 +500,8 @@ async def update_job_status_from_job_chunks_status(engine, job_id):
                 errors_found = False
                 hits = 0
                 async for row in await connection.execute(query):
-                    if row.status == JOB_CHUNK_STATUS_CHOICES.pending or row.status == JOB_CHUNK_STATUS_CHOICES.started:
+                    if row.status in (JOB_CHUNK_STATUS_CHOICES.created, JOB_CHUNK_STATUS_CHOICES.pending,
+                                      JOB_CHUNK_STATUS_CHOICES.started):
                         unfinished_chunks_found = True
                         break
                     elif row.status == JOB_CHUNK_STATUS_CHOICES.error or row.status == JOB_CHUNK_STATUS_CHOICES.timeout:
@@ -298,6 +514,8 @@ async def update_job_status_from_job_chunks_status(engine, job_id):
                 elif unfinished_chunks_found is False and errors_found is True:
                     await set_job_status(engine, job_id, status=JOB_STATUS_CHOICES.partial_success, hits=hits)
 
+                return unfinished_chunks_found is False
+
             except Exception as e:
                 raise SQLError("Failed to check job_chunk status, job_id = %s" % job_id) from e
 
@@ -339,6 +557,26 @@ async def get_job_query(engine, job_id):
                                       "get_job_query() for job with job_id = %s" % job_id) from e
 
 
+async def get_job_queries(engine, job_ids):
+    """Returns {job_id: query} of the given jobs, with a single query to the database"""
+    job_ids = list(job_ids)
+    if not job_ids:
+        return {}
+
+    try:
+        async with engine.acquire() as connection:
+            try:
+                sql_query = sa.select([Job.c.id, Job.c.query]).select_from(Job).where(Job.c.id.in_(job_ids))
+
+                return {row.id: row.query async for row in await connection.execute(sql_query)}
+            except Exception as e:
+                raise SQLError("Failed to get job queries, job_ids = %s" % job_ids) from e
+
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open connection to the database in "
+                                      "get_job_queries() for jobs with job_ids = %s" % job_ids) from e
+
+
 async def get_job_ordering(engine, job_id):
     try:
         async with engine.acquire() as connection:
@@ -369,45 +607,86 @@ async def set_job_ordering(engine, job_id, ordering):
                                       "set_job_ordering() for job with job_id = %s" % job_id) from e
 
 
-async def get_job_results(engine, job_id, limit=1000):
+# the queries of the hot paths are built once, so that the asyncpg engine compiles and prepares them once
+# per connection, see asyncpg_engine.py
+RESULT_COLUMNS = [column.name for column in JobResult.c if column.name not in ('id', 'job_id', 'rank')]
+
+"""Top results of a finished job, a single scan of the (job_id, rank) index"""
+JOB_RESULTS = (
+    sa.select([JobResult.c[column] for column in RESULT_COLUMNS])
+    .where(JobResult.c.job_id == sa.bindparam('job_id'))
+    .order_by(JobResult.c.rank)
+    .limit(sa.bindparam('limit'))
+)
+
+# best hit of each rnacentral_id among the results of the job_chunks of a job, by score
+BEST_JOB_CHUNK_RESULTS = '''
+    SELECT DISTINCT ON (rnacentral_id) job_chunk_results.id, {columns}
+    FROM job_chunk_results
+    JOIN job_chunks ON job_chunks.id = job_chunk_results.job_chunk_id
+    WHERE job_chunks.job_id = :job_id
+    ORDER BY rnacentral_id, score DESC, job_chunk_results.id
+'''.format(columns=', '.join('job_chunk_results.%s' % column for column in RESULT_COLUMNS))
+
+"""Top results of a job that is not finished yet, or that was finished before job_results existed"""
+JOB_CHUNK_RESULTS = sa.text('''
+    SELECT {columns}
+    FROM ({best}) AS best
+    ORDER BY score DESC, id
+    LIMIT :limit
+'''.format(columns=', '.join(RESULT_COLUMNS), best=BEST_JOB_CHUNK_RESULTS))
+
+"""Saves the top results of a job in job_results, see save_job_results"""
+SAVE_JOB_RESULTS = sa.text('''
+    INSERT INTO job_results (job_id, rank, {columns})
+    SELECT CAST(:job_id AS VARCHAR), row_number() OVER (ORDER BY score DESC, id), {columns}
+    FROM ({best}) AS best
+    ORDER BY score DESC, id
+    LIMIT :limit
+'''.format(columns=', '.join(RESULT_COLUMNS), best=BEST_JOB_CHUNK_RESULTS))
+
+
+async def save_job_results(engine, job_id, limit=TOP_RESULTS):
     """
-    Aggregates results from multiple job_chunks and returns them.
+    Saves the top results of a finished job in job_results, ranked by score,
+    so that get_job_results reads them with a single index scan.
 
-    By default, we're using a limit of 10000 on the number of hits due to
-    recommendation from text search team. You can increase it up to infinity,
-    shall the need arise.
+    :param engine: params to connect to the db
+    :param job_id: id of the job
+    :param limit: number of top results of the job
+    :return: None
     """
     try:
         async with engine.acquire() as connection:
-            sql = (sa.select([
-                    JobChunkResult.c.rnacentral_id.distinct(),
-                    JobChunk.c.job_id,
-                    JobChunk.c.database,
-                    JobChunkResult.c.description,
-                    JobChunkResult.c.score,
-                    JobChunkResult.c.bias,
-                    JobChunkResult.c.e_value,
-                    JobChunkResult.c.target_length,
-                    JobChunkResult.c.alignment,
-                    JobChunkResult.c.alignment_length,
-                    JobChunkResult.c.gap_count,
-                    JobChunkResult.c.match_count,
-                    JobChunkResult.c.nts_count1,
-                    JobChunkResult.c.nts_count2,
-                    JobChunkResult.c.identity,
-                    JobChunkResult.c.query_coverage,
-                    JobChunkResult.c.target_coverage,
-                    JobChunkResult.c.gaps,
-                    JobChunkResult.c.query_length,
-                    JobChunkResult.c.result_id,
-                    JobChunkResult.c.alignment_start,
-                    JobChunkResult.c.alignment_stop,
-                    JobChunkResult.c.alignment_sequence,
-                ])
-                .select_from(sa.join(JobChunk, JobChunkResult, JobChunk.c.id == JobChunkResult.c.job_chunk_id))  # noqa
-                .order_by(JobChunkResult.c.score.desc())
-                .limit(limit)
-                .where(JobChunk.c.job_id == job_id))  # noqa
+            try:
+                async with connection.begin():
+                    await connection.execute(JobResult.delete().where(JobResult.c.job_id == job_id))
+                    await connection.execute(SAVE_JOB_RESULTS, job_id=job_id, limit=limit)
+            except Exception as e:
+                raise SQLError("Failed to save the results of job_id = %s" % job_id) from e
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError("Failed to open connection to the database in "
+                                      "save_job_results() for job with job_id = %s" % job_id) from e
+
+
+async def get_job_results(engine, job_id, limit=TOP_RESULTS):
+    """
+    Returns the top results of a job, the best hit of each rnacentral_id.
+
+    By default, we're using a limit of 1000 on the number of hits due to
+    recommendation from text search team. Only the TOP_RESULTS best hits
+    of a job are saved, see job_chunk_results.set_job_chunk_results.
+    """
+    try:
+        async with engine.acquire() as connection:
+            rows = []
+            async for row in await connection.execute(JOB_RESULTS, job_id=job_id, limit=limit):
+                rows.append(row)
+
+            if not rows:
+                # the job is not finished yet, or it has no results at all
+                async for row in await connection.execute(JOB_CHUNK_RESULTS, job_id=job_id, limit=limit):
+                    rows.append(row)
 
             # popular species: zebrafish, arabidopsis thaliana, caenorhabditis elegans, drosophila melanogaster,
             # saccharomyces cerevisiae S288c, schizosaccharomyces pombe, escherichia coli str. K-12 substr. MG1655
@@ -415,11 +694,11 @@ async def get_job_results(engine, job_id, limit=1000):
             popular_species = {7955, 3702, 6239, 7227, 559292, 4896, 511145, 224308}
 
             results = []
-            async for row in await connection.execute(sql):
+            for row in rows:
                 # check species priority.
                 # priority order = human (9606), mouse (10090), popular species, others
                 try:
-                    taxid = row[0].split('_')[1]
+                    taxid = row.rnacentral_id.split('_')[1]
                     if taxid == '9606':
                         species_priority = 'a'  # Very high priority
                     elif taxid == '10090':
@@ -433,27 +712,27 @@ async def get_job_results(engine, job_id, limit=1000):
 
                 # add result
                 results.append({
-                    'rnacentral_id': row[0],
-                    'description': row[3],
-                    'score': row[4],
-                    'bias': row[5],
-                    'e_value': row[6],
-                    'target_length': row[7],
-                    'alignment': row[8],
-                    'alignment_length': row[9],
-                    'gap_count': row[10],
-                    'match_count': row[11],
-                    'nts_count1': row[12],
-                    'nts_count2': row[13],
-                    'identity': row[14],
-                    'query_coverage': row[15],
-                    'target_coverage': row[16],
-                    'gaps': row[17],
-                    'query_length': row[18],
-                    'result_id': row[19],
-                    'alignment_start': row[20],
-                    'alignment_stop': row[21],
-                    'alignment_sequence': row[22],
+                    'rnacentral_id': row.rnacentral_id,
+                    'description': row.description,
+                    'score': row.score,
+                    'bias': row.bias,
+                    'e_value': row.e_value,
+                    'target_length': row.target_length,
+                    'alignment': row.alignment,
+                    'alignment_length': row.alignment_length,
+                    'gap_count': row.gap_count,
+                    'match_count': row.match_count,
+                    'nts_count1': row.nts_count1,
+                    'nts_count2': row.nts_count2,
+                    'identity': row.identity,
+                    'query_coverage': row.query_coverage,
+                    'target_coverage': row.target_coverage,
+                    'gaps': row.gaps,
+                    'query_length': row.query_length,
+                    'result_id': row.result_id,
+                    'alignment_start': row.alignment_start,
+                    'alignment_stop': row.alignment_stop,
+                    'alignment_sequence': row.alignment_sequence,
                     'species_priority': species_priority if species_priority else 'd'
                 })
 
@@ -487,52 +766,57 @@ async def get_job_results(engine, job_id, limit=1000):
         raise DatabaseConnectionError(str(e)) from e
 
 
-async def find_highest_priority_jobs(engine):
+HIGHEST_PRIORITY_JOBS = (
+    sa.select(
+        [
+            Job.c.id.label('id'),
+            Job.c.priority.label('priority'),
+            Job.c.submitted.label('submitted'),
+            JobChunk.c.database.label('database'),
+            JobChunk.c.rank.label('rank')
+        ]
+    )
+    .select_from(
+        sa.join(Job, JobChunk, Job.c.id == JobChunk.c.job_id)
+    )
+    .where(
+        sa.and_(
+            Job.c.status == JOB_STATUS_CHOICES.started,
+            JobChunk.c.status == JOB_CHUNK_STATUS_CHOICES.pending
+        )
+    )
+    .union_all(
+        sa.select(
+            [
+                InfernalJob.c.job_id.label('id'),
+                InfernalJob.c.priority.label('priority'),
+                InfernalJob.c.submitted.label('submitted'),
+                sa.null().label('database'),
+                sa.literal_column('0').label('rank')
+            ]
+        )
+        .select_from(InfernalJob)
+        .where(InfernalJob.c.status == JOB_CHUNK_STATUS_CHOICES.pending)
+    )
+    .order_by('priority', 'submitted', 'rank')
+    .limit(sa.bindparam('limit'))
+)
+
+
+async def find_highest_priority_jobs(engine, limit=30):
     """
     Find unfinished jobs to give consumers for processing.
 
     :param engine: params to connect to the db
+    :param limit: maximum number of job chunks and infernal jobs to return
     :return: sorted list of job chunks and infernal jobs
     """
     # among the running jobs, find the one with high priority, submitted first
     try:
         async with engine.acquire() as connection:
             output = []
-            query = (
-                sa.select(
-                    [
-                        Job.c.id.label('id'),
-                        Job.c.priority.label('priority'),
-                        Job.c.submitted.label('submitted'),
-                        JobChunk.c.database.label('database')
-                    ]
-                )
-                .select_from(
-                    sa.join(Job, JobChunk, Job.c.id == JobChunk.c.job_id)
-                )
-                .where(
-                    sa.and_(
-                        Job.c.status == JOB_STATUS_CHOICES.started,
-                        JobChunk.c.status == JOB_CHUNK_STATUS_CHOICES.pending
-                    )
-                )
-                .union_all(
-                    sa.select(
-                        [
-                            InfernalJob.c.job_id.label('id'),
-                            InfernalJob.c.priority.label('priority'),
-                            InfernalJob.c.submitted.label('submitted'),
-                            sa.literal(None).label('database')
-                        ]
-                    )
-                    .select_from(InfernalJob)
-                    .where(InfernalJob.c.status == JOB_CHUNK_STATUS_CHOICES.pending)
-                )
-                .order_by('priority', 'submitted')
-                .limit(30)
-            )
 
-            async for row in connection.execute(query):
+            async for row in connection.execute(HIGHEST_PRIORITY_JOBS, limit=limit):
                 output.append((row.id, row.priority, row.submitted, row.database))
 
             return output
@@ -543,6 +827,143 @@ async def find_highest_priority_jobs(engine):
         raise SQLError("Failed to find highest priority jobs") from e
 
 
+async def find_pending_jobs(engine):
+    """
+    Summarizes the work that is waiting for a consumer, one entry per job, for the scheduling policies.
+
+    :param engine: params to connect to the db
+    :return: list of PendingJob, with the number of pending job chunks of the job
+        and whether its infernal job is pending
+    """
+    try:
+        async with engine.acquire() as connection:
+            query = sa.text('''
+                SELECT jobs.id, jobs.priority, jobs.submitted, jobs.source,
+                       coalesce(chunks.pending, 0) AS chunks, infernal_job.id IS NOT NULL AS infernal
+                FROM jobs
+                LEFT JOIN (
+                    SELECT job_id, count(*) AS pending
+                    FROM job_chunks
+                    WHERE status = :pending
+                    GROUP BY job_id
+                ) AS chunks ON chunks.job_id = jobs.id AND jobs.status = :started
+                LEFT JOIN infernal_job ON infernal_job.job_id = jobs.id AND infernal_job.status = :pending
+                WHERE chunks.pending IS NOT NULL OR infernal_job.id IS NOT NULL
+            ''')
+
+            output = []
+            async for row in await connection.execute(
+                    query, pending=JOB_CHUNK_STATUS_CHOICES.pending, started=JOB_STATUS_CHOICES.started):
+                output.append(PendingJob(row.id, row.priority, row.submitted, row.source, row.chunks, row.infernal))
+            return output
+
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError(str(e)) from e
+    except Exception as e:
+        raise SQLError("Failed to find pending jobs") from e
+
+
+async def find_pending_job_chunks(engine, counts):
+    """
+    Returns the first pending job chunks of the given jobs, in the order of their rank.
+
+    :param engine: params to connect to the db
+    :param counts: dict {job_id: number of job chunks}
+    :return: dict {job_id: [database]}
+    """
+    if not counts:
+        return {}
+
+    try:
+        async with engine.acquire() as connection:
+            query = sa.text('''
+                SELECT job_id, database
+                FROM (
+                    SELECT job_id, database, row_number() OVER (PARTITION BY job_id ORDER BY rank, id) AS position
+                    FROM job_chunks
+                    WHERE status = :pending AND job_id = ANY(:job_ids)
+                ) AS pending
+                WHERE position <= :limit
+                ORDER BY job_id, position
+            ''')
+
+            output = {}
+            async for row in await connection.execute(
+                    query, pending=JOB_CHUNK_STATUS_CHOICES.pending, job_ids=list(counts), limit=max(counts.values())):
+                if len(output.setdefault(row.job_id, [])) < counts[row.job_id]:
+                    output[row.job_id].append(row.database)
+            return output
+
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError(str(e)) from e
+    except Exception as e:
+        raise SQLError("Failed to find pending job chunks") from e
+
+
+async def count_running_jobs_by_source(engine):
+    """Returns {source: number of started job chunks and infernal jobs} of the jobs of each source"""
+    try:
+        async with engine.acquire() as connection:
+            query = sa.text('''
+                SELECT jobs.source, count(*) AS running
+                FROM (
+                    SELECT job_id FROM job_chunks WHERE status = :started
+                    UNION ALL
+                    SELECT job_id FROM infernal_job WHERE status = :started
+                ) AS started
+                JOIN jobs ON jobs.id = started.job_id
+                GROUP BY jobs.source
+            ''')
+
+            output = {}
+            async for row in await connection.execute(query, started=JOB_CHUNK_STATUS_CHOICES.started):
+                output[row.source] = row.running
+            return output
+
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError(str(e)) from e
+    except Exception as e:
+        raise SQLError("Failed to count running jobs") from e
+
+
+async def get_queue_depth(engine):
+    """
+    Summarizes the work that no consumer has started yet, per priority of the jobs.
+
+    :param engine: params to connect to the db
+    :return: dict {priority: QueueDepth}, with the number of created or pending job chunks and infernal jobs,
+        the sum of the predicted runtimes of the job chunks in seconds, and the number of them without a prediction
+    """
+    try:
+        async with engine.acquire() as connection:
+            query = sa.text('''
+                SELECT jobs.priority, count(*) AS tasks, coalesce(sum(queued.predicted_runtime), 0) AS predicted,
+                       count(*) - count(queued.predicted_runtime) AS unpredicted
+                FROM (
+                    SELECT job_id, predicted_runtime FROM job_chunks WHERE status IN (:created, :pending)
+                    UNION ALL
+                    SELECT job_id, NULL::float FROM infernal_job WHERE status = :pending
+                ) AS queued
+                JOIN jobs ON jobs.id = queued.job_id
+                WHERE jobs.status = :started
+                GROUP BY jobs.priority
+            ''')
+
+            output = {}
+            async for row in await connection.execute(
+                    query,
+                    created=JOB_CHUNK_STATUS_CHOICES.created,
+                    pending=JOB_CHUNK_STATUS_CHOICES.pending,
+                    started=JOB_STATUS_CHOICES.started):
+                output[row.priority] = QueueDepth(row.tasks, float(row.predicted), row.unpredicted)
+            return output
+
+    except psycopg2.Error as e:
+        raise DatabaseConnectionError(str(e)) from e
+    except Exception as e:
+        raise SQLError("Failed to get the queue depth") from e
+
+
 async def get_infernal_job_results(engine, job_id):
     """
     Function to get cmscan command results
@@ -15,7 +15,8 @@ import logging
 import sqlalchemy as sa
 from aiopg.sa import create_engine
 
-from .settings import get_postgres_credentials
+from .asyncpg_engine import create_engine as asyncpg_create_engine
+from .settings import get_postgres_credentials, POSTGRES_BACKEND, POSTGRES_POOL_MIN, POSTGRES_POOL_MAX
 
 
 # Connection initialization code
@@ -28,11 +29,17 @@ async def init_pg(app):
     logger.debug("POSTGRES_HOST = %s" % app['settings'].POSTGRES_HOST)
     logger.debug("POSTGRES_PASSWORD = %s" % app['settings'].POSTGRES_PASSWORD)
 
-    app['engine'] = await create_engine(
+    logger.debug("POSTGRES_BACKEND = %s" % POSTGRES_BACKEND)
+
+    # both engines have the same interface, the db functions work with either of them
+    engine = asyncpg_create_engine if POSTGRES_BACKEND == 'asyncpg' else create_engine
+    app['engine'] = await engine(
         user=app['settings'].POSTGRES_USER,
         database=app['settings'].POSTGRES_DATABASE,
         host=app['settings'].POSTGRES_HOST,
-        password=app['settings'].POSTGRES_PASSWORD
+        password=app['settings'].POSTGRES_PASSWORD,
+        minsize=POSTGRES_POOL_MIN,
+        maxsize=POSTGRES_POOL_MAX
     )
 
 
@@ -67,6 +74,7 @@ class JOB_CHUNK_STATUS_CHOICES(object):
 class CONSUMER_STATUS_CHOICES(object):
     available = 'available'
     busy = 'busy'
+    suspect = 'suspect'  # a lease of one of its job chunks expired, see job_chunks.requeue_expired_job_chunks
 
 
 metadata = sa.MetaData()
@@ -77,7 +85,10 @@ Consumer = sa.Table('consumer', metadata,
                     sa.Column('ip', sa.String(20), primary_key=True),
                     sa.Column('status', sa.String(255)),  # choices=CONSUMER_STATUS_CHOICES, default='available'
                     sa.Column('job_chunk_id', sa.ForeignKey('job_chunks.id')),
-                    sa.Column('port', sa.String(10)))
+                    sa.Column('port', sa.String(10)),
+                    sa.Column('slots', sa.Integer),  # number of searches the consumer can run concurrently
+                    sa.Column('running', sa.Integer),  # number of searches currently running on the consumer
+                    sa.Column('last_heartbeat', sa.DateTime, nullable=True))
 
 """A search job that is divided into multiple job chunks per database"""
 Job = sa.Table('jobs', metadata,
@@ -92,7 +103,10 @@ Job = sa.Table('jobs', metadata,
                sa.Column('r2dt_id', sa.String(255)),
                sa.Column('r2dt_date', sa.DateTime),
                sa.Column('priority', sa.String(255)),
-               sa.Column('url', sa.String(255)))
+               sa.Column('url', sa.String(255)),
+               sa.Column('source', sa.String(255), nullable=True),  # e.g. RNAcentral, Rfam or API
+               sa.Column('query_digest', sa.String(32), nullable=True),  # see jobs.query_digest
+               sa.Column('databases_digest', sa.String(32), nullable=True))  # see jobs.databases_digest
 
 """Part of the search job, run against a specific database and assigned to a specific consumer"""
 JobChunk = sa.Table('job_chunks', metadata,
@@ -103,7 +117,13 @@ JobChunk = sa.Table('job_chunks', metadata,
                     sa.Column('finished', sa.DateTime, nullable=True),
                     sa.Column('consumer', sa.ForeignKey('consumer.ip'), nullable=True),
                     sa.Column('hits', sa.Integer, nullable=True),
-                    sa.Column('status', sa.String(255)))  # choices=JOB_CHUNK_STATUS_CHOICES, default='started'
+                    sa.Column('status', sa.String(255)),  # choices=JOB_CHUNK_STATUS_CHOICES, default='started'
+                    sa.Column('rank', sa.Integer),  # order in which the job chunks of a job are dispatched
+                    sa.Column('release', sa.String(64), nullable=True),  # fingerprint of the database file
+                    sa.Column('predicted_runtime', sa.Float, nullable=True),  # seconds, see producer.runtime_model
+                    sa.Column('timeout', sa.Integer, nullable=True),  # seconds, overrides MAX_RUN_TIME if lower
+                    sa.Column('lease_expires', sa.DateTime, nullable=True),  # renewed by the consumer heartbeats
+                    sa.Column('pruned', sa.Boolean))  # some of its results are not in the top results of its job
 
 """Result of a specific JobChunk"""
 JobChunkResult = sa.Table('job_chunk_results', metadata,
@@ -131,6 +151,33 @@ JobChunkResult = sa.Table('job_chunk_results', metadata,
                           sa.Column('alignment_sequence', sa.Text),
                           sa.Column('result_id', sa.Integer))
 
+"""Top results of a finished job, the best hit of each rnacentral_id, see jobs.save_job_results"""
+JobResult = sa.Table('job_results', metadata,
+                     sa.Column('id', sa.Integer, primary_key=True),
+                     sa.Column('job_id', sa.String(36), sa.ForeignKey('jobs.id')),
+                     sa.Column('rank', sa.Integer),
+                     sa.Column('rnacentral_id', sa.String(255)),
+                     sa.Column('description', sa.Text, nullable=True),
+                     sa.Column('score', sa.Float),
+                     sa.Column('bias', sa.Float),
+                     sa.Column('e_value', sa.Float),
+                     sa.Column('target_length', sa.Integer),
+                     sa.Column('alignment', sa.Text),
+                     sa.Column('alignment_length', sa.Integer),
+                     sa.Column('gap_count', sa.Integer),
+                     sa.Column('match_count', sa.Integer),
+                     sa.Column('nts_count1', sa.Integer),
+                     sa.Column('nts_count2', sa.Integer),
+                     sa.Column('identity', sa.Float),
+                     sa.Column('query_coverage', sa.Float),
+                     sa.Column('target_coverage', sa.Float),
+                     sa.Column('gaps', sa.Float),
+                     sa.Column('query_length', sa.Integer),
+                     sa.Column('alignment_start', sa.Integer),
+                     sa.Column('alignment_stop', sa.Integer),
+                     sa.Column('alignment_sequence', sa.Text),
+                     sa.Column('result_id', sa.Integer))
+
 InfernalJob = sa.Table('infernal_job', metadata,
                        sa.Column('id', sa.Integer, primary_key=True),
                        sa.Column('job_id', sa.String(36), sa.ForeignKey('jobs.id')),
@@ -168,7 +215,8 @@ Statistic = sa.Table('statistic', metadata,
                      sa.Column('id', sa.Integer, primary_key=True),
                      sa.Column('period', sa.String(7)),
                      sa.Column('source', sa.String(50)),
-                     sa.Column('total', sa.Integer))
+                     sa.Column('total', sa.Integer),
+                     sa.UniqueConstraint('source', 'period'))  # see statistic.increment_statistics
 
 # Migrations
 # ----------
@@ -186,6 +234,7 @@ async def migrate(ENVIRONMENT):
 
     async with engine:
         async with engine.acquire() as connection:
+            await connection.execute('DROP TABLE IF EXISTS job_results')
             await connection.execute('DROP TABLE IF EXISTS job_chunk_results')
             await connection.execute('DROP TABLE IF EXISTS job_chunks')
             await connection.execute('DROP TABLE IF EXISTS infernal_result')
@@ -199,7 +248,10 @@ async def migrate(ENVIRONMENT):
                   ip VARCHAR(20) PRIMARY KEY,
                   status VARCHAR(255) NOT NULL,
                   job_chunk_id VARCHAR(15),
-                  port VARCHAR(10))
+                  port VARCHAR(10),
+                  slots INTEGER NOT NULL DEFAULT 1,
+                  running INTEGER NOT NULL DEFAULT 0,
+                  last_heartbeat TIMESTAMP)
             ''')
 
             await connection.execute('''
@@ -215,7 +267,10 @@ async def migrate(ENVIRONMENT):
                   r2dt_id VARCHAR(255),
                   r2dt_date TIMESTAMP,
                   priority VARCHAR(255),
-                  url VARCHAR(255))
+                  url VARCHAR(255),
+                  source VARCHAR(255),
+                  query_digest VARCHAR(32),
+                  databases_digest VARCHAR(32))
             ''')
 
             await connection.execute('''
@@ -227,7 +282,13 @@ async def migrate(ENVIRONMENT):
                   finished TIMESTAMP,
                   consumer VARCHAR(20) references consumer(ip) ON UPDATE CASCADE ON DELETE SET NULL,
                   hits INTEGER,
-                  status VARCHAR(255))
+                  status VARCHAR(255),
+                  rank INTEGER NOT NULL DEFAULT 0,
+                  release VARCHAR(64),
+                  predicted_runtime FLOAT,
+                  timeout INTEGER,
+                  lease_expires TIMESTAMP,
+                  pruned BOOLEAN NOT NULL DEFAULT FALSE)
             ''')
 
             await connection.execute('''
@@ -257,6 +318,34 @@ async def migrate(ENVIRONMENT):
                   result_id INTEGER NOT NULL)
             ''')
 
+            await connection.execute('''
+                CREATE TABLE job_results (
+                  id serial PRIMARY KEY,
+                  job_id VARCHAR(36) references jobs(id) ON UPDATE CASCADE ON DELETE CASCADE,
+                  rank INTEGER NOT NULL,
+                  rnacentral_id VARCHAR(255) NOT NULL,
+                  description TEXT,
+                  score FLOAT NOT NULL,
+                  bias FLOAT NOT NULL,
+                  e_value FLOAT NOT NULL,
+                  target_length INTEGER NOT NULL,
+                  alignment TEXT NOT NULL,
+                  alignment_length INTEGER NOT NULL,
+                  gap_count INTEGER NOT NULL,
+                  match_count INTEGER NOT NULL,
+                  nts_count1 INTEGER NOT NULL,
+                  nts_count2 INTEGER NOT NULL,
+                  identity FLOAT NOT NULL,
+                  query_coverage FLOAT NOT NULL,
+                  target_coverage FLOAT NOT NULL,
+                  gaps FLOAT NOT NULL,
+                  query_length INTEGER NOT NULL,
+                  alignment_start INTEGER NOT NULL,
+                  alignment_stop INTEGER NOT NULL,
+                  alignment_sequence TEXT NOT NULL,
+                  result_id INTEGER NOT NULL)
+            ''')
+
             await connection.execute('''
                 CREATE TABLE infernal_job (
                   id serial PRIMARY KEY,
@@ -293,14 +382,19 @@ async def migrate(ENVIRONMENT):
                   alignment TEXT)
             ''')
 
-            # await connection.execute('''
-            #     CREATE TABLE statistic (
-            #       id serial PRIMARY KEY,
-            #       period VARCHAR(7),
-            #       source VARCHAR(50),
-            #       total INTEGER NOT NULL)
-            # ''')
+            # the statistics are kept, the table is only created if it doesn't exist yet
+            await connection.execute('''
+                CREATE TABLE IF NOT EXISTS statistic (
+                  id serial PRIMARY KEY,
+                  period VARCHAR(7),
+                  source VARCHAR(50),
+                  total INTEGER NOT NULL,
+                  UNIQUE (source, period))
+            ''')
 
             await connection.execute('''CREATE INDEX on job_chunks (job_id)''')
+            await connection.execute('''CREATE INDEX on job_chunks (database, release)''')
+            await connection.execute('''CREATE UNIQUE INDEX on jobs (query_digest, databases_digest)''')
             await connection.execute('''CREATE INDEX on job_chunk_results (job_chunk_id)''')
+            await connection.execute('''CREATE INDEX on job_results (job_id, rank)''')
             await connection.execute('''CREATE INDEX on infernal_result (infernal_job_id)''')
@@ -0,0 +1,63 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from contextlib import asynccontextmanager
+
+
+class Session(object):
+    """
+    Unit of work: a single pooled connection shared by a sequence of db functions.
+
+    The db functions take an engine and call engine.acquire(). A session has the same acquire(),
+    that returns the connection of the session instead of a new one from the pool, so any db function
+    can be called with a session instead of an engine. A session opened on another session reuses its
+    connection, so db functions that call each other never hold two connections at once.
+
+    Example:
+        async with Session(engine) as session:
+            async with session.begin():
+                finished = await finish_job_chunk(session, job_id, database, consumer_ip, 'success')
+                await set_job_chunk_results(session, job_id, database, results, job_chunk_id=finished.job_chunk_id)
+
+    Without begin(), every statement is committed on its own, like with an engine. Inside begin(),
+    an error in any of the db functions rolls back all of them. Errors opening the connection are
+    psycopg2 errors, like those of engine.acquire().
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+        self._context = None
+
+    async def __aenter__(self):
+        self._context = self.engine.acquire()
+        self.connection = await self._context.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        context, self._context, self.connection = self._context, None, None
+        return await context.__aexit__(exc_type, exc, tb)
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Same as engine.acquire(), but yields the connection of the session"""
+        if self.connection is None:
+            raise RuntimeError("Session is not open, use 'async with Session(engine) as session'")
+        yield self.connection
+
+    def begin(self):
+        """
+        Starts the transaction of the unit of work, use as 'async with session.begin()'.
+        It is committed at the end of the block, or rolled back if the block raises.
+        Transactions started by the db functions inside the block are part of it.
+        """
+        return self.connection.begin()
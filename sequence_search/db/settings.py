@@ -15,6 +15,14 @@ import os
 from collections import namedtuple
 
 
+# database driver used by init_pg: 'aiopg' (SQLAlchemy and psycopg2) or 'asyncpg', see asyncpg_engine.py
+POSTGRES_BACKEND = os.getenv('POSTGRES_BACKEND', 'aiopg')
+
+# minimum and maximum number of connections in the pool of each producer or consumer
+POSTGRES_POOL_MIN = int(os.getenv('POSTGRES_POOL_MIN', 1))
+POSTGRES_POOL_MAX = int(os.getenv('POSTGRES_POOL_MAX', 10))
+
+
 Settings = namedtuple('Settings', [
     'POSTGRES_HOST',
     'POSTGRES_PORT',
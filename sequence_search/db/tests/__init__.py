@@ -13,10 +13,16 @@ limitations under the License.
 
 from .test_base import DBTestCase
 from .test_consumers import FindAvailableConsumersTestCase, GetConsumerStatusTestCase, SetConsumerStatusTestCase, \
-    DelegateJobChunkToConsumerTestCase, RegisterConsumerInTheDatabaseTestCase
-from .test_job_chunk_results import SetJobChunkResultsTestCase
+    DelegateJobChunkToConsumerTestCase, RegisterConsumerInTheDatabaseTestCase, ConsumerSlotsTestCase, \
+    ClaimNextJobTestCase, FindCachedDatabasesTestCase
+from .test_job_chunk_results import SetJobChunkResultsTestCase, TopResultsTestCase, MergeTopResultsTestCase
 from .test_job_chunks import GetConsumerIpFromJobChunkTestCase, GetJobChunkFromJobAndDatabase, SaveJobChunkTestCase, \
-    SetJobChunkStatusTestCase, FindHighestPriorityJobChunkTestCase
-from .test_jobs import GetJobTestCase, GetJobQueryTestCase
+    SetJobChunkStatusTestCase, FindHighestPriorityJobChunkTestCase, FindReusableJobChunksTestCase, \
+    RequeueExpiredJobChunksTestCase, StartFinishJobChunkTestCase
+from .test_jobs import GetJobTestCase, GetJobQueryTestCase, FindReusableJobTestCase, FindPendingJobsTestCase, \
+    CreateJobTestCase
 from .test_infernal_jobs import InfernalTestCase
 from .test_infernal_results import InfernalResultTestCase
+from .test_session import SessionTestCase
+from .test_asyncpg_engine import CompileQueryTestCase, AsyncpgEngineTestCase
+from .test_statistic import IncrementStatisticsTestCase
@@ -0,0 +1,136 @@
+"""
+Copyright [2009-2019] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import unittest
+from collections import namedtuple, OrderedDict
+
+import sqlalchemy as sa
+from aiohttp.test_utils import unittest_run_loop
+
+from sequence_search.db.asyncpg_engine import asyncpg, compile_query, coerce_arguments, create_engine, rowcount, \
+    Result
+from sequence_search.db.consumers import count_consumer_slots, get_consumer_status, set_consumer_status
+from sequence_search.db.jobs import find_highest_priority_jobs
+from sequence_search.db.models import Consumer, JobChunk, CONSUMER_STATUS_CHOICES
+from sequence_search.db.session import Session
+from sequence_search.db.tests.test_base import DBTestCase
+
+
+class Record(OrderedDict):
+    """Stand-in for asyncpg.Record, that is accessed by name and by position"""
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+
+class CompileQueryTestCase(unittest.TestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python3 -m unittest sequence_search.db.tests.test_asyncpg_engine.CompileQueryTestCase
+    """
+    def test_compile_text(self):
+        query = sa.text("SELECT id::text FROM jobs WHERE id = :job_id AND query LIKE 'A%' OR id = :job_id")
+        compiled = compile_query(query)
+        assert compiled.sql == "SELECT id::text FROM jobs WHERE id = $1 AND query LIKE 'A%' OR id = $2"
+        assert compiled.arguments({'job_id': 'x'}) == ['x', 'x']
+
+        # sa.text() queries are built on every call, they are compiled only once
+        assert compile_query(sa.text(query.text)) is compiled
+
+    def test_compile_construct(self):
+        query = sa.select([JobChunk.c.id]).where(sa.and_(
+            JobChunk.c.job_id == 'x', JobChunk.c.database.in_(['mirbase-1.fasta', 'mirbase-2.fasta'])
+        ))
+        compiled = compile_query(query)
+        assert compiled.sql.endswith('job_chunks.job_id = $1 AND job_chunks.database IN ($2, $3)')
+        assert compiled.arguments({}) == ['x', 'mirbase-1.fasta', 'mirbase-2.fasta']
+        assert compile_query(query) is compiled
+
+    def test_coerce_arguments(self):
+        Parameter = namedtuple('Parameter', ['name'])
+        parameters = [Parameter('varchar'), Parameter('int4'), Parameter('float8'), Parameter('varchar')]
+        assert coerce_arguments([12, '3', '0.5', None], parameters) == ['12', 3, 0.5, None]
+
+    def test_rowcount(self):
+        assert rowcount('UPDATE 3') == 3
+        assert rowcount('INSERT 0 5') == 5
+        assert rowcount('CREATE TABLE') == -1
+
+    def test_result(self):
+        result = Result([
+            Record([('id', 1), ('status', 'started')]),
+            Record([('id', 2), ('status', 'pending')]),
+        ], 2)
+
+        async def read():
+            rows = [row async for row in result]
+            return rows, await result.fetchone()
+
+        loop = asyncio.new_event_loop()
+        try:
+            rows, empty = loop.run_until_complete(read())
+        finally:
+            loop.close()
+        assert [(row.id, row['status'], row[0]) for row in rows] == [(1, 'started', 1), (2, 'pending', 2)]
+        assert dict(rows[0].items()) == {'id': 1, 'status': 'started'}
+        assert empty is None
+        assert result.rowcount == 2
+
+
+@unittest.skipIf(asyncpg is None, 'asyncpg is not installed')
+class AsyncpgEngineTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python3 -m unittest sequence_search.db.tests.test_asyncpg_engine.AsyncpgEngineTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        settings = self.app['settings']
+        self.engine = await create_engine(user=settings.POSTGRES_USER, database=settings.POSTGRES_DATABASE,
+                                          host=settings.POSTGRES_HOST, password=settings.POSTGRES_PASSWORD)
+
+        async with self.engine.acquire() as connection:
+            await connection.execute(
+                Consumer.insert().values(ip='192.168.0.2', status=CONSUMER_STATUS_CHOICES.available, slots=2)
+            )
+
+    async def tearDownAsync(self):
+        self.engine.close()
+        await self.engine.wait_closed()
+        await super().tearDownAsync()
+
+    @unittest_run_loop
+    async def test_db_functions(self):
+        await set_consumer_status(self.engine, '192.168.0.2', CONSUMER_STATUS_CHOICES.busy)
+        assert await get_consumer_status(self.engine, '192.168.0.2') == CONSUMER_STATUS_CHOICES.busy
+        assert await get_consumer_status(self.app['engine'], '192.168.0.2') == CONSUMER_STATUS_CHOICES.busy
+        assert await find_highest_priority_jobs(self.engine) == []
+
+    @unittest_run_loop
+    async def test_scalar(self):
+        assert await count_consumer_slots(self.engine) == 2
+
+    @unittest_run_loop
+    async def test_transaction_rollback(self):
+        with self.assertRaises(ValueError):
+            async with Session(self.engine) as session:
+                async with session.begin():
+                    await set_consumer_status(session, '192.168.0.2', CONSUMER_STATUS_CHOICES.busy)
+                    raise ValueError('rolls back the transaction')
+
+        assert await get_consumer_status(self.engine, '192.168.0.2') == CONSUMER_STATUS_CHOICES.available
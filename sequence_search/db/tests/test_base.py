@@ -36,6 +36,7 @@ class DBTestCase(AioHTTPTestCase):
 
     async def tearDownAsync(self):
         async with self.app['engine'].acquire() as connection:
+            await connection.execute('DELETE FROM job_results')
             await connection.execute('DELETE FROM job_chunk_results')
             await connection.execute('DELETE FROM job_chunks')
             await connection.execute('DELETE FROM infernal_result')
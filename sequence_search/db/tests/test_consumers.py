@@ -11,15 +11,18 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import asyncio
 import datetime
 import uuid
 
 from aiohttp.test_utils import unittest_run_loop
 
-from sequence_search.db.models import Job, JobChunk, Consumer, CONSUMER_STATUS_CHOICES, JOB_STATUS_CHOICES, \
-    JOB_CHUNK_STATUS_CHOICES
+from sequence_search.db.models import Job, JobChunk, InfernalJob, Consumer, CONSUMER_STATUS_CHOICES, \
+    JOB_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES
 from sequence_search.db.consumers import get_consumer_status, set_consumer_status, find_available_consumers, \
-    delegate_job_chunk_to_consumer, register_consumer_in_the_database, get_ip, set_consumer_fields
+    delegate_job_chunk_to_consumer, register_consumer_in_the_database, get_ip, set_consumer_fields, \
+    find_available_consumer_slots, acquire_consumer_slot, release_consumer_slot, sync_consumer_slots, claim_next_job, \
+    find_cached_databases
 from sequence_search.db.tests.test_base import DBTestCase
 
 
@@ -189,6 +192,27 @@ class RegisterConsumerInTheDatabaseTestCase(DBTestCase):
         consumer = await get_consumer_status(self.app['engine'], consumer_ip)
         assert consumer == CONSUMER_STATUS_CHOICES.available
 
+    @unittest_run_loop
+    async def test_register_consumer_again_after_restart(self):
+        await register_consumer_in_the_database(self.app)
+        consumer_ip = get_ip(self.app)
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Consumer.update().where(Consumer.c.ip == consumer_ip).values(
+                    status=CONSUMER_STATUS_CHOICES.busy, running=1
+                )
+            )
+
+        await register_consumer_in_the_database(self.app)
+
+        async with self.app['engine'].acquire() as connection:
+            result = await connection.execute(Consumer.select().where(Consumer.c.ip == consumer_ip))
+            consumer = await result.fetchone()
+
+        assert consumer.running == 0
+        assert consumer.status == CONSUMER_STATUS_CHOICES.available
+
 
 class SetConsumerFieldsTestCase(DBTestCase):
     """
@@ -220,3 +244,185 @@ class SetConsumerFieldsTestCase(DBTestCase):
         async with self.app['engine'].acquire() as connection:
             consumer_fields = await get_consumer_status(self.app['engine'], self.consumer_ip)
             assert consumer_fields == CONSUMER_STATUS_CHOICES.busy
+
+
+class ConsumerSlotsTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.db.tests.test_consumers.ConsumerSlotsTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Consumer.insert().values(
+                    ip='192.168.0.2',
+                    status=CONSUMER_STATUS_CHOICES.available,
+                    slots=2,
+                    running=0
+                )
+            )
+
+            await connection.execute(
+                Consumer.insert().values(
+                    ip='192.168.0.3',
+                    status=CONSUMER_STATUS_CHOICES.available,
+                    slots=1,
+                    running=0
+                )
+            )
+
+    @unittest_run_loop
+    async def test_find_available_consumer_slots(self):
+        slots = await find_available_consumer_slots(self.app['engine'])
+        assert [consumer.ip for consumer in slots] == ['192.168.0.2', '192.168.0.3', '192.168.0.2']
+
+    @unittest_run_loop
+    async def test_acquire_consumer_slot(self):
+        await acquire_consumer_slot(self.app['engine'], '192.168.0.2', 'infernal-job')
+        assert await get_consumer_status(self.app['engine'], '192.168.0.2') == CONSUMER_STATUS_CHOICES.available
+
+        await acquire_consumer_slot(self.app['engine'], '192.168.0.2', 'infernal-job')
+        assert await get_consumer_status(self.app['engine'], '192.168.0.2') == CONSUMER_STATUS_CHOICES.busy
+
+        slots = await find_available_consumer_slots(self.app['engine'])
+        assert [consumer.ip for consumer in slots] == ['192.168.0.3']
+
+    @unittest_run_loop
+    async def test_release_consumer_slot(self):
+        await acquire_consumer_slot(self.app['engine'], '192.168.0.3', 'infernal-job')
+        assert await get_consumer_status(self.app['engine'], '192.168.0.3') == CONSUMER_STATUS_CHOICES.busy
+
+        await release_consumer_slot(self.app['engine'], '192.168.0.3')
+        assert await get_consumer_status(self.app['engine'], '192.168.0.3') == CONSUMER_STATUS_CHOICES.available
+
+    @unittest_run_loop
+    async def test_sync_consumer_slots(self):
+        await acquire_consumer_slot(self.app['engine'], '192.168.0.3', 'infernal-job')
+        await sync_consumer_slots(self.app['engine'])
+        assert await get_consumer_status(self.app['engine'], '192.168.0.3') == CONSUMER_STATUS_CHOICES.available
+
+
+class ClaimNextJobTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.db.tests.test_consumers.ClaimNextJobTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        self.job_id = str(uuid.uuid4())
+        self.job_id2 = str(uuid.uuid4())
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Consumer.insert().values(
+                    ip='192.168.0.2',
+                    status=CONSUMER_STATUS_CHOICES.available,
+                    slots=2,
+                    running=0
+                )
+            )
+
+            for job_id, priority, query in [(self.job_id, 'low', 'AACAGCATGAGTGCGCTGGATGCTG'),
+                                            (self.job_id2, 'high', 'CGTGCTGAATAGCTGGAGAGGCTCAT')]:
+                await connection.execute(
+                    Job.insert().values(
+                        id=job_id,
+                        query=query,
+                        submitted=datetime.datetime.now(),
+                        priority=priority,
+                        status=JOB_STATUS_CHOICES.started
+                    )
+                )
+
+            await connection.execute(
+                JobChunk.insert().values(
+                    job_id=self.job_id,
+                    database='mirbase-1.fasta',
+                    status=JOB_CHUNK_STATUS_CHOICES.pending
+                )
+            )
+
+            await connection.execute(
+                InfernalJob.insert().values(
+                    job_id=self.job_id2,
+                    submitted=datetime.datetime.now(),
+                    priority='high',
+                    status=JOB_CHUNK_STATUS_CHOICES.pending
+                )
+            )
+
+    @unittest_run_loop
+    async def test_claim_next_job(self):
+        claimed = await claim_next_job(self.app['engine'], '192.168.0.2')
+        assert (claimed.job_id, claimed.database) == (self.job_id2, None)
+
+        claimed = await claim_next_job(self.app['engine'], '192.168.0.2')
+        assert (claimed.job_id, claimed.database) == (self.job_id, 'mirbase-1.fasta')
+        assert claimed.query == 'AACAGCATGAGTGCGCTGGATGCTG'
+
+        assert await claim_next_job(self.app['engine'], '192.168.0.2') is None
+        assert await get_consumer_status(self.app['engine'], '192.168.0.2') == CONSUMER_STATUS_CHOICES.busy
+
+    @unittest_run_loop
+    async def test_concurrent_claims(self):
+        claims = await asyncio.gather(*[claim_next_job(self.app['engine'], '192.168.0.2') for _ in range(4)])
+        claimed = [(claim.job_id, claim.database) for claim in claims if claim]
+        assert len(claimed) == len(set(claimed))
+
+        # the jobs skipped because another claim had locked them are still pending
+        for _ in range(2):
+            claim = await claim_next_job(self.app['engine'], '192.168.0.2')
+            if claim:
+                claimed.append((claim.job_id, claim.database))
+        assert sorted(claimed, key=str) == sorted([(self.job_id, 'mirbase-1.fasta'), (self.job_id2, None)], key=str)
+
+
+class FindCachedDatabasesTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.db.tests.test_consumers.FindCachedDatabasesTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        self.job_id = str(uuid.uuid4())
+        now = datetime.datetime.now()
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Consumer.insert().values(ip='192.168.0.2', status=CONSUMER_STATUS_CHOICES.available, slots=2,
+                                         running=0)
+            )
+
+            await connection.execute(
+                Job.insert().values(
+                    id=self.job_id,
+                    query='AACAGCATGAGTGCGCTGGATGCTG',
+                    submitted=now,
+                    status=JOB_STATUS_CHOICES.started
+                )
+            )
+
+            for minutes, database in [(1, 'mirbase-1.fasta'), (2, 'rfam-1.fasta'), (3, 'pombase-1.fasta'),
+                                      (120, 'snodb-1.fasta')]:
+                await connection.execute(
+                    JobChunk.insert().values(
+                        job_id=self.job_id,
+                        database=database,
+                        submitted=now - datetime.timedelta(minutes=minutes),
+                        status=JOB_CHUNK_STATUS_CHOICES.success,
+                        consumer='192.168.0.2'
+                    )
+                )
+
+    @unittest_run_loop
+    async def test_find_cached_databases(self):
+        since = datetime.datetime.now() - datetime.timedelta(minutes=30)
+        cached = await find_cached_databases(self.app['engine'], since, 2)
+        assert cached == {'192.168.0.2': {'mirbase-1.fasta', 'rfam-1.fasta'}}
@@ -12,13 +12,15 @@ limitations under the License.
 """
 
 import datetime
+import unittest
 import uuid
 
 from aiohttp.test_utils import unittest_run_loop
 import sqlalchemy as sa
 
-from sequence_search.db.models import Job, JobChunk, JOB_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES
-from sequence_search.db.job_chunk_results import set_job_chunk_results
+from sequence_search.db.models import Job, JobChunk, JobChunkResult, JOB_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES
+from sequence_search.db.job_chunk_results import set_job_chunk_results, top_results, INSERT_BATCH_SIZE
+from sequence_search.db.jobs import get_job_results, save_job_results
 from sequence_search.db.tests.test_base import DBTestCase
 
 
@@ -55,7 +57,7 @@ class SetJobChunkResultsTestCase(DBTestCase):
     @unittest_run_loop
     async def test_set_job_chunk_results(self):
         results = [{
-            "rnacentral_id": 'URS000075D2D2',
+            "rnacentral_id": 'URS%010X_10090' % result_id,
             "description": 'Mus musculus miR - 1195 stem - loop',
             "score": 6.5,
             "bias": 0.7,
@@ -87,3 +89,187 @@ class SetJobChunkResultsTestCase(DBTestCase):
             async for row in await connection.execute(query, job_chunk_id=self.job_chunk_id):
                 assert row.rnacentral_id == 'URS000075D2D2'
                 assert row.description == 'Mus musculus miR - 1195 stem - loop'
+
+    @unittest_run_loop
+    async def test_set_job_chunk_results_of_job_chunk_id(self):
+        results = [{
+            "rnacentral_id": 'URS%010X_10090' % result_id,
+            "description": 'Mus musculus miR - 1195 stem - loop',
+            "score": 6.5,
+            "bias": 0.7,
+            "e_value": 32,
+            "target_length": 98,
+            "alignment": "Query  8 GAGUUUGAGACCAGCCUGGCCA 29",
+            "alignment_length": 22,
+            "gap_count": 0,
+            "match_count": 18,
+            "nts_count1": 22,
+            "nts_count2": 22,
+            "identity": 81.8181818181818,
+            "query_coverage": 73.3333333333333,
+            "target_coverage": 22.4489795918367,
+            "gaps": 0.0,
+            "query_length": 30,
+            "alignment_start": 22.0,
+            "alignment_stop": 43.0,
+            "alignment_sequence": 'GAGUUCGAGGCCAGCCUGCUCA',
+            "result_id": result_id
+        } for result_id in range(1, INSERT_BATCH_SIZE + 11)]
+
+        saved = await set_job_chunk_results(self.app['engine'], self.job_id, 'mirbase', results,
+                                            job_chunk_id=self.job_chunk_id)
+        assert saved == INSERT_BATCH_SIZE + 10
+
+        async with self.app['engine'].acquire() as connection:
+            query = sa.text('''
+                SELECT COUNT(*) AS count, MAX(result_id) AS result_id, MAX(e_value) AS e_value
+                FROM job_chunk_results
+                WHERE job_chunk_id=:job_chunk_id
+            ''')
+
+            row = await (await connection.execute(query, job_chunk_id=self.job_chunk_id)).first()
+            assert row.count == INSERT_BATCH_SIZE + 10
+            assert row.result_id == INSERT_BATCH_SIZE + 10
+            assert row.e_value == 32.0
+
+
+class TopResultsTestCase(unittest.TestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python3 -m unittest sequence_search.db.tests.test_job_chunk_results.TopResultsTestCase
+    """
+    def test_best_hit_of_each_rnacentral_id(self):
+        rows = [
+            (1, 10, 'URS0000000001_9606', 20.0),
+            (2, 10, 'URS0000000002_9606', 10.0),
+            (-1, 11, 'URS0000000001_9606', 30.0),
+            (-2, 11, 'URS0000000003_9606', 10.0),
+        ]
+        selected, pruned = top_results(rows, 10)
+        assert selected == {2, -1, -2}
+        assert pruned == {10}
+
+    def test_limit(self):
+        rows = [
+            (1, 10, 'URS0000000001_9606', 20.0),
+            (-1, 11, 'URS0000000002_9606', 30.0),
+            (-2, 11, 'URS0000000003_9606', 20.0),
+        ]
+        selected, pruned = top_results(rows, 2)
+        assert selected == {-1, 1}  # the first row wins on equal scores
+        assert pruned == {11}
+
+    def test_duplicates_of_a_job_chunk(self):
+        rows = [
+            (-1, 11, 'URS0000000001_9606', 20.0),
+            (-2, 11, 'URS0000000001_9606', 30.0),
+        ]
+        assert top_results(rows, 10) == ({-2}, set())
+
+
+class MergeTopResultsTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python3 -m unittest sequence_search.db.tests.test_job_chunk_results.MergeTopResultsTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        async with self.app['engine'].acquire() as connection:
+            self.job_id = str(uuid.uuid4())
+
+            await connection.execute(
+                Job.insert().values(
+                    id=self.job_id,
+                    query='AACAGCATGAGTGCGCTGGATGCTG',
+                    submitted=datetime.datetime.now(),
+                    status=JOB_STATUS_CHOICES.started
+                )
+            )
+
+            self.job_chunk_ids = []
+            for database in ['mirbase-1.fasta', 'mirbase-2.fasta']:
+                self.job_chunk_ids.append(await connection.scalar(
+                    JobChunk.insert().values(
+                        job_id=self.job_id,
+                        database=database,
+                        submitted=datetime.datetime.now(),
+                        status=JOB_CHUNK_STATUS_CHOICES.started
+                    )
+                ))
+
+    def results(self, scores):
+        return [{
+            "rnacentral_id": rnacentral_id,
+            "description": 'Mus musculus miR - 1195 stem - loop',
+            "score": score,
+            "bias": 0.7,
+            "e_value": 1.0 / score,
+            "target_length": 98,
+            "alignment": "Query  8 GAGUUUGAGACCAGCCUGGCCA 29",
+            "alignment_length": 22,
+            "gap_count": 0,
+            "match_count": 18,
+            "nts_count1": 22,
+            "nts_count2": 0,
+            "identity": 81.8,
+            "query_coverage": 73.3,
+            "target_coverage": 0.0,
+            "gaps": 0.0,
+            "query_length": 30,
+            "alignment_start": 8,
+            "alignment_stop": 29,
+            "alignment_sequence": "GAGUUUGAGACCAGCCUGGCCA",
+            "result_id": result_id
+        } for result_id, (rnacentral_id, score) in enumerate(scores, start=1)]
+
+    async def saved_results(self):
+        async with self.app['engine'].acquire() as connection:
+            query = (
+                sa.select([JobChunkResult.c.job_chunk_id, JobChunkResult.c.rnacentral_id, JobChunkResult.c.score])
+                .order_by(JobChunkResult.c.score.desc())
+            )
+            return [(row.job_chunk_id, row.rnacentral_id, row.score) async for row in await connection.execute(query)]
+
+    async def pruned_job_chunks(self):
+        async with self.app['engine'].acquire() as connection:
+            query = sa.select([JobChunk.c.id]).where(JobChunk.c.pruned.is_(True))
+            return [row.id async for row in await connection.execute(query)]
+
+    @unittest_run_loop
+    async def test_merge_top_results(self):
+        saved = await set_job_chunk_results(self.app['engine'], self.job_id, 'mirbase-1.fasta', self.results([
+            ('URS0000000001_9606', 20.0), ('URS0000000002_9606', 10.0), ('URS0000000003_9606', 5.0),
+        ]), job_chunk_id=self.job_chunk_ids[0], limit=3)
+        assert saved == 3
+
+        saved = await set_job_chunk_results(self.app['engine'], self.job_id, 'mirbase-2.fasta', self.results([
+            ('URS0000000001_9606', 30.0), ('URS0000000004_9606', 15.0), ('URS0000000005_9606', 1.0),
+        ]), job_chunk_id=self.job_chunk_ids[1], limit=3)
+        assert saved == 2
+
+        assert await self.saved_results() == [
+            (self.job_chunk_ids[1], 'URS0000000001_9606', 30.0),
+            (self.job_chunk_ids[1], 'URS0000000004_9606', 15.0),
+            (self.job_chunk_ids[0], 'URS0000000002_9606', 10.0),
+        ]
+        assert sorted(await self.pruned_job_chunks()) == self.job_chunk_ids
+
+    @unittest_run_loop
+    async def test_save_job_results(self):
+        await set_job_chunk_results(self.app['engine'], self.job_id, 'mirbase-1.fasta', self.results([
+            ('URS0000000001_9606', 20.0), ('URS0000000002_9606', 10.0),
+        ]), job_chunk_id=self.job_chunk_ids[0])
+        await save_job_results(self.app['engine'], self.job_id)
+
+        # the saved job results are read, not the results of the job chunks
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                JobChunkResult.delete().where(JobChunkResult.c.job_chunk_id == self.job_chunk_ids[0])
+            )
+
+        results = await get_job_results(self.app['engine'], self.job_id)
+        assert [result['rnacentral_id'] for result in results] == ['URS0000000001_9606', 'URS0000000002_9606']
+        assert results[1]['alignment_sequence'] == 'GAGUUUGAGACCAGCCUGGCCA'
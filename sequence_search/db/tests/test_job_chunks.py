@@ -15,14 +15,16 @@ import datetime
 import uuid
 
 from aiohttp.test_utils import unittest_run_loop
+import sqlalchemy as sa
 
 from sequence_search.db.tests.test_base import DBTestCase
 from sequence_search.db import DoesNotExist
-from sequence_search.db.models import Job, JobChunk, Consumer, JOB_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES, \
-    CONSUMER_STATUS_CHOICES
-from sequence_search.db.jobs import find_highest_priority_jobs, database_used_in_search
+from sequence_search.db.models import Job, JobChunk, JobChunkResult, Consumer, JOB_STATUS_CHOICES, \
+    JOB_CHUNK_STATUS_CHOICES, CONSUMER_STATUS_CHOICES
+from sequence_search.db.jobs import find_highest_priority_jobs, database_used_in_search, query_digest
 from sequence_search.db.job_chunks import save_job_chunk, get_consumer_ip_from_job_chunk, set_job_chunk_status, \
-    get_job_chunk_from_job_and_database
+    get_job_chunk_from_job_and_database, find_reusable_job_chunks, copy_job_chunk_results, \
+    requeue_expired_job_chunks, start_job_chunk, finish_job_chunk
 
 
 class GetJobChunkFromJobAndDatabase(DBTestCase):
@@ -195,6 +197,315 @@ class FindHighestPriorityJobChunkTestCase(DBTestCase):
         assert job_id == job_id3
         assert database == 'rfam'
 
+    @unittest_run_loop
+    async def test_job_chunk_rank(self):
+        async with self.app['engine'].acquire() as connection:
+            await connection.scalar(
+                JobChunk.insert().values(
+                    job_id=self.job_id,
+                    database='mirbase-2',
+                    submitted=datetime.datetime.now(),
+                    status=JOB_CHUNK_STATUS_CHOICES.pending,
+                    rank=-1
+                )
+            )
+
+        chunks = await find_highest_priority_jobs(self.app['engine'])
+        assert [database for job_id, priority, submitted, database in chunks[:2]] == ['mirbase-2', 'mirbase']
+
+
+class FindReusableJobChunksTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.db.tests.test_job_chunks.FindReusableJobChunksTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        self.query = 'AACAGCATGAGTGCGCTGGATGCTG'
+        self.job_id = str(uuid.uuid4())
+        self.job_id2 = str(uuid.uuid4())
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Job.insert().values(
+                    id=self.job_id,
+                    query=self.query,
+                    query_digest=query_digest(self.query),
+                    submitted=datetime.datetime.now(),
+                    status=JOB_STATUS_CHOICES.success
+                )
+            )
+
+            self.job_chunk_id = await connection.scalar(
+                JobChunk.insert().values(
+                    job_id=self.job_id,
+                    database='mirbase-1.fasta',
+                    submitted=datetime.datetime.now(),
+                    finished=datetime.datetime.now(),
+                    status=JOB_CHUNK_STATUS_CHOICES.success,
+                    hits=1,
+                    release='1000-1'
+                )
+            )
+
+            await connection.execute(
+                JobChunkResult.insert().values(
+                    job_chunk_id=self.job_chunk_id,
+                    rnacentral_id='URS000075D2D2',
+                    description='Mus musculus miR-1195 stem-loop',
+                    score=6.5,
+                    bias=0.7,
+                    e_value=32.0,
+                    target_length=98,
+                    alignment='',
+                    alignment_length=22,
+                    gap_count=0,
+                    match_count=18,
+                    nts_count1=22,
+                    nts_count2=0,
+                    identity=81.8,
+                    query_coverage=73.3,
+                    target_coverage=0.0,
+                    gaps=0.0,
+                    query_length=30,
+                    alignment_start=8,
+                    alignment_stop=29,
+                    alignment_sequence='GAGUUUGAGACCAGCCUGGCCA',
+                    result_id=1
+                )
+            )
+
+            await connection.execute(
+                Job.insert().values(
+                    id=self.job_id2,
+                    query=self.query,
+                    submitted=datetime.datetime.now(),
+                    status=JOB_STATUS_CHOICES.started
+                )
+            )
+
+    @unittest_run_loop
+    async def test_find_reusable_job_chunks(self):
+        job_chunks = await find_reusable_job_chunks(
+            self.app['engine'], self.query.replace('U', 'T').lower(), {'mirbase-1.fasta': '1000-1'}
+        )
+        assert job_chunks == {'mirbase-1.fasta': (self.job_chunk_id, 1)}
+
+    @unittest_run_loop
+    async def test_new_release_is_not_reused(self):
+        job_chunks = await find_reusable_job_chunks(
+            self.app['engine'], self.query, {'mirbase-1.fasta': '1000-2', 'mirbase-2.fasta': '1000-1'}
+        )
+        assert job_chunks == {}
+
+    @unittest_run_loop
+    async def test_copy_job_chunk_results(self):
+        job_chunk_id = await save_job_chunk(self.app['engine'], self.job_id2, 'mirbase-1.fasta', release='1000-1')
+        await copy_job_chunk_results(self.app['engine'], self.job_id2, 'mirbase-1.fasta', self.job_chunk_id, 1)
+
+        async with self.app['engine'].acquire() as connection:
+            query = sa.select([JobChunk.c.status, JobChunk.c.hits]).where(JobChunk.c.id == job_chunk_id)
+            async for row in await connection.execute(query):
+                assert row.status == JOB_CHUNK_STATUS_CHOICES.success
+                assert row.hits == 1
+
+            query = sa.select([JobChunkResult.c.rnacentral_id]).where(JobChunkResult.c.job_chunk_id == job_chunk_id)
+            results = [row.rnacentral_id async for row in await connection.execute(query)]
+            assert results == ['URS000075D2D2']
+
+
+class RequeueExpiredJobChunksTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.db.tests.test_job_chunks.RequeueExpiredJobChunksTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        self.job_id = str(uuid.uuid4())
+        self.now = datetime.datetime.now()
+        minutes = datetime.timedelta(minutes=1)
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Consumer.insert().values(ip='192.168.0.2', status=CONSUMER_STATUS_CHOICES.busy, slots=1, running=1)
+            )
+
+            await connection.execute(
+                Job.insert().values(
+                    id=self.job_id,
+                    query='AACAGCATGAGTGCGCTGGATGCTG',
+                    submitted=self.now - 20 * minutes,
+                    status=JOB_STATUS_CHOICES.success
+                )
+            )
+
+            for database, status, submitted, lease_expires in [
+                ('mirbase-1.fasta', JOB_CHUNK_STATUS_CHOICES.started, self.now - 5 * minutes, self.now - minutes),
+                ('mirbase-2.fasta', JOB_CHUNK_STATUS_CHOICES.started, self.now - 5 * minutes, self.now + minutes),
+                ('mirbase-3.fasta', JOB_CHUNK_STATUS_CHOICES.started, self.now - 5 * minutes, None),
+                ('mirbase-4.fasta', JOB_CHUNK_STATUS_CHOICES.created, None, None),
+            ]:
+                await connection.execute(
+                    JobChunk.insert().values(
+                        job_id=self.job_id,
+                        database=database,
+                        submitted=submitted,
+                        status=status,
+                        consumer='192.168.0.2' if status == JOB_CHUNK_STATUS_CHOICES.started else None,
+                        lease_expires=lease_expires
+                    )
+                )
+
+    @unittest_run_loop
+    async def test_requeue_expired_job_chunks(self):
+        requeued = await requeue_expired_job_chunks(self.app['engine'], self.now, 60, 600)
+        assert sorted(requeued) == [
+            (self.job_id, 'mirbase-1.fasta', '192.168.0.2'),
+            (self.job_id, 'mirbase-3.fasta', '192.168.0.2'),
+            (self.job_id, 'mirbase-4.fasta', None),
+        ]
+
+        async with self.app['engine'].acquire() as connection:
+            query = sa.select([JobChunk.c.database, JobChunk.c.status]).order_by(JobChunk.c.database)
+            statuses = [(row.database, row.status) async for row in await connection.execute(query)]
+            assert statuses == [
+                ('mirbase-1.fasta', JOB_CHUNK_STATUS_CHOICES.pending),
+                ('mirbase-2.fasta', JOB_CHUNK_STATUS_CHOICES.started),
+                ('mirbase-3.fasta', JOB_CHUNK_STATUS_CHOICES.pending),
+                ('mirbase-4.fasta', JOB_CHUNK_STATUS_CHOICES.pending),
+            ]
+
+            query = sa.select([Consumer.c.status]).where(Consumer.c.ip == '192.168.0.2')
+            assert [row.status async for row in await connection.execute(query)] == [CONSUMER_STATUS_CHOICES.suspect]
+
+            query = sa.select([Job.c.status]).where(Job.c.id == self.job_id)
+            assert [row.status async for row in await connection.execute(query)] == [JOB_STATUS_CHOICES.started]
+
+
+class StartFinishJobChunkTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.db.tests.test_job_chunks.StartFinishJobChunkTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        self.job_id = str(uuid.uuid4())
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Consumer.insert().values(ip='192.168.0.2', status=CONSUMER_STATUS_CHOICES.available, slots=2, running=0)
+            )
+
+            await connection.execute(
+                Job.insert().values(
+                    id=self.job_id,
+                    query='AACAGCATGAGTGCGCTGGATGCTG',
+                    submitted=datetime.datetime.now(),
+                    status=JOB_STATUS_CHOICES.started
+                )
+            )
+
+            for database in ['mirbase-1.fasta', 'mirbase-2.fasta']:
+                await connection.execute(
+                    JobChunk.insert().values(
+                        job_id=self.job_id,
+                        database=database,
+                        status=JOB_CHUNK_STATUS_CHOICES.pending
+                    )
+                )
+
+    async def consumer(self):
+        async with self.app['engine'].acquire() as connection:
+            query = sa.select([Consumer.c.status, Consumer.c.running]).where(Consumer.c.ip == '192.168.0.2')
+            async for row in await connection.execute(query):
+                return row.status, row.running
+
+    async def job(self):
+        async with self.app['engine'].acquire() as connection:
+            query = sa.select([Job.c.status, Job.c.hits]).where(Job.c.id == self.job_id)
+            async for row in await connection.execute(query):
+                return row.status, row.hits
+
+    @unittest_run_loop
+    async def test_start_and_finish_job_chunks(self):
+        first = await start_job_chunk(self.app['engine'], self.job_id, 'mirbase-1.fasta', '192.168.0.2')
+        second = await start_job_chunk(self.app['engine'], self.job_id, 'mirbase-2.fasta', '192.168.0.2')
+        assert first and second
+        assert await self.consumer() == (CONSUMER_STATUS_CHOICES.busy, 2)
+        assert await get_consumer_ip_from_job_chunk(self.app['engine'], first) == '192.168.0.2'
+
+        finished = await finish_job_chunk(self.app['engine'], self.job_id, 'mirbase-1.fasta', '192.168.0.2',
+                                          JOB_CHUNK_STATUS_CHOICES.success, hits=3)
+        assert finished == (first, False)
+        assert await self.consumer() == (CONSUMER_STATUS_CHOICES.available, 1)
+        assert await self.job() == (JOB_STATUS_CHOICES.started, None)
+
+        finished = await finish_job_chunk(self.app['engine'], self.job_id, 'mirbase-2.fasta', '192.168.0.2',
+                                          JOB_CHUNK_STATUS_CHOICES.timeout)
+        assert finished == (second, True)
+        assert await self.consumer() == (CONSUMER_STATUS_CHOICES.available, 0)
+        assert await self.job() == (JOB_STATUS_CHOICES.partial_success, 3)
+
+    @unittest_run_loop
+    async def test_start_missing_job_chunk(self):
+        assert await start_job_chunk(self.app['engine'], self.job_id, 'mirbase-3.fasta', '192.168.0.2') is None
+        assert await self.consumer() == (CONSUMER_STATUS_CHOICES.available, 0)
+
+    @unittest_run_loop
+    async def test_start_started_or_finished_job_chunk(self):
+        assert await start_job_chunk(self.app['engine'], self.job_id, 'mirbase-1.fasta', '192.168.0.2')
+        assert await start_job_chunk(self.app['engine'], self.job_id, 'mirbase-1.fasta', '192.168.0.2') is None
+        assert await self.consumer() == (CONSUMER_STATUS_CHOICES.available, 1)
+
+        await finish_job_chunk(self.app['engine'], self.job_id, 'mirbase-1.fasta', '192.168.0.2',
+                               JOB_CHUNK_STATUS_CHOICES.success, hits=3)
+        assert await start_job_chunk(self.app['engine'], self.job_id, 'mirbase-1.fasta', '192.168.0.2') is None
+        assert await self.consumer() == (CONSUMER_STATUS_CHOICES.available, 0)
+
+    @unittest_run_loop
+    async def test_finish_requeued_job_chunk(self):
+        await start_job_chunk(self.app['engine'], self.job_id, 'mirbase-1.fasta', '192.168.0.2')
+        await set_job_chunk_status(self.app['engine'], self.job_id, 'mirbase-1.fasta', JOB_CHUNK_STATUS_CHOICES.pending)
+
+        finished = await finish_job_chunk(self.app['engine'], self.job_id, 'mirbase-1.fasta', '192.168.0.2',
+                                          JOB_CHUNK_STATUS_CHOICES.success, hits=3)
+        assert finished is None
+        assert await self.consumer() == (CONSUMER_STATUS_CHOICES.available, 0)
+
+        async with self.app['engine'].acquire() as connection:
+            query = sa.select([JobChunk.c.status]).where(JobChunk.c.database == 'mirbase-1.fasta')
+            async for row in await connection.execute(query):
+                assert row.status == JOB_CHUNK_STATUS_CHOICES.pending
+
+    @unittest_run_loop
+    async def test_finish_job_chunk_keeps_consumer_status(self):
+        await start_job_chunk(self.app['engine'], self.job_id, 'mirbase-1.fasta', '192.168.0.2')
+        await start_job_chunk(self.app['engine'], self.job_id, 'mirbase-2.fasta', '192.168.0.2')
+
+        # the slots of the consumer were reduced while both job_chunks were running
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(Consumer.update().where(Consumer.c.ip == '192.168.0.2').values(slots=1))
+
+        await finish_job_chunk(self.app['engine'], self.job_id, 'mirbase-1.fasta', '192.168.0.2',
+                               JOB_CHUNK_STATUS_CHOICES.success)
+        assert await self.consumer() == (CONSUMER_STATUS_CHOICES.busy, 1)
+
+        # a lease of the consumer expired, see requeue_expired_job_chunks
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Consumer.update().where(Consumer.c.ip == '192.168.0.2').values(status=CONSUMER_STATUS_CHOICES.suspect)
+            )
+
+        await finish_job_chunk(self.app['engine'], self.job_id, 'mirbase-2.fasta', '192.168.0.2',
+                               JOB_CHUNK_STATUS_CHOICES.success)
+        assert await self.consumer() == (CONSUMER_STATUS_CHOICES.suspect, 0)
+
 
 class GetConsumerIpFromJobChunkTestCase(DBTestCase):
     """
@@ -17,8 +17,12 @@ import uuid
 from aiohttp.test_utils import unittest_run_loop
 
 from sequence_search.db.jobs import get_job, get_job_query, job_exists, JOB_STATUS_CHOICES, save_job, save_r2dt_id, \
-    sequence_exists, set_job_status
-from sequence_search.db.models import Job
+    sequence_exists, set_job_status, find_reusable_job, query_digest, databases_digest, find_pending_jobs, \
+    find_pending_job_chunks, get_queue_depth, QueueDepth, create_job
+from sequence_search.db import SQLError
+import sqlalchemy as sa
+
+from sequence_search.db.models import Job, JobChunk, JobChunkResult, InfernalJob, JOB_CHUNK_STATUS_CHOICES
 from sequence_search.db.tests.test_base import DBTestCase
 
 
@@ -165,6 +169,262 @@ class JobAndSequenceExistsTestCase(DBTestCase):
         assert self.job_id in job
 
 
+class FindReusableJobTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.db.tests.test_jobs.FindReusableJobTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        self.job_id = await save_job(
+            self.app['engine'],
+            query="AACAGCAUGAGUGCGCUGGAUGCUG",
+            description="",
+            url='localhost',
+            priority='low',
+            releases={'mirbase-1.fasta': '1000-1', 'mirbase-2.fasta': '2000-1'}
+        )
+
+    def test_query_digest(self):
+        assert query_digest('aacagcatgagtgc\n') == query_digest('AACAGCAUGAGUGC')
+        assert query_digest('AACAGCAUGAGUGC') != query_digest('AACAGCAUGAGUGG')
+
+    def test_databases_digest(self):
+        assert databases_digest({'mirbase-1.fasta': '1000-1', 'mirbase-2.fasta': '2000-1'}) == \
+            databases_digest({'mirbase-2.fasta': '2000-1', 'mirbase-1.fasta': '1000-1'})
+        assert databases_digest({'mirbase-1.fasta': '1000-1', 'mirbase-2.fasta': '2000-1'}) != \
+            databases_digest({'mirbase-1.fasta': '1000-1', 'mirbase-2.fasta': '2000-2'})
+        assert databases_digest({'mirbase-1.fasta': '1000-1', 'mirbase-2.fasta': None}) is None
+
+    @unittest_run_loop
+    async def test_find_reusable_job(self):
+        job_id = await find_reusable_job(
+            self.app['engine'], 'aacagcatgagtgcgctggatgctg', {'mirbase-2.fasta': '2000-1', 'mirbase-1.fasta': '1000-1'}
+        )
+        assert job_id == self.job_id
+
+    @unittest_run_loop
+    async def test_find_reusable_job_other_databases(self):
+        job_id = await find_reusable_job(self.app['engine'], 'AACAGCAUGAGUGCGCUGGAUGCUG', {'mirbase-1.fasta': '1000-1'})
+        assert job_id is None
+
+    @unittest_run_loop
+    async def test_find_reusable_job_new_release(self):
+        releases = {'mirbase-1.fasta': '1000-1', 'mirbase-2.fasta': '2000-2'}
+        assert await find_reusable_job(self.app['engine'], 'AACAGCAUGAGUGCGCUGGAUGCUG', releases) is None
+
+        # a new job can be saved for the new release
+        job_id = await save_job(
+            self.app['engine'],
+            query="AACAGCATGAGTGCGCTGGATGCTG",
+            description="",
+            url='localhost',
+            priority='low',
+            releases=releases
+        )
+        assert await find_reusable_job(self.app['engine'], 'AACAGCAUGAGUGCGCUGGAUGCUG', releases) == job_id
+
+    @unittest_run_loop
+    async def test_find_reusable_job_outdated_job_chunk(self):
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                JobChunk.insert().values(job_id=self.job_id, database='mirbase-1.fasta', release='1000-0',
+                                         status=JOB_CHUNK_STATUS_CHOICES.success)
+            )
+
+        job_id = await find_reusable_job(
+            self.app['engine'], 'AACAGCAUGAGUGCGCUGGAUGCUG', {'mirbase-1.fasta': '1000-1', 'mirbase-2.fasta': '2000-1'}
+        )
+        assert job_id is None
+
+    @unittest_run_loop
+    async def test_save_job_with_same_query_and_databases(self):
+        with self.assertRaises(SQLError):
+            await save_job(
+                self.app['engine'],
+                query="AACAGCATGAGTGCGCTGGATGCTG",
+                description="",
+                url='localhost',
+                priority='low',
+                releases={'mirbase-2.fasta': '2000-1', 'mirbase-1.fasta': '1000-1'}
+            )
+
+
+class FindPendingJobsTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.db.tests.test_jobs.FindPendingJobsTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        self.job_id = str(uuid.uuid4())
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Job.insert().values(
+                    id=self.job_id,
+                    query='AACAGCATGAGTGCGCTGGATGCTG',
+                    submitted=datetime.datetime.now(),
+                    priority='high',
+                    source='Rfam',
+                    status=JOB_STATUS_CHOICES.started
+                )
+            )
+
+            for rank, (database, status) in enumerate([('mirbase-3.fasta', JOB_CHUNK_STATUS_CHOICES.pending),
+                                                       ('mirbase-1.fasta', JOB_CHUNK_STATUS_CHOICES.started),
+                                                       ('mirbase-2.fasta', JOB_CHUNK_STATUS_CHOICES.pending)]):
+                await connection.execute(
+                    JobChunk.insert().values(job_id=self.job_id, database=database, status=status, rank=rank)
+                )
+
+            await connection.execute(
+                InfernalJob.insert().values(
+                    job_id=self.job_id,
+                    submitted=datetime.datetime.now(),
+                    priority='high',
+                    status=JOB_CHUNK_STATUS_CHOICES.pending
+                )
+            )
+
+    @unittest_run_loop
+    async def test_find_pending_jobs(self):
+        jobs = await find_pending_jobs(self.app['engine'])
+        assert [(job.job_id, job.source, job.chunks, job.infernal) for job in jobs] == [(self.job_id, 'Rfam', 2, True)]
+
+    @unittest_run_loop
+    async def test_find_pending_job_chunks(self):
+        databases = await find_pending_job_chunks(self.app['engine'], {self.job_id: 1})
+        assert databases == {self.job_id: ['mirbase-3.fasta']}
+
+        databases = await find_pending_job_chunks(self.app['engine'], {self.job_id: 5})
+        assert databases == {self.job_id: ['mirbase-3.fasta', 'mirbase-2.fasta']}
+
+    @unittest_run_loop
+    async def test_get_queue_depth(self):
+        depth = await get_queue_depth(self.app['engine'])
+        assert depth == {'high': QueueDepth(tasks=3, predicted_runtime=0.0, unpredicted=3)}
+
+
+class CreateJobTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.db.tests.test_jobs.CreateJobTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        self.query = 'AACAGCATGAGTGCGCTGGATGCTG'
+        self.old_job_id = str(uuid.uuid4())
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Job.insert().values(
+                    id=self.old_job_id,
+                    query=self.query,
+                    submitted=datetime.datetime.now(),
+                    status=JOB_STATUS_CHOICES.success
+                )
+            )
+
+            self.old_job_chunk_id = await connection.scalar(
+                JobChunk.insert().values(
+                    job_id=self.old_job_id,
+                    database='mirbase-1.fasta',
+                    status=JOB_CHUNK_STATUS_CHOICES.success,
+                    hits=1
+                )
+            )
+
+            await connection.execute(
+                JobChunkResult.insert().values(
+                    job_chunk_id=self.old_job_chunk_id,
+                    rnacentral_id='URS000075D2D2',
+                    description='Mus musculus miR-1195 stem-loop',
+                    score=6.5,
+                    bias=0.7,
+                    e_value=32.0,
+                    target_length=98,
+                    alignment='',
+                    alignment_length=22,
+                    gap_count=0,
+                    match_count=18,
+                    nts_count1=22,
+                    nts_count2=0,
+                    identity=81.8,
+                    query_coverage=73.3,
+                    target_coverage=0.0,
+                    gaps=0.0,
+                    query_length=30,
+                    alignment_start=8,
+                    alignment_stop=29,
+                    alignment_sequence='GAGUUUGAGACCAGCCUGGCCA',
+                    result_id=1
+                )
+            )
+
+        self.job_chunks = [
+            {'database': database, 'rank': rank, 'release': '1000-1', 'predicted_runtime': None, 'timeout': None}
+            for rank, database in enumerate(['mirbase-1.fasta', 'mirbase-2.fasta', 'mirbase-3.fasta'])
+        ]
+
+    async def get_job_chunks(self, job_id):
+        async with self.app['engine'].acquire() as connection:
+            query = (sa.select([JobChunk.c.id, JobChunk.c.database, JobChunk.c.status, JobChunk.c.hits])
+                     .where(JobChunk.c.job_id == job_id)
+                     .order_by(JobChunk.c.rank))
+            return [row async for row in await connection.execute(query)]
+
+    @unittest_run_loop
+    async def test_create_job(self):
+        job_id = await create_job(
+            self.app['engine'], self.query, '', '', 'low', ['mirbase-1.fasta', 'mirbase-2.fasta', 'mirbase-3.fasta'],
+            'API', self.job_chunks, reused={'mirbase-1.fasta': (self.old_job_chunk_id, 1)}, skipped=['mirbase-3.fasta']
+        )
+
+        job_chunks = await self.get_job_chunks(job_id)
+        assert [(row.database, row.status, row.hits) for row in job_chunks] == [
+            ('mirbase-1.fasta', JOB_CHUNK_STATUS_CHOICES.success, 1),
+            ('mirbase-2.fasta', JOB_CHUNK_STATUS_CHOICES.pending, None),
+            ('mirbase-3.fasta', JOB_CHUNK_STATUS_CHOICES.success, 0),
+        ]
+
+        async with self.app['engine'].acquire() as connection:
+            query = sa.select([JobChunkResult.c.rnacentral_id]).where(JobChunkResult.c.job_chunk_id == job_chunks[0].id)
+            assert [row.rnacentral_id async for row in await connection.execute(query)] == ['URS000075D2D2']
+
+            query = sa.select([InfernalJob.c.status]).where(InfernalJob.c.job_id == job_id)
+            assert [row.status async for row in await connection.execute(query)] == [JOB_CHUNK_STATUS_CHOICES.pending]
+
+        job = await get_job(self.app['engine'], job_id)
+        assert job['status'] == JOB_STATUS_CHOICES.started
+
+    @unittest_run_loop
+    async def test_create_finished_job(self):
+        job_id = await create_job(
+            self.app['engine'], self.query, '', '', 'low', ['mirbase-1.fasta'], 'API', self.job_chunks[:1],
+            reused={'mirbase-1.fasta': (self.old_job_chunk_id, 1)}, queued=False
+        )
+
+        job = await get_job(self.app['engine'], job_id)
+        assert job['status'] == JOB_STATUS_CHOICES.success
+
+    @unittest_run_loop
+    async def test_create_job_to_dispatch(self):
+        job_id = await create_job(
+            self.app['engine'], self.query, '', '', 'low', ['mirbase-2.fasta'], 'API', self.job_chunks[1:2],
+            queued=False
+        )
+
+        job_chunks = await self.get_job_chunks(job_id)
+        assert [row.status for row in job_chunks] == [JOB_CHUNK_STATUS_CHOICES.created]
+
+
 class SaveR2DTTestCase(DBTestCase):
     """
     Run this test with the following command:
@@ -0,0 +1,55 @@
+"""
+Copyright [2009-2019] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from aiohttp.test_utils import unittest_run_loop
+
+from sequence_search.db.models import Consumer, CONSUMER_STATUS_CHOICES
+from sequence_search.db.consumers import get_consumer_status, set_consumer_status
+from sequence_search.db.session import Session
+from sequence_search.db.tests.test_base import DBTestCase
+
+
+class SessionTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python3 -m unittest sequence_search.db.tests.test_session.SessionTestCase
+    """
+    async def setUpAsync(self):
+        await super().setUpAsync()
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(Consumer.insert().values(ip='192.168.0.2', status=CONSUMER_STATUS_CHOICES.available))
+
+    @unittest_run_loop
+    async def test_session_shares_connection(self):
+        async with Session(self.app['engine']) as session:
+            async with session.acquire() as connection:
+                assert connection is session.connection
+            async with Session(session) as nested:
+                assert nested.connection is session.connection
+
+            await set_consumer_status(session, '192.168.0.2', CONSUMER_STATUS_CHOICES.busy)
+            assert await get_consumer_status(session, '192.168.0.2') == CONSUMER_STATUS_CHOICES.busy
+
+        assert await get_consumer_status(self.app['engine'], '192.168.0.2') == CONSUMER_STATUS_CHOICES.busy
+
+    @unittest_run_loop
+    async def test_transaction_rollback(self):
+        with self.assertRaises(ValueError):
+            async with Session(self.app['engine']) as session:
+                async with session.begin():
+                    await set_consumer_status(session, '192.168.0.2', CONSUMER_STATUS_CHOICES.busy)
+                    raise ValueError('rolls back the unit of work')
+
+        assert await get_consumer_status(self.app['engine'], '192.168.0.2') == CONSUMER_STATUS_CHOICES.available
@@ -0,0 +1,49 @@
+"""
+Copyright [2009-2019] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from aiohttp.test_utils import unittest_run_loop
+
+from sequence_search.db.tests.test_base import DBTestCase
+from sequence_search.db.models import Statistic
+from sequence_search.db.statistic import increment_statistics
+
+
+class IncrementStatisticsTestCase(DBTestCase):
+    """
+    Run this test with the following command:
+
+    ENVIRONMENT=TEST python -m unittest sequence_search.db.tests.test_statistic.IncrementStatisticsTestCase
+    """
+    source = 'test-increment-statistics'
+
+    async def tearDownAsync(self):
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(Statistic.delete().where(Statistic.c.source == self.source))
+
+        await super().tearDownAsync()
+
+    async def get_statistics(self):
+        async with self.app['engine'].acquire() as connection:
+            query = Statistic.select().where(Statistic.c.source == self.source).order_by(Statistic.c.period)
+            return [(row.period, row.total) async for row in connection.execute(query)]
+
+    @unittest_run_loop
+    async def test_increment_statistics(self):
+        await increment_statistics(self.app['engine'], {(self.source, '2020-01'): 3})
+        assert await self.get_statistics() == [('2020-01', 3)]
+
+    @unittest_run_loop
+    async def test_increment_existing_statistics(self):
+        await increment_statistics(self.app['engine'], {(self.source, '2020-01'): 3})
+        await increment_statistics(self.app['engine'], {(self.source, '2020-01'): 2, (self.source, '2020-02'): 1})
+        assert await self.get_statistics() == [('2020-01', 5), ('2020-02', 1)]
@@ -12,6 +12,7 @@ limitations under the License.
 """
 
 import argparse
+import datetime
 import logging
 import asyncio
 
@@ -23,12 +24,16 @@ from aiohttp import web, web_middlewares
 
 from . import settings
 from ..db.models import close_pg, init_pg, migrate
-from ..db.job_chunks import get_job_chunk
-from ..db.jobs import get_job_query, find_highest_priority_jobs
-from ..db.consumers import delegate_job_chunk_to_consumer, find_available_consumers, find_busy_consumers, \
-    set_consumer_status, set_consumer_job_chunk_id, CONSUMER_STATUS_CHOICES, delegate_infernal_job_to_consumer
+from ..db.consumers import find_available_consumer_slots, sync_consumer_slots
+from ..db.job_chunks import requeue_expired_job_chunks
 from ..db.settings import get_postgres_credentials
+from .chunk_sketches import load_chunk_sketches
 from .consumer_client import ConsumerClient
+from .dispatch import dispatch
+from .placement import get_cached_databases, place_jobs
+from .runtime_model import RuntimeModel, refresh_runtime_model
+from .scheduling import find_next_jobs, get_policy
+from .statistics import StatisticsBuffer, flush_statistics
 from .urls import setup_routes
 
 """
@@ -48,12 +53,25 @@ async def on_startup(app):
         # create initial migrations in the database
         await migrate(app['settings'].ENVIRONMENT)
 
-    # initialize scheduling tasks to consumers in the background
+    # initialize scheduling tasks to consumers in the background, consumers wake it up when they finish a job
+    app['scheduler_wakeup'] = asyncio.Event()
     app['check_chunks_task'] = asyncio.create_task(check_chunks_and_consumers(app))
 
+    # count the searches in memory and save them periodically
+    app['statistics'] = StatisticsBuffer()
+    app['flush_statistics_task'] = asyncio.create_task(flush_statistics(app))
+
     # initialize ConsumerClient
     app['consumer_client'] = ConsumerClient()
 
+    # load the k-mer sketches of the database files, used to order the job chunks of each query
+    loop = asyncio.get_event_loop()
+    app['chunk_sketches'] = await loop.run_in_executor(None, load_chunk_sketches)
+
+    # fit the runtime model of the job chunks in the background, it predicts nothing until the first fit
+    app['runtime_model'] = RuntimeModel()
+    app['runtime_model_task'] = asyncio.create_task(refresh_runtime_model(app))
+
 
 async def on_cleanup(app):
     # proper cleanup for background task on app shutdown
@@ -65,6 +83,28 @@ async def on_cleanup(app):
         except asyncio.CancelledError:
             logging.info("Background task check_chunks_and_consumers was cancelled")
 
+    task = app.get('runtime_model_task')
+    if task:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            logging.info("Background task refresh_runtime_model was cancelled")
+
+    # save the searches counted since the last flush
+    task = app.get('flush_statistics_task')
+    if task:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            logging.info("Background task flush_statistics was cancelled")
+
+        try:
+            await app['statistics'].flush(app['engine'])
+        except Exception as e:
+            logging.error(f"Error saving statistics: {str(e)}")
+
     # close the aiohttp session if it exists
     consumer_client = app.get('consumer_client')
     if consumer_client:
@@ -77,55 +117,57 @@ async def on_cleanup(app):
 async def check_chunks_and_consumers(app):
     """
     Periodically runs a task that checks the status of consumers in the database and
-     - schedules job_chunks to run on consumers
-     - restarts stuck consumers
+     - schedules job_chunks to run on free consumer slots
+     - requeues job chunks whose lease expired, see views/job_chunk_heartbeat
+     - frees slots of stuck consumers
+
+    The task runs right away when a consumer reports a finished job (see views/job_done),
+    the periodic pass is a safety net for lost notifications.
     """
     while True:
+        # notifications received from now on trigger another pass
+        app['scheduler_wakeup'].clear()
+
         try:
-            # Fetch jobs and available consumers
-            unfinished_jobs = await find_highest_priority_jobs(app['engine'])
-            available_consumers = await find_available_consumers(app['engine'])
-
-            # Assign jobs to available consumers
-            while unfinished_jobs and available_consumers:
-                consumer = available_consumers.pop(0)
-                job = unfinished_jobs.pop(0)
-                query = await get_job_query(app['engine'], job[0])
-
-                if job[3] is not None:  # data from JobChunk
-                    await delegate_job_chunk_to_consumer(
-                        engine=app['engine'],
-                        consumer_ip=consumer.ip,
-                        consumer_port=consumer.port,
-                        job_id=job[0],
-                        database=job[3],
-                        query=query,
-                        consumer_client=app['consumer_client']
-                    )
-                else:  # data from InfernalJob
-                    await delegate_infernal_job_to_consumer(
-                        engine=app['engine'],
-                        consumer_ip=consumer.ip,
-                        consumer_port=consumer.port,
-                        job_id=job[0],
-                        query=query,
-                        consumer_client=app['consumer_client']
-                    )
-
-            busy_consumers = await find_busy_consumers(app['engine'])
-            for consumer in busy_consumers:
-                if consumer.job_chunk_id is None:
-                    await set_consumer_status(app['engine'], consumer.ip, CONSUMER_STATUS_CHOICES.available)
-                elif consumer.job_chunk_id != 'infernal-job':
-                    job_chunk = await get_job_chunk(app['engine'], consumer.job_chunk_id)
-                    if job_chunk.finished is not None:
-                        await set_consumer_job_chunk_id(app['engine'], consumer.ip, None)
-                        await set_consumer_status(app['engine'], consumer.ip, CONSUMER_STATUS_CHOICES.available)
+            # Fetch free slots of the available consumers and as many jobs as there are slots, more with
+            # affinity placement, as some job chunks may wait for a consumer with their database file in cache
+            available_consumers = await find_available_consumer_slots(app['engine'])
+            unfinished_jobs = []
+            if available_consumers and settings.DISPATCH_MODE != 'pull':  # in pull mode, consumers claim the jobs
+                lookahead = settings.AFFINITY_LOOKAHEAD if settings.AFFINITY_PLACEMENT else 1
+                unfinished_jobs = await find_next_jobs(
+                    app['engine'], app['scheduling_policy'], limit=len(available_consumers) * lookahead
+                )
+
+            # Assign jobs to free consumer slots, preferring the consumers that have the database file
+            # in cache; job chunks against the same database go to the same consumer when possible,
+            # so that it can batch the queries
+            assignments = []
+            if unfinished_jobs:
+                cached = await get_cached_databases(app['engine'])
+                assignments = place_jobs(unfinished_jobs, available_consumers, cached, datetime.datetime.now())
+
+            # submit all the assignments to the consumers at the same time
+            if assignments:
+                await dispatch(app, assignments)
+
+            # requeue the job chunks of consumers that stopped sending heartbeats and the ones stuck in 'created'
+            requeued = await requeue_expired_job_chunks(
+                app['engine'], datetime.datetime.now(), settings.LEASE_DURATION, settings.CREATED_CHUNK_TIMEOUT
+            )
+            for job_id, database, consumer in requeued:
+                logging.warning(f"Requeued job_chunk job_id = {job_id}, database = {database}, consumer = {consumer}")
+
+            # free the slots of consumers that finished a search without releasing its slot
+            await sync_consumer_slots(app['engine'])
 
         except Exception as e:
             logging.error(f"Unexpected error in check_chunks_and_consumers: {str(e)}", exc_info=True)
         finally:
-            await asyncio.sleep(5)
+            try:
+                await asyncio.wait_for(app['scheduler_wakeup'].wait(), settings.SCHEDULER_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
 
 
 def create_app():
@@ -137,6 +179,9 @@ def create_app():
 
     app.update(name='producer', settings=settings)
 
+    # decides which pending job chunks the free consumer slots get
+    app['scheduling_policy'] = get_policy(settings.SCHEDULER_POLICY)
+
     # setup Jinja2 template renderer; jinja2 contains various loaders, can also try PackageLoader etc.
     aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader(str(settings.PROJECT_ROOT / 'static')))
 
@@ -0,0 +1,81 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+import math
+
+from . import settings
+from .scheduling import priority_level
+from ..db.consumers import count_consumer_slots
+from ..db.jobs import get_queue_depth
+from ..db.session import Session
+
+
+"""
+Admission control of api/submit-job.
+
+The wait of a new job is estimated from the queued work of the jobs with the same or a higher priority,
+spread over all consumer slots. Low priority jobs of the ADMISSION_SOURCES are rejected with
+429 Too Many Requests while the wait or the number of queued tasks is above its threshold;
+the other jobs are always accepted.
+"""
+
+
+async def get_queue_state(app):
+    """Returns the queue depth and the number of consumer slots, cached for ADMISSION_REFRESH seconds"""
+    now = datetime.datetime.now()
+    state = app.get('queue_state')
+    if state is None or (now - state[0]).total_seconds() > settings.ADMISSION_REFRESH:
+        async with Session(app['engine']) as session:
+            depth = await get_queue_depth(session)
+            slots = await count_consumer_slots(session)
+        app['queue_state'] = state = (now, depth, slots)
+    return state[1], state[2]
+
+
+def estimate_wait(depth, slots, priority):
+    """
+    Returns the estimated seconds until a consumer starts a new job of the given priority.
+
+    :param depth: dict {priority: QueueDepth} as returned by get_queue_depth
+    :param slots: total number of consumer slots
+    :param priority: priority of the new job
+    :return: seconds, None if there is no consumer to run the job
+    """
+    if not slots:
+        return None
+
+    level = priority_level(priority)
+    seconds = sum(
+        queued.predicted_runtime + queued.unpredicted * settings.ADMISSION_DEFAULT_RUNTIME
+        for job_priority, queued in depth.items() if priority_level(job_priority) <= level
+    )
+    return seconds / slots
+
+
+def retry_after(depth, wait, priority, source):
+    """
+    Decides whether a new job is accepted.
+
+    :return: None if the job is accepted, otherwise the seconds after which the client should try again
+    """
+    sources = [item.strip() for item in settings.ADMISSION_SOURCES.split(',')]
+    if not settings.ADMISSION_CONTROL or priority != 'low' or source not in sources:
+        return None
+
+    excess = wait - settings.ADMISSION_MAX_WAIT if wait is not None else 0
+    queued = sum(queued.tasks for queued in depth.values())
+    if excess <= 0 and queued <= settings.ADMISSION_MAX_QUEUED:
+        return None
+
+    return max(int(math.ceil(excess)), settings.ADMISSION_MIN_RETRY)
@@ -0,0 +1,195 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import math
+import mmap
+import os
+import struct
+
+from ..consumer.rnacentral_databases import database_file_path, get_database_files
+
+
+# length of the k-mers stored in the sketches
+KMER_LENGTH = 16
+
+# sketch file header: magic, size of the filter in bits, number of hash functions, false positive rate
+HEADER = struct.Struct('<8sQQd')
+MAGIC = b'SKETCH01'
+
+MASK = 0xFFFFFFFFFFFFFFFF
+
+# 2-bit encoding of the nucleotides, k-mers with any other character are not stored
+ENCODING = {'A': 0, 'C': 1, 'G': 2, 'U': 3, 'T': 3}
+
+
+def sketch_file_path(database):
+    """Returns path to the sketch of a database file (e.g. mirbase-1.fasta.sketch)"""
+    return str(database_file_path(database)) + '.sketch'
+
+
+def kmers(sequence):
+    """Yields the 2-bit codes of every k-mer in the sequence that consists of A, C, G and U/T only"""
+    mask = 4 ** KMER_LENGTH
+    code, valid = 0, 0
+    for char in sequence.upper():
+        value = ENCODING.get(char)
+        if value is None:
+            code, valid = 0, 0
+            continue
+        code = (code * 4 + value) % mask
+        valid += 1
+        if valid >= KMER_LENGTH:
+            yield code
+
+
+def bit_positions(code, size, hashes):
+    """Returns the bits of a k-mer in a bloom filter of the given size, with double hashing"""
+    first = (code * 0x9E3779B97F4A7C15) & MASK
+    second = (((code ^ (code >> 29)) * 0xBF58476D1CE4E5B9) & MASK) | 1
+    return [(first + i * second) % size for i in range(hashes)]
+
+
+def read_sequences(filename):
+    """Yields the sequences of a fasta file"""
+    with open(filename, 'r') as f:
+        sequence = []
+        for line in f:
+            if line.startswith('>'):
+                yield ''.join(sequence)
+                sequence = []
+            else:
+                sequence.append(line.strip())
+        yield ''.join(sequence)
+
+
+class ChunkSketch(object):
+    """
+    Bloom filter of the k-mers of a database file.
+
+    The fraction of query k-mers found in the filter, corrected for the false positive rate,
+    estimates the density of hits of the query in the database file.
+
+    The filter has bits_per_kmer bits for every k-mer of the file and the number of hash functions
+    that minimizes its false positive rate, about 1% with 10 bits per k-mer. Sketch files are
+    memory-mapped, so only the pages of the bits of the queried k-mers are read.
+    """
+    def __init__(self, bits, size, hashes, false_positive_rate):
+        self.bits = bits
+        self.size = size
+        self.hashes = hashes
+        self.false_positive_rate = false_positive_rate
+
+    @classmethod
+    def build(cls, filename, bits_per_kmer):
+        # the number of k-mers is an upper bound of the number of distinct ones
+        count = sum(sum(1 for code in kmers(sequence)) for sequence in read_sequences(filename))
+        size = max(64, int(count * bits_per_kmer))
+        hashes = max(1, int(round(bits_per_kmer * math.log(2))))
+
+        bits = bytearray((size + 7) // 8)
+        for sequence in read_sequences(filename):
+            for code in kmers(sequence):
+                for bit in bit_positions(code, size, hashes):
+                    bits[bit // 8] |= 1 << (bit % 8)
+
+        ones = sum(bin(byte).count('1') for byte in bits)
+        return cls(bytes(bits), size, hashes, (float(ones) / size) ** hashes)
+
+    @classmethod
+    def load(cls, filename):
+        """Memory-maps a sketch file written by save"""
+        with open(filename, 'rb') as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        magic, size, hashes, false_positive_rate = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError('%s is not a chunk sketch, build it again' % filename)
+        return cls(view[HEADER.size:HEADER.size + (size + 7) // 8], size, hashes, false_positive_rate)
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.size, self.hashes, self.false_positive_rate))
+            f.write(self.bits)
+
+    def contains(self, code):
+        return all(self.bits[bit // 8] & (1 << (bit % 8)) for bit in bit_positions(code, self.size, self.hashes))
+
+    def score(self, codes):
+        """
+        Returns the estimated fraction of the query k-mers that are present in the database file,
+        between 0 (no shared k-mers) and 1 (all k-mers shared).
+
+        :param codes: set of k-mer codes of the query
+        """
+        if not codes:
+            return None
+
+        if self.false_positive_rate >= 1:
+            # the filter is saturated, every k-mer seems to be present
+            return None
+
+        found = float(sum(1 for code in codes if self.contains(code))) / len(codes)
+        if found == 0:
+            return 0.0
+
+        # a database file with shared k-mers stays above the ones without any, even if they are false positives
+        return max(0.000001, (found - self.false_positive_rate) / (1 - self.false_positive_rate))
+
+
+def load_chunk_sketches():
+    """Loads the sketches of all database files that have one, see __main__ below"""
+    sketches = {}
+    for file in get_database_files():
+        if os.path.isfile(sketch_file_path(file.name)):
+            try:
+                sketches[file.name] = ChunkSketch.load(sketch_file_path(file.name))
+            except Exception as e:
+                logging.error(f"Error loading the sketch of {file.name}: {str(e)}")
+    return sketches
+
+
+def rank_databases(sketches, query, databases):
+    """
+    Orders the database files of a search by the estimated density of hits of the query,
+    so that the most promising job chunks are dispatched first.
+
+    :param sketches: dict {database file: ChunkSketch}
+    :param query: query sequence
+    :param databases: list of database files, as returned by producer_to_consumers_databases
+    :return: list of (database, score), the databases that share k-mers with the query first,
+        then the databases that can't be scored (score None) and the ones without shared k-mers (score 0)
+    """
+    codes = set(kmers(query))
+    scores = [(database, sketches[database].score(codes) if database in sketches else None)
+              for database in databases]
+
+    def key(item):
+        database, score = item
+        if score is None:
+            return 1, 0
+        return (0, -score) if score > 0 else (2, 0)
+
+    return sorted(scores, key=key)
+
+
+if __name__ == "__main__":
+    """Precompute the sketches, e.g. python3 -m sequence_search.producer.chunk_sketches mirbase-1.fasta"""
+    import sys
+    from .settings import CHUNK_SKETCH_BITS_PER_KMER
+    if len(sys.argv) < 2:
+        print('Provide the names of the database files to sketch')
+        sys.exit(1)
+    for database in sys.argv[1:]:
+        ChunkSketch.build(database_file_path(database), CHUNK_SKETCH_BITS_PER_KMER).save(sketch_file_path(database))
+        print('Sketched %s' % database)
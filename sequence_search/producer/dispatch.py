@@ -0,0 +1,75 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import logging
+
+from . import settings
+from ..db.consumers import delegate_job_chunk_to_consumer, delegate_infernal_job_to_consumer
+from ..db.jobs import get_job_queries
+from ..db.job_chunks import requeue_job_chunks
+
+
+async def dispatch(app, assignments, queries=None):
+    """
+    Delegates job chunks and infernal jobs to consumer slots concurrently, at most DISPATCH_CONCURRENCY
+    requests at a time and each within DISPATCH_TIMEOUT, so that a slow or dead consumer
+    doesn't hold back the others. The job chunks that could not be delegated are returned to pending.
+
+    :param app: application with the engine and the consumer_client
+    :param assignments: list of (consumer, job_id, database), database is None for an infernal job
+    :param queries: dict {job_id: query} (optional, read from the database if missing)
+    :return: list of (job_id, database) that could not be delegated
+    """
+    engine = app['engine']
+    if queries is None:
+        queries = await get_job_queries(engine, {job_id for consumer, job_id, database in assignments})
+
+    semaphore = asyncio.Semaphore(settings.DISPATCH_CONCURRENCY)
+
+    async def delegate(consumer, job_id, database):
+        async with semaphore:
+            if database is None:
+                request = delegate_infernal_job_to_consumer(
+                    engine=engine,
+                    consumer_ip=consumer.ip,
+                    consumer_port=consumer.port,
+                    job_id=job_id,
+                    query=queries[job_id],
+                    consumer_client=app['consumer_client']
+                )
+            else:
+                request = delegate_job_chunk_to_consumer(
+                    engine=engine,
+                    consumer_ip=consumer.ip,
+                    consumer_port=consumer.port,
+                    job_id=job_id,
+                    database=database,
+                    query=queries[job_id],
+                    consumer_client=app['consumer_client']
+                )
+
+            try:
+                return await asyncio.wait_for(request, settings.DISPATCH_TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.error(f"Timeout while submitting job {job_id} to {consumer.ip}:{consumer.port}.")
+                return False
+
+    delegated = await asyncio.gather(*[delegate(*assignment) for assignment in assignments])
+    failed = [(job_id, database) for (consumer, job_id, database), success in zip(assignments, delegated)
+              if not success]
+
+    # infernal jobs are pending until a consumer starts them, only new job chunks have to be requeued
+    await requeue_job_chunks(engine, [(job_id, database) for job_id, database in failed if database is not None])
+
+    return failed
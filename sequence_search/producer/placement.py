@@ -0,0 +1,73 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+
+from . import settings
+from ..db.consumers import find_cached_databases, pop_consumer_slot
+
+
+"""
+Database-affinity placement of the job chunks.
+
+Consumers read the database files from NFS, a job chunk runs at memory speed only on a consumer
+that has its database file in the page cache, i.e. that searched it recently. Job chunks wait up to
+AFFINITY_MAX_WAIT seconds for a slot on such a consumer, then any free consumer slot takes them.
+"""
+
+
+async def get_cached_databases(engine):
+    """Returns {consumer ip: set of database files} that are likely in the page cache of each consumer"""
+    if not settings.AFFINITY_PLACEMENT:
+        return {}
+    since = datetime.datetime.now() - datetime.timedelta(seconds=settings.AFFINITY_WINDOW)
+    return await find_cached_databases(engine, since, settings.AFFINITY_CACHE_FILES)
+
+
+def place_jobs(jobs, slots, cached, now, max_wait=None):
+    """
+    Assigns the jobs to the free consumer slots.
+
+    :param jobs: list of (job_id, priority, submitted, database) as returned by find_next_jobs,
+        database is None for an infernal job
+    :param slots: free consumer slots as returned by find_available_consumer_slots, the assigned slots are removed
+    :param cached: {consumer ip: set of database files} as returned by get_cached_databases, updated with
+        the assignments, so that job chunks against the same database go to the same consumer and can be batched
+    :param now: current datetime
+    :param max_wait: seconds that a job chunk waits for a consumer with its database file in cache,
+        AFFINITY_MAX_WAIT if None
+    :return: list of (consumer, job_id, database); the job chunks left out wait for another pass
+    """
+    max_wait = datetime.timedelta(seconds=settings.AFFINITY_MAX_WAIT if max_wait is None else max_wait)
+
+    assignments = []
+    for job_id, priority, submitted, database in jobs:
+        if not slots:
+            break
+
+        if database is None:
+            # infernal jobs don't read the database files
+            assignments.append((pop_consumer_slot(slots), job_id, database))
+            continue
+
+        warm = [ip for ip, databases in cached.items() if database in databases]
+        consumer_ip = next((consumer.ip for consumer in slots if consumer.ip in warm), None)
+        if consumer_ip is None and warm and submitted and now - submitted < max_wait:
+            # the consumers with this database file in cache are busy, wait for one of them to finish
+            continue
+
+        consumer = pop_consumer_slot(slots, consumer_ip)
+        cached.setdefault(consumer.ip, set()).add(database)
+        assignments.append((consumer, job_id, database))
+
+    return assignments
@@ -0,0 +1,104 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import datetime
+import logging
+
+from . import settings
+from ..db.job_chunks import get_job_chunk_runtimes
+
+
+class RuntimeModel(object):
+    """
+    Predicts the runtime of a job chunk from the length of the query, with a linear model
+    (seconds = intercept + slope * query length) fitted to the recent job chunks of each database file.
+    """
+    def __init__(self, coefficients=None, fitted=None):
+        self.coefficients = coefficients or {}  # {database: (intercept, slope, samples)}
+        self.fitted = fitted
+
+    @classmethod
+    def fit(cls, runtimes, min_samples=10):
+        """
+        :param runtimes: list of (database, query length, seconds), see get_job_chunk_runtimes
+        :param min_samples: database files with fewer job chunks are not predicted
+        """
+        samples = {}
+        for database, length, seconds in runtimes:
+            samples.setdefault(database, []).append((length, seconds))
+
+        coefficients = {}
+        for database, points in samples.items():
+            if len(points) < min_samples:
+                continue
+
+            n = float(len(points))
+            mean_x = sum(x for x, y in points) / n
+            mean_y = sum(y for x, y in points) / n
+            variance = sum((x - mean_x) ** 2 for x, y in points)
+            covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+
+            # longer queries never take less time
+            slope = max(covariance / variance, 0.0) if variance else 0.0
+            coefficients[database] = (mean_y - slope * mean_x, slope, len(points))
+
+        return cls(coefficients, datetime.datetime.now())
+
+    def predict(self, database, length):
+        """Returns the predicted runtime in seconds, or None if the database file has no model"""
+        if database not in self.coefficients:
+            return None
+        intercept, slope, samples = self.coefficients[database]
+        return max(intercept + slope * length, 0.0)
+
+    def timeout(self, database, length):
+        """Returns the deadline of a job chunk in seconds, RUNTIME_TIMEOUT_FACTOR times its predicted runtime"""
+        predicted = self.predict(database, length)
+        if predicted is None:
+            return None
+        return int(max(predicted * settings.RUNTIME_TIMEOUT_FACTOR, settings.RUNTIME_TIMEOUT_MIN))
+
+    def order(self, databases, length):
+        """
+        Orders the database files of a job by decreasing predicted runtime, so that the longest
+        job chunks start first and the whole job finishes sooner. Database files without a model
+        may be the longest ones, they come first. The order of the input breaks ties.
+        """
+        def key(item):
+            index, database = item
+            predicted = self.predict(database, length)
+            return (0, 0, index) if predicted is None else (1, -predicted, index)
+
+        return [database for index, database in sorted(enumerate(databases), key=key)]
+
+    def to_json(self):
+        return {
+            'fitted': str(self.fitted) if self.fitted else None,
+            'databases': {
+                database: {'intercept': intercept, 'slope': slope, 'samples': samples}
+                for database, (intercept, slope, samples) in sorted(self.coefficients.items())
+            }
+        }
+
+
+async def refresh_runtime_model(app):
+    """Periodically fits the runtime model to the job chunks of the last RUNTIME_MODEL_HISTORY days"""
+    while True:
+        try:
+            since = datetime.datetime.now() - datetime.timedelta(days=settings.RUNTIME_MODEL_HISTORY)
+            runtimes = await get_job_chunk_runtimes(app['engine'], since)
+            app['runtime_model'] = RuntimeModel.fit(runtimes, settings.RUNTIME_MODEL_MIN_SAMPLES)
+        except Exception as e:
+            logging.error(f"Error fitting the runtime model: {str(e)}")
+        await asyncio.sleep(settings.RUNTIME_MODEL_REFRESH)
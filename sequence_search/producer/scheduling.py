@@ -0,0 +1,190 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+from collections import Counter, deque
+
+from . import settings
+from ..db.jobs import find_pending_jobs, find_pending_job_chunks, count_running_jobs_by_source
+
+
+"""
+Scheduling policies decide which pending job chunks and infernal jobs get the free consumer slots.
+The policy is chosen with the SCHEDULER_POLICY setting, see POLICIES below.
+"""
+
+# priorities of the jobs, from the highest to the lowest, see submit_job
+PRIORITIES = ['critical', 'db-seq-test', 'high', 'low']
+
+# source of the jobs submitted before the sources were recorded
+DEFAULT_SOURCE = 'API'
+
+
+def priority_level(priority):
+    """Returns 0 for the highest priority, unknown priorities come last"""
+    try:
+        return PRIORITIES.index(priority)
+    except ValueError:
+        return len(PRIORITIES)
+
+
+def parse_values(text):
+    """Parses settings like 'RNAcentral:2,Rfam:1' into {'RNAcentral': 2.0, 'Rfam': 1.0}"""
+    values = {}
+    for item in text.split(','):
+        if item.strip():
+            key, value = item.rsplit(':', 1)
+            values[key.strip()] = float(value)
+    return values
+
+
+def tasks(job):
+    """Number of consumer slots that a PendingJob can take"""
+    return job.chunks + (1 if job.infernal else 0)
+
+
+class SchedulingPolicy(object):
+    """
+    Base class of the scheduling policies. Subclasses either order the jobs with key()
+    or override select() if jobs can't be ordered independently of each other.
+    """
+    def key(self, job, now):
+        raise NotImplementedError
+
+    def select(self, jobs, running, limit, now):
+        """
+        :param jobs: list of PendingJob
+        :param running: dict {source: number of running job chunks and infernal jobs}
+        :param limit: number of free consumer slots
+        :param now: current time
+        :return: list of job ids, one per slot, a job appears once for each of its tasks that gets a slot
+        """
+        selected = []
+        for job in sorted(jobs, key=lambda job: self.key(job, now)):
+            if len(selected) >= limit:
+                break
+            selected.extend([job.job_id] * min(tasks(job), limit - len(selected)))
+        return selected
+
+
+class PriorityPolicy(SchedulingPolicy):
+    """Strict priority, jobs with the same priority are run in the order they were submitted"""
+    def key(self, job, now):
+        return priority_level(job.priority), job.submitted or datetime.datetime.min
+
+
+class AgingPolicy(SchedulingPolicy):
+    """Strict priority, but a job moves up one priority level for every `interval` seconds that it waits"""
+    def __init__(self, interval):
+        self.interval = interval
+
+    def key(self, job, now):
+        submitted = job.submitted or now
+        waited = max((now - submitted).total_seconds(), 0)
+        return max(priority_level(job.priority) - int(waited // self.interval), 0), submitted
+
+
+class FairSharePolicy(SchedulingPolicy):
+    """
+    Weighted fair share between the sources of the jobs (RNAcentral, Rfam, API...): every free slot goes
+    to the source with the lowest number of running tasks relative to its weight, so that one source
+    can't starve the others. The jobs of a source are ordered with the aging policy.
+    """
+    def __init__(self, shares, interval):
+        self.shares = shares
+        self.aging = AgingPolicy(interval)
+
+    def weight(self, source):
+        return self.shares.get(source, 1.0)
+
+    def select(self, jobs, running, limit, now):
+        queues = {}
+        for job in sorted(jobs, key=lambda job: self.aging.key(job, now)):
+            queue = queues.setdefault(job.source or DEFAULT_SOURCE, deque())
+            queue.extend([job.job_id] * min(tasks(job), limit - len(queue)))
+
+        load = Counter()
+        for source, count in running.items():
+            load[source or DEFAULT_SOURCE] += count
+
+        selected = []
+        queues = {source: queue for source, queue in queues.items() if queue}
+        while queues and len(selected) < limit:
+            source = min(queues, key=lambda source: (load[source] / self.weight(source), source))
+            selected.append(queues[source].popleft())
+            load[source] += 1
+            if not queues[source]:
+                del queues[source]
+        return selected
+
+
+class DeadlinePolicy(SchedulingPolicy):
+    """
+    Earliest deadline first for the sources with a latency target, e.g. the expert databases
+    that embed the search; the jobs of the other sources follow, ordered with the aging policy.
+    """
+    def __init__(self, deadlines, interval):
+        self.deadlines = deadlines
+        self.aging = AgingPolicy(interval)
+
+    def key(self, job, now):
+        if job.source in self.deadlines:
+            submitted = job.submitted or now
+            return (0, submitted + datetime.timedelta(seconds=self.deadlines[job.source]))
+        return (1, ) + self.aging.key(job, now)
+
+
+POLICIES = {
+    'priority': lambda: PriorityPolicy(),
+    'aging': lambda: AgingPolicy(settings.SCHEDULER_AGING),
+    'fair-share': lambda: FairSharePolicy(parse_values(settings.SCHEDULER_SHARES), settings.SCHEDULER_AGING),
+    'deadline': lambda: DeadlinePolicy(parse_values(settings.SCHEDULER_DEADLINES), settings.SCHEDULER_AGING),
+}
+
+
+def get_policy(name):
+    """Returns the scheduling policy with the given name, see POLICIES"""
+    if name not in POLICIES:
+        raise ValueError("Unknown scheduling policy %s, choose one of %s" % (name, ', '.join(POLICIES)))
+    return POLICIES[name]()
+
+
+async def find_next_jobs(engine, policy, limit):
+    """
+    Picks the job chunks and infernal jobs that the free consumer slots should run next.
+    The infernal job of a job comes before its job chunks, the job chunks follow their rank.
+
+    :param engine: params to connect to the db
+    :param policy: SchedulingPolicy
+    :param limit: number of free consumer slots
+    :return: list of (job_id, priority, submitted, database), database is None for an infernal job,
+        the same as find_highest_priority_jobs
+    """
+    jobs = {job.job_id: job for job in await find_pending_jobs(engine)}
+    running = await count_running_jobs_by_source(engine) if isinstance(policy, FairSharePolicy) else {}
+    selected = policy.select(list(jobs.values()), running, limit, datetime.datetime.now())
+
+    counts = Counter(selected)
+    chunks = {job_id: count - (1 if jobs[job_id].infernal else 0) for job_id, count in counts.items()}
+    databases = await find_pending_job_chunks(engine, {job_id: count for job_id, count in chunks.items() if count})
+
+    output = []
+    infernal = set()
+    for job_id in selected:
+        job = jobs[job_id]
+        if job.infernal and job_id not in infernal:
+            infernal.add(job_id)
+            output.append((job_id, job.priority, job.submitted, None))
+        elif databases.get(job_id):
+            output.append((job_id, job.priority, job.submitted, databases[job_id].pop(0)))
+    return output
@@ -35,6 +35,105 @@ CONSUMER_SUBMIT_INFERNAL_JOB_URL = 'submit-infernal-job'
 MIN_QUERY_LENGTH = 10
 MAX_QUERY_LENGTH = 7000
 
+# bits of the k-mer sketches of the database files per k-mer of the file, see chunk_sketches
+CHUNK_SKETCH_BITS_PER_KMER = 10
+
+# do not search the database files that share no k-mers with the query, according to their sketches
+CHUNK_SKETCH_SKIP = False
+
+# copy the results of finished job_chunks that searched the same query against the same database file
+CHUNK_RESULTS_REUSE = True
+
+# 'push' submits the work to the consumers, 'pull' leaves it pending for the consumers to claim it,
+# must be the same as the DISPATCH_MODE of the consumers
+DISPATCH_MODE = 'push'
+
+# maximum number of job chunks and infernal jobs that are submitted to the consumers at the same time
+DISPATCH_CONCURRENCY = 16
+
+# seconds to wait for a consumer to accept a job chunk or an infernal job
+DISPATCH_TIMEOUT = 10
+
+# start the job chunks of a job that are predicted to take longest first, see runtime_model
+RUNTIME_ORDER = True
+
+# seconds between two fits of the runtime model
+RUNTIME_MODEL_REFRESH = 600
+
+# days of job chunks used to fit the runtime model
+RUNTIME_MODEL_HISTORY = 7
+
+# minimum number of job chunks of a database file to predict its runtime
+RUNTIME_MODEL_MIN_SAMPLES = 10
+
+# the deadline of a job chunk is its predicted runtime times this factor, but at least RUNTIME_TIMEOUT_MIN seconds;
+# consumers still stop every search after their MAX_RUN_TIME
+RUNTIME_TIMEOUT_FACTOR = 4.0
+RUNTIME_TIMEOUT_MIN = 60
+
+# which pending job chunks the free consumer slots get: 'priority', 'aging', 'fair-share' or 'deadline',
+# see scheduling.POLICIES
+SCHEDULER_POLICY = 'priority'
+
+# seconds of waiting that move a job up one priority level ('aging', 'fair-share' and 'deadline' policies)
+SCHEDULER_AGING = 600
+
+# weights of the sources of the jobs in the 'fair-share' policy, the other sources have a weight of 1
+SCHEDULER_SHARES = 'RNAcentral:2'
+
+# latency targets in seconds of the sources of the jobs in the 'deadline' policy
+SCHEDULER_DEADLINES = 'miRBase:60,snoDB:60,GtRNAdb:60,Ribocentre:60'
+
+# seconds between the periodic passes of the scheduler, which also runs whenever a consumer calls api/job-done
+SCHEDULER_INTERVAL = 5
+
+# seconds that a heartbeat of a consumer extends the lease of its running job chunks; the job chunks whose lease
+# expires are requeued, must be a few times the HEARTBEAT_INTERVAL of the consumers
+LEASE_DURATION = 60
+
+# seconds after which the job chunks of a job that are still 'created' are requeued
+CREATED_CHUNK_TIMEOUT = 600
+
+# send the job chunks to the consumers that searched the same database file recently, see placement
+AFFINITY_PLACEMENT = True
+
+# seconds of job chunks used to tell which database files are in the page cache of a consumer
+AFFINITY_WINDOW = 1800
+
+# number of recently searched database files that fit in the page cache of a consumer
+AFFINITY_CACHE_FILES = 8
+
+# seconds that a job chunk may wait for a consumer with its database file in cache, before any consumer takes it
+AFFINITY_MAX_WAIT = 15
+
+# the scheduler considers this many pending jobs per free slot, so that the slots left by waiting job chunks
+# go to other job chunks
+AFFINITY_LOOKAHEAD = 2
+
+# seconds between two saves of the search statistics counted in memory, see statistics
+STATISTICS_FLUSH_INTERVAL = 30
+
+# reject the low priority jobs of ADMISSION_SOURCES with 429 Too Many Requests while the queue is too long
+ADMISSION_CONTROL = True
+
+# comma-separated sources of the jobs that can be rejected, see submit_job
+ADMISSION_SOURCES = 'API'
+
+# estimated seconds of waiting for a consumer above which new jobs are rejected
+ADMISSION_MAX_WAIT = 300
+
+# number of queued job chunks and infernal jobs above which new jobs are rejected
+ADMISSION_MAX_QUEUED = 2000
+
+# seconds that a queued job chunk without a predicted runtime is expected to take, see runtime_model
+ADMISSION_DEFAULT_RUNTIME = 30
+
+# minimum seconds of the Retry-After header of rejected jobs
+ADMISSION_MIN_RETRY = 30
+
+# seconds that the queue depth is cached for, so that a spike of submissions doesn't query it every time
+ADMISSION_REFRESH = 2
+
 ENVIRONMENT = os.getenv('ENVIRONMENT', 'LOCAL')
 
 # add settings from environment-specific files
@@ -0,0 +1,58 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+
+from . import settings
+from ..db.statistic import increment_statistics
+
+
+class StatisticsBuffer(object):
+    """
+    Counts the searches of each source and period in memory, so that submit_job does no database I/O for them.
+    The counts are added to the statistic table every STATISTICS_FLUSH_INTERVAL seconds, see flush_statistics.
+    """
+    def __init__(self):
+        self.counts = Counter()
+
+    def add(self, source, period):
+        self.counts[(source, period)] += 1
+
+    def take(self):
+        """Returns the counts since the last call and starts counting from zero"""
+        counts, self.counts = self.counts, Counter()
+        return counts
+
+    def restore(self, counts):
+        """Puts back counts that could not be saved, they are saved with the next flush"""
+        self.counts.update(counts)
+
+    async def flush(self, engine):
+        counts = self.take()
+        try:
+            await increment_statistics(engine, dict(counts))
+        except Exception:
+            self.restore(counts)
+            raise
+
+
+async def flush_statistics(app):
+    """Periodically saves the counted searches to the statistic table"""
+    while True:
+        await asyncio.sleep(settings.STATISTICS_FLUSH_INTERVAL)
+        try:
+            await app['statistics'].flush(app['engine'])
+        except Exception as e:
+            logging.error(f"Error saving statistics: {str(e)}")
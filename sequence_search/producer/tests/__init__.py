@@ -16,3 +16,12 @@ from .test_job_result import *
 from .test_job_status import *
 from .test_r2dt import *
 from .test_submit_job import *
+from .test_chunk_sketches import *
+from .test_job_done import *
+from .test_dispatch import *
+from .test_scheduling import *
+from .test_runtime_model import *
+from .test_placement import *
+from .test_job_chunk_heartbeat import *
+from .test_admission import *
+from .test_statistics import *
@@ -0,0 +1,56 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+
+from sequence_search.db.jobs import QueueDepth
+from sequence_search.producer import settings
+from sequence_search.producer.admission import estimate_wait, retry_after
+
+"""
+Run these tests with:
+
+ENVIRONMENT=TEST python3 -m unittest sequence_search.producer.tests.test_admission
+"""
+
+DEPTH = {
+    'critical': QueueDepth(tasks=2, predicted_runtime=20.0, unpredicted=0),
+    'high': QueueDepth(tasks=10, predicted_runtime=300.0, unpredicted=2),
+    'low': QueueDepth(tasks=100, predicted_runtime=4000.0, unpredicted=0),
+}
+
+
+class AdmissionTestCase(unittest.TestCase):
+    def test_estimate_wait(self):
+        assert estimate_wait(DEPTH, 10, 'critical') == 2.0
+        assert estimate_wait(DEPTH, 10, 'high') == (20 + 300 + 2 * settings.ADMISSION_DEFAULT_RUNTIME) / 10.0
+        assert estimate_wait(DEPTH, 10, 'low') == (4320 + 2 * settings.ADMISSION_DEFAULT_RUNTIME) / 10.0
+        assert estimate_wait({}, 10, 'low') == 0
+        assert estimate_wait(DEPTH, 0, 'low') is None
+
+    def test_short_queue_is_accepted(self):
+        assert retry_after(DEPTH, settings.ADMISSION_MAX_WAIT - 1, 'low', 'API') is None
+
+    def test_long_queue_is_rejected(self):
+        wait = settings.ADMISSION_MAX_WAIT + 1000
+        assert retry_after(DEPTH, wait, 'low', 'API') == 1000
+        assert retry_after(DEPTH, settings.ADMISSION_MAX_WAIT + 1, 'low', 'API') == settings.ADMISSION_MIN_RETRY
+
+    def test_many_queued_tasks_are_rejected(self):
+        depth = {'low': QueueDepth(tasks=settings.ADMISSION_MAX_QUEUED + 1, predicted_runtime=0.0, unpredicted=0)}
+        assert retry_after(depth, 0, 'low', 'API') == settings.ADMISSION_MIN_RETRY
+
+    def test_expert_databases_are_always_accepted(self):
+        wait = settings.ADMISSION_MAX_WAIT + 1000
+        assert retry_after(DEPTH, wait, 'critical', 'miRBase') is None
+        assert retry_after(DEPTH, wait, 'low', 'RNAcentral') is None
@@ -0,0 +1,82 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import random
+import tempfile
+import unittest
+
+from sequence_search.producer.chunk_sketches import ChunkSketch, kmers, rank_databases
+
+"""
+Run these tests with:
+
+ENVIRONMENT=TEST python3 -m unittest sequence_search.producer.tests.test_chunk_sketches
+"""
+
+QUERY = 'AAAAGGUCGGAGCGAGGCAAAAUUGGCUUUCAAACUAGGUUCUGGGUUCACAUAAGACCU'
+
+
+class ChunkSketchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def sketch(self, sequences):
+        filename = os.path.join(self.tmp.name, 'database.fasta')
+        with open(filename, 'w') as f:
+            for i, sequence in enumerate(sequences):
+                f.write('>URS%010d_9606 description\n%s\n' % (i, sequence))
+        return ChunkSketch.build(filename, 10)
+
+    def test_kmers_of_dna_and_rna(self):
+        assert list(kmers('aaaaggtcggagcgaggc')) == list(kmers('AAAAGGUCGGAGCGAGGC'))
+        assert len(list(kmers('AAAAGGUCGGAGCGAGGC'))) == 3
+        assert list(kmers('AAAAGGUCNGGAGCGAGGC')) == []
+
+    def test_score(self):
+        codes = set(kmers(QUERY))
+        assert self.sketch([QUERY]).score(codes) == 1.0
+        assert 0 < self.sketch([QUERY[:30], 'CCCCCCCCCCCCCCCCCCCCC']).score(codes) < 1.0
+        assert self.sketch(['CCCCCCCCCCCCCCCCCCCCC']).score(codes) == 0.0
+        assert self.sketch([QUERY]).score(set()) is None
+
+    def test_size_follows_the_number_of_kmers(self):
+        generator = random.Random(1)
+        sequences = [''.join(generator.choice('ACGU') for _ in range(200)) for _ in range(100)]
+        sketch = self.sketch(sequences)
+        assert sketch.size == 10 * 100 * (200 - 15)
+        assert sketch.hashes == 7
+        assert sketch.false_positive_rate < 0.02
+
+        other = set(kmers(''.join(generator.choice('ACGU') for _ in range(2000))))
+        assert sum(1 for code in other if sketch.contains(code)) < 0.02 * len(other)
+
+    def test_save_and_load(self):
+        filename = os.path.join(self.tmp.name, 'database.fasta.sketch')
+        self.sketch([QUERY]).save(filename)
+        sketch = ChunkSketch.load(filename)
+        assert sketch.score(set(kmers(QUERY))) == 1.0
+        assert sketch.score(set(kmers('CCCCCCCCCCCCCCCCCCCCC'))) == 0.0
+
+    def test_rank_databases(self):
+        sketches = {
+            'mirbase-1.fasta': self.sketch(['CCCCCCCCCCCCCCCCCCCCC']),
+            'mirbase-2.fasta': self.sketch([QUERY[:30]]),
+            'mirbase-3.fasta': self.sketch([QUERY]),
+        }
+        databases = ['mirbase-1.fasta', 'mirbase-2.fasta', 'mirbase-3.fasta', 'mirbase-4.fasta']
+        ranked = [database for database, score in rank_databases(sketches, QUERY, databases)]
+        assert ranked == ['mirbase-3.fasta', 'mirbase-2.fasta', 'mirbase-4.fasta', 'mirbase-1.fasta']
@@ -0,0 +1,116 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import datetime
+import logging
+import uuid
+from collections import namedtuple
+
+import sqlalchemy as sa
+from aiohttp import web
+from aiohttp.test_utils import AioHTTPTestCase
+from aiohttp.test_utils import unittest_run_loop
+
+from sequence_search.db.models import Job, JobChunk, JOB_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES
+from sequence_search.db.settings import get_postgres_credentials
+from sequence_search.producer import settings
+from sequence_search.producer.__main__ import create_app
+from sequence_search.producer.dispatch import dispatch
+
+
+"""
+Run these tests with:
+
+ENVIRONMENT=TEST python3 -m unittest sequence_search.producer.tests.test_dispatch
+"""
+
+Consumer = namedtuple('Consumer', ['ip', 'port'])
+
+
+class SlowConsumerClient(object):
+    """Consumer client where the consumer 192.168.0.3 never answers"""
+    def __init__(self):
+        self.submitted = []
+
+    async def submit_job(self, consumer_ip, consumer_port, job_id, database, query):
+        if consumer_ip == '192.168.0.3':
+            await asyncio.sleep(10)
+        self.submitted.append(database)
+        return web.Response(status=200)
+
+
+class DispatchTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        logging.basicConfig(level=logging.CRITICAL)  # subdue the timeout errors
+        app = create_app()
+        settings = get_postgres_credentials(ENVIRONMENT='TEST')
+        app.update(name='test', settings=settings)
+        return app
+
+    async def setUpAsync(self):
+        await super().setUpAsync()
+        self.job_id = str(uuid.uuid4())
+        self.timeout = settings.DISPATCH_TIMEOUT
+        settings.DISPATCH_TIMEOUT = 0.5
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Job.insert().values(
+                    id=self.job_id,
+                    query='AACAGCATGAGTGCGCTGGATGCTG',
+                    submitted=datetime.datetime.now(),
+                    status=JOB_STATUS_CHOICES.started
+                )
+            )
+
+            for database in ['mirbase-1.fasta', 'mirbase-2.fasta', 'mirbase-3.fasta']:
+                await connection.execute(
+                    JobChunk.insert().values(
+                        job_id=self.job_id,
+                        database=database,
+                        status=JOB_CHUNK_STATUS_CHOICES.created
+                    )
+                )
+
+    async def tearDownAsync(self):
+        settings.DISPATCH_TIMEOUT = self.timeout
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute('DELETE FROM job_chunk_results')
+            await connection.execute('DELETE FROM job_chunks')
+            await connection.execute('DELETE FROM jobs')
+
+        await super().tearDownAsync()
+
+    @unittest_run_loop
+    async def test_dispatch_with_slow_consumer(self):
+        self.app['consumer_client'] = SlowConsumerClient()
+        assignments = [
+            (Consumer('192.168.0.2', 8000), self.job_id, 'mirbase-1.fasta'),
+            (Consumer('192.168.0.3', 8000), self.job_id, 'mirbase-2.fasta'),
+            (Consumer('192.168.0.4', 8000), self.job_id, 'mirbase-3.fasta'),
+        ]
+
+        started = datetime.datetime.now()
+        failed = await dispatch(self.app, assignments)
+
+        # the slow consumer holds back neither the other consumers nor the whole dispatch
+        assert (datetime.datetime.now() - started).total_seconds() < 5
+        assert sorted(self.app['consumer_client'].submitted) == ['mirbase-1.fasta', 'mirbase-3.fasta']
+        assert failed == [(self.job_id, 'mirbase-2.fasta')]
+
+        async with self.app['engine'].acquire() as connection:
+            query = sa.select([JobChunk.c.status]).where(JobChunk.c.database == 'mirbase-2.fasta')
+            statuses = [row.status async for row in await connection.execute(query)]
+            assert statuses == [JOB_CHUNK_STATUS_CHOICES.pending]
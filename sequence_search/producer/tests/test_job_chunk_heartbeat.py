@@ -0,0 +1,106 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+import json
+import logging
+import uuid
+
+import sqlalchemy as sa
+from aiohttp.test_utils import AioHTTPTestCase
+from aiohttp.test_utils import unittest_run_loop
+
+from sequence_search.db.models import Job, JobChunk, Consumer, JOB_STATUS_CHOICES, JOB_CHUNK_STATUS_CHOICES, \
+    CONSUMER_STATUS_CHOICES
+from sequence_search.db.settings import get_postgres_credentials
+from sequence_search.producer.__main__ import create_app
+
+
+"""
+Run these tests with:
+
+ENVIRONMENT=TEST python3 -m unittest sequence_search.producer.tests.test_job_chunk_heartbeat
+"""
+
+
+class JobChunkHeartbeatTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        logging.basicConfig(level=logging.ERROR)  # subdue messages like 'DEBUG:asyncio:Using selector: KqueueSelector'
+        app = create_app()
+        settings = get_postgres_credentials(ENVIRONMENT='TEST')
+        app.update(name='test', settings=settings)
+        return app
+
+    async def setUpAsync(self):
+        await super().setUpAsync()
+        self.job_id = str(uuid.uuid4())
+
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute(
+                Consumer.insert().values(ip='192.168.0.2', status=CONSUMER_STATUS_CHOICES.suspect, slots=2, running=1)
+            )
+
+            await connection.execute(
+                Job.insert().values(
+                    id=self.job_id,
+                    query='AACAGCATGAGTGCGCTGGATGCTG',
+                    submitted=datetime.datetime.now(),
+                    status=JOB_STATUS_CHOICES.started
+                )
+            )
+
+            for database, consumer in [('mirbase-1.fasta', '192.168.0.2'), ('mirbase-2.fasta', None)]:
+                await connection.execute(
+                    JobChunk.insert().values(
+                        job_id=self.job_id,
+                        database=database,
+                        submitted=datetime.datetime.now(),
+                        status=JOB_CHUNK_STATUS_CHOICES.started,
+                        consumer=consumer
+                    )
+                )
+
+    async def tearDownAsync(self):
+        async with self.app['engine'].acquire() as connection:
+            await connection.execute('DELETE FROM job_chunks')
+            await connection.execute('DELETE FROM jobs')
+            await connection.execute('DELETE FROM consumer')
+
+        await super().tearDownAsync()
+
+    @unittest_run_loop
+    async def test_heartbeat_renews_leases(self):
+        url = self.app.router["job-chunk-heartbeat"].url_for()
+        data = json.dumps({
+            "consumer": "192.168.0.2",
+            "job_chunks": [[self.job_id, "mirbase-1.fasta"], [self.job_id, "mirbase-2.fasta"]]
+        })
+        async with self.client.post(path=url, data=data, headers={"content-type": "application/json"}) as response:
+            assert response.status == 200
+            assert await response.json() == {"renewed": 1}
+
+        async with self.app['engine'].acquire() as connection:
+            query = sa.select([JobChunk.c.database, JobChunk.c.lease_expires]).order_by(JobChunk.c.database)
+            leases = [(row.database, row.lease_expires is not None) async for row in await connection.execute(query)]
+            assert leases == [('mirbase-1.fasta', True), ('mirbase-2.fasta', False)]
+
+            query = sa.select([Consumer.c.status]).where(Consumer.c.ip == '192.168.0.2')
+            statuses = [row.status async for row in await connection.execute(query)]
+            assert statuses == [CONSUMER_STATUS_CHOICES.available]
+
+    @unittest_run_loop
+    async def test_heartbeat_without_consumer(self):
+        url = self.app.router["job-chunk-heartbeat"].url_for()
+        async with self.client.post(path=url, data=json.dumps({}), headers={"content-type": "application/json"}) \
+                as response:
+            assert response.status == 400
@@ -0,0 +1,57 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import json
+import logging
+
+from aiohttp.test_utils import AioHTTPTestCase
+from aiohttp.test_utils import unittest_run_loop
+
+from sequence_search.db.settings import get_postgres_credentials
+from sequence_search.producer.__main__ import create_app
+
+
+"""
+Run these tests with:
+
+ENVIRONMENT=TEST python3 -m unittest sequence_search.producer.tests.test_job_done
+"""
+
+
+class JobDoneTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        logging.basicConfig(level=logging.ERROR)  # subdue messages like 'DEBUG:asyncio:Using selector: KqueueSelector'
+        app = create_app()
+        settings = get_postgres_credentials(ENVIRONMENT='TEST')
+        app.update(name='test', settings=settings)
+        return app
+
+    @unittest_run_loop
+    async def test_job_done_wakes_up_scheduler(self):
+        # let the scheduler finish its first pass, it won't clear a new event until the next one
+        await asyncio.sleep(0.5)
+        self.app['scheduler_wakeup'] = wakeup = asyncio.Event()
+
+        url = self.app.router["job-done"].url_for()
+        data = json.dumps({"job_id": "1", "database": "mirbase-1.fasta"})
+        async with self.client.post(path=url, data=data, headers={"content-type": "application/json"}) as response:
+            assert response.status == 200
+
+        assert wakeup.is_set()
+
+    @unittest_run_loop
+    async def test_job_done_without_data(self):
+        url = self.app.router["job-done"].url_for()
+        async with self.client.post(path=url) as response:
+            assert response.status == 200
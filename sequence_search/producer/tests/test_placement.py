@@ -0,0 +1,72 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+import unittest
+from collections import namedtuple
+
+from sequence_search.producer.placement import place_jobs
+
+"""
+Run these tests with:
+
+ENVIRONMENT=TEST python3 -m unittest sequence_search.producer.tests.test_placement
+"""
+
+Consumer = namedtuple('Consumer', ['ip', 'port'])
+
+NOW = datetime.datetime(2024, 1, 1, 12, 0, 0)
+JUST_SUBMITTED = NOW - datetime.timedelta(seconds=1)
+LONG_AGO = NOW - datetime.timedelta(seconds=60)
+
+
+def slots(*ips):
+    return [Consumer(ip, '8000') for ip in ips]
+
+
+def placed(assignments):
+    return [(consumer.ip, job_id, database) for consumer, job_id, database in assignments]
+
+
+class PlaceJobsTestCase(unittest.TestCase):
+    def test_cached_consumer_is_preferred(self):
+        jobs = [('1', 'low', JUST_SUBMITTED, 'mirbase-1.fasta'), ('1', 'low', JUST_SUBMITTED, 'rfam-1.fasta')]
+        cached = {'192.168.0.3': {'mirbase-1.fasta'}, '192.168.0.2': {'rfam-1.fasta'}}
+        assert placed(place_jobs(jobs, slots('192.168.0.2', '192.168.0.3'), cached, NOW, 15)) == [
+            ('192.168.0.3', '1', 'mirbase-1.fasta'), ('192.168.0.2', '1', 'rfam-1.fasta')
+        ]
+
+    def test_job_chunk_waits_for_busy_cached_consumer(self):
+        jobs = [('1', 'low', JUST_SUBMITTED, 'mirbase-1.fasta'), ('2', 'low', JUST_SUBMITTED, 'rfam-1.fasta')]
+        cached = {'192.168.0.3': {'mirbase-1.fasta'}}
+        free = slots('192.168.0.2')
+        assert placed(place_jobs(jobs, free, cached, NOW, 15)) == [('192.168.0.2', '2', 'rfam-1.fasta')]
+        assert free == []
+
+    def test_wait_is_bounded(self):
+        jobs = [('1', 'low', LONG_AGO, 'mirbase-1.fasta')]
+        cached = {'192.168.0.3': {'mirbase-1.fasta'}}
+        assert placed(place_jobs(jobs, slots('192.168.0.2'), cached, NOW, 15)) == [
+            ('192.168.0.2', '1', 'mirbase-1.fasta')
+        ]
+
+    def test_same_database_goes_to_same_consumer(self):
+        jobs = [('1', 'low', JUST_SUBMITTED, 'mirbase-1.fasta'), ('2', 'low', JUST_SUBMITTED, 'mirbase-1.fasta')]
+        assert placed(place_jobs(jobs, slots('192.168.0.2', '192.168.0.3', '192.168.0.2'), {}, NOW, 15)) == [
+            ('192.168.0.2', '1', 'mirbase-1.fasta'), ('192.168.0.2', '2', 'mirbase-1.fasta')
+        ]
+
+    def test_infernal_job_takes_any_slot(self):
+        jobs = [('1', 'low', JUST_SUBMITTED, None)]
+        cached = {'192.168.0.3': {'mirbase-1.fasta'}}
+        assert placed(place_jobs(jobs, slots('192.168.0.2'), cached, NOW, 15)) == [('192.168.0.2', '1', None)]
@@ -0,0 +1,69 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+
+from sequence_search.producer import settings
+from sequence_search.producer.runtime_model import RuntimeModel
+
+"""
+Run these tests with:
+
+ENVIRONMENT=TEST python3 -m unittest sequence_search.producer.tests.test_runtime_model
+"""
+
+# mirbase-1.fasta takes 10 seconds plus 0.1 second per nucleotide, rfam-1.fasta always takes 30 seconds
+RUNTIMES = [('mirbase-1.fasta', length, 10 + 0.1 * length) for length in range(100, 1100, 100)] + \
+    [('rfam-1.fasta', length, 30.0) for length in range(100, 1100, 100)] + \
+    [('pombase-1.fasta', 100, 1.0)]
+
+
+class RuntimeModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = RuntimeModel.fit(RUNTIMES, min_samples=10)
+
+    def test_fit(self):
+        intercept, slope, samples = self.model.coefficients['mirbase-1.fasta']
+        assert round(intercept, 6) == 10.0
+        assert round(slope, 6) == 0.1
+        assert samples == 10
+        assert self.model.coefficients['rfam-1.fasta'] == (30.0, 0.0, 10)
+
+    def test_too_few_samples(self):
+        assert 'pombase-1.fasta' not in self.model.coefficients
+        assert self.model.predict('pombase-1.fasta', 100) is None
+        assert self.model.timeout('pombase-1.fasta', 100) is None
+
+    def test_slope_is_never_negative(self):
+        model = RuntimeModel.fit([('mirbase-1.fasta', 100, 20.0), ('mirbase-1.fasta', 200, 10.0)], min_samples=2)
+        assert model.coefficients['mirbase-1.fasta'] == (15.0, 0.0, 2)
+
+    def test_predict(self):
+        assert round(self.model.predict('mirbase-1.fasta', 2000), 6) == 210.0
+        assert self.model.predict('rfam-1.fasta', 2000) == 30.0
+
+    def test_timeout(self):
+        assert self.model.timeout('mirbase-1.fasta', 2000) == int(210 * settings.RUNTIME_TIMEOUT_FACTOR)
+        assert self.model.timeout('mirbase-1.fasta', 0) == settings.RUNTIME_TIMEOUT_MIN
+
+    def test_order(self):
+        databases = ['pombase-1.fasta', 'rfam-1.fasta', 'mirbase-1.fasta', 'snodb-1.fasta']
+        assert self.model.order(databases, 100) == \
+            ['pombase-1.fasta', 'snodb-1.fasta', 'rfam-1.fasta', 'mirbase-1.fasta']
+        assert self.model.order(databases, 1000) == \
+            ['pombase-1.fasta', 'snodb-1.fasta', 'mirbase-1.fasta', 'rfam-1.fasta']
+
+    def test_empty_model(self):
+        databases = ['rfam-1.fasta', 'mirbase-1.fasta']
+        assert RuntimeModel().order(databases, 100) == databases
+        assert RuntimeModel().to_json() == {'fitted': None, 'databases': {}}
@@ -0,0 +1,65 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+import unittest
+
+from sequence_search.db.jobs import PendingJob
+from sequence_search.producer.scheduling import PriorityPolicy, AgingPolicy, FairSharePolicy, DeadlinePolicy, \
+    get_policy, parse_values
+
+"""
+Run these tests with:
+
+ENVIRONMENT=TEST python3 -m unittest sequence_search.producer.tests.test_scheduling
+"""
+
+NOW = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def job(job_id, priority='low', minutes=0, source='API', chunks=1, infernal=False):
+    """PendingJob submitted `minutes` ago"""
+    return PendingJob(job_id, priority, NOW - datetime.timedelta(minutes=minutes), source, chunks, infernal)
+
+
+class SchedulingPolicyTestCase(unittest.TestCase):
+    def test_priority(self):
+        jobs = [job('1', 'low', 10), job('2', 'high', 1), job('3', 'db-seq-test', 1), job('4', 'critical', 0)]
+        assert PriorityPolicy().select(jobs, {}, 10, NOW) == ['4', '3', '2', '1']
+
+    def test_priority_with_limit(self):
+        jobs = [job('1', 'low', 10, chunks=3, infernal=True), job('2', 'high', 1, chunks=2)]
+        assert PriorityPolicy().select(jobs, {}, 4, NOW) == ['2', '2', '1', '1']
+
+    def test_aging(self):
+        jobs = [job('1', 'low', 25), job('2', 'high', 0), job('3', 'low', 5)]
+        # after 20 minutes, a low priority job has moved up to the high priority level and it's older
+        assert AgingPolicy(600).select(jobs, {}, 10, NOW) == ['1', '2', '3']
+        assert PriorityPolicy().select(jobs, {}, 10, NOW) == ['2', '1', '3']
+
+    def test_fair_share(self):
+        jobs = [job('1', 'low', 10, 'API', chunks=10), job('2', 'low', 0, 'RNAcentral', chunks=10)]
+        policy = FairSharePolicy({'RNAcentral': 2}, 600)
+        assert policy.select(jobs, {}, 6, NOW) == ['1', '2', '2', '1', '2', '2']
+        assert policy.select(jobs, {'RNAcentral': 4}, 4, NOW) == ['1', '1', '1', '2']
+
+    def test_deadline(self):
+        jobs = [job('1', 'high', 10), job('2', 'critical', 0, 'miRBase'), job('3', 'critical', 1, 'snoDB')]
+        policy = DeadlinePolicy({'miRBase': 60, 'snoDB': 600}, 600)
+        assert policy.select(jobs, {}, 10, NOW) == ['2', '3', '1']
+
+    def test_get_policy(self):
+        assert isinstance(get_policy('fair-share'), FairSharePolicy)
+        assert parse_values('miRBase:60, snoDB:30') == {'miRBase': 60.0, 'snoDB': 30.0}
+        with self.assertRaises(ValueError):
+            get_policy('round-robin')
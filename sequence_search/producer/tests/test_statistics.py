@@ -0,0 +1,71 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import unittest
+from unittest import mock
+
+from sequence_search.db import SQLError
+from sequence_search.producer.statistics import StatisticsBuffer
+
+"""
+Run these tests with:
+
+ENVIRONMENT=TEST python3 -m unittest sequence_search.producer.tests.test_statistics
+"""
+
+
+class StatisticsBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_add_and_take(self):
+        statistics = StatisticsBuffer()
+        statistics.add('API', '2019-11')
+        statistics.add('API', '2019-11')
+        statistics.add('rnacentral.org', '2019-11')
+
+        assert statistics.take() == {('API', '2019-11'): 2, ('rnacentral.org', '2019-11'): 1}
+        assert statistics.take() == {}
+
+    def test_flush(self):
+        statistics = StatisticsBuffer()
+        statistics.add('API', '2019-11')
+
+        saved = []
+
+        async def increment_statistics(engine, counts):
+            saved.append(counts)
+
+        with mock.patch('sequence_search.producer.statistics.increment_statistics', increment_statistics):
+            self.loop.run_until_complete(statistics.flush('engine'))
+
+        assert saved == [{('API', '2019-11'): 1}]
+        assert statistics.take() == {}
+
+    def test_failed_flush_keeps_counts(self):
+        statistics = StatisticsBuffer()
+        statistics.add('API', '2019-11')
+
+        async def failure(engine, counts):
+            statistics.add('API', '2019-11')  # submitted while the database was busy
+            raise SQLError('database is down')
+
+        with mock.patch('sequence_search.producer.statistics.increment_statistics', failure):
+            with self.assertRaises(SQLError):
+                self.loop.run_until_complete(statistics.flush('engine'))
+
+        assert statistics.take() == {('API', '2019-11'): 2}
@@ -15,7 +15,8 @@ import os
 from aiohttp_swagger import setup_swagger
 from .views import index, submit_job, job_status, job_result, rnacentral_databases, job_results_urs_list, \
     facets, facets_search, list_rnacentral_ids, post_rnacentral_ids, consumers_statuses, jobs_statuses, show_searches, \
-    infernal_job_result, infernal_status, r2dt
+    infernal_job_result, infernal_status, r2dt, job_done, runtime_model, job_runtimes, \
+    job_chunk_heartbeat
 from . import settings
 
 
@@ -36,6 +37,10 @@ def setup_routes(app):
     app.router.add_get('/api/infernal-status/{job_id:[A-Za-z0-9_-]+}', infernal_status, name='infernal-status')
     app.router.add_get('/api/infernal-result/{job_id:[A-Za-z0-9_-]+}', infernal_job_result, name='infernal-job-result')
     app.router.add_patch('/api/r2dt/{job_id:[A-Za-z0-9_-]+}', r2dt, name='r2dt')
+    app.router.add_post('/api/job-done', job_done, name='job-done')
+    app.router.add_post('/api/job-chunk-heartbeat', job_chunk_heartbeat, name='job-chunk-heartbeat')
+    app.router.add_get('/api/runtime-model', runtime_model, name='runtime-model')
+    app.router.add_get('/api/job-runtimes/{job_id:[A-Za-z0-9_-]+}', job_runtimes, name='job-runtimes')
     setup_static_routes(app)
 
     # setup swagger documentation
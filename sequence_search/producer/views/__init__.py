@@ -13,6 +13,7 @@ limitations under the License.
 
 from .index import index
 from .job_chunk_heartbeat import job_chunk_heartbeat
+from .job_done import job_done
 from .job_status import job_status
 from .jobs_statuses import jobs_statuses
 from .job_result import job_result
@@ -28,3 +29,5 @@ from .show_searches import show_searches
 from .infernal_job_result import infernal_job_result
 from .infernal_status import infernal_status
 from .r2dt import r2dt
+from .runtime_model import runtime_model
+from .job_runtimes import job_runtimes
@@ -20,6 +20,7 @@ from pymemcache.client import base
 from pymemcache import serde
 
 from ...db.jobs import get_job_results, get_job, job_exists, set_job_ordering
+from ...db.session import Session
 from ..text_search_client import get_text_search_results, ProxyConnectionError, EBITextSearchConnectionError, \
     facetfields
 
@@ -105,9 +106,6 @@ async def facets_search(request):
     """
     job_id = request.match_info['job_id']
 
-    if not await job_exists(request.app['engine'], job_id):
-        return web.HTTPNotFound(text="Job %s does not exist" % job_id)
-
     # parse query parameters
     query = request.query['query'] if 'query' in request.query else 'rna'
     start = request.query['start'] if 'start' in request.query else 0
@@ -115,17 +113,21 @@ async def facets_search(request):
     facetcount = request.query['facetcount'] if 'facetcount' in request.query else 100
     ordering = request.query['ordering'] if 'ordering' in request.query else 'e_value'
 
-    # set ordering, so that EBI text search returns entries in correct order
-    await set_job_ordering(request.app['engine'], job_id, ordering)
+    async with Session(request.app['engine']) as session:
+        if not await job_exists(session, job_id):
+            return web.HTTPNotFound(text="Job %s does not exist" % job_id)
+
+        # set ordering, so that EBI text search returns entries in correct order
+        await set_job_ordering(session, job_id, ordering)
 
-    # get sequence search query sequence, status and number of hits
-    job = await get_job(request.app['engine'], job_id)
-    sequence = job['query']
-    status = job['status']
-    hits = job['hits']
+        # get sequence search query sequence, status and number of hits
+        job = await get_job(session, job_id)
+        sequence = job['query']
+        status = job['status']
+        hits = job['hits']
 
-    # get sequence search results from the database, sort/aggregate?
-    results = await get_job_results(request.app['engine'], job_id)
+        # get sequence search results from the database, sort/aggregate?
+        results = await get_job_results(session, job_id)
 
     # try to get facets from EBI text search, otherwise stub facets
     try:
@@ -11,6 +11,68 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import datetime
+
+from aiohttp import web
+
+from .. import settings
+from ...db import DatabaseConnectionError, SQLError
+from ...db.consumers import record_consumer_heartbeat
+from ...db.job_chunks import renew_job_chunk_leases
+from ...db.session import Session
+
 
 async def job_chunk_heartbeat(request):
-    pass
\ No newline at end of file
+    """
+    Called periodically by each consumer with the job_chunks it is running. Renews their leases
+    for LEASE_DURATION seconds; check_chunks_and_consumers requeues the job_chunks whose lease expires.
+
+    Example:
+    curl -H "Content-Type:application/json" -d "{\"consumer\": \"192.168.0.2\", \"job_chunks\": [[\"<job_id>\", \"mirbase-1.fasta\"]]}" localhost:8002/api/job-chunk-heartbeat
+
+    ---
+    tags:
+    - Consumers
+    summary: Renews the leases of the job chunks that a consumer is running
+    consumes:
+     - application/json
+    parameters:
+     - in: body
+       name: Heartbeat
+       description: IP of the consumer and the (job_id, database) of its running job chunks
+       required: true
+       schema:
+         properties:
+           consumer:
+             type: string
+           job_chunks:
+             type: array
+         required:
+           - consumer
+    responses:
+      200:
+        description: OK
+      400:
+        description: Bad request
+      500:
+        description: Internal server error
+    """
+    try:
+        data = await request.json()
+        consumer_ip = data['consumer']
+        job_chunks = [(job_id, database) for job_id, database in data.get('job_chunks', [])]
+    except (KeyError, TypeError, ValueError) as e:
+        raise web.HTTPBadRequest(text=str(e)) from e
+
+    now = datetime.datetime.now()
+    try:
+        async with Session(request.app['engine']) as session:
+            async with session.begin():
+                await record_consumer_heartbeat(session, consumer_ip, now)
+                renewed = await renew_job_chunk_leases(
+                    session, consumer_ip, job_chunks, now + datetime.timedelta(seconds=settings.LEASE_DURATION)
+                )
+    except (DatabaseConnectionError, SQLError) as e:
+        raise web.HTTPServerError() from e
+
+    return web.json_response({"renewed": renewed})
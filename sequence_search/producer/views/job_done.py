@@ -0,0 +1,60 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+
+from aiohttp import web
+
+
+async def job_done(request):
+    """
+    Called by a consumer when it finishes a job_chunk or an infernal_job and frees its slot.
+    Wakes up check_chunks_and_consumers, so that the free slot is used right away instead of
+    on the next periodic pass of the scheduler.
+
+    Example:
+    curl -H "Content-Type:application/json" -d "{\"job_id\": \"<job_id>\", \"database\": \"mirbase-1.fasta\"}" localhost:8002/api/job-done
+
+    ---
+    tags:
+    - Consumers
+    summary: Notifies the producer that a consumer slot is free
+    consumes:
+     - application/json
+    parameters:
+     - in: body
+       name: Finished job
+       description: Job and database file that the consumer has finished (optional)
+       required: false
+       schema:
+         properties:
+           job_id:
+             type: string
+           database:
+             type: string
+    responses:
+      200:
+        description: OK
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+
+    logging.debug("Consumer finished job_id = %s, database = %s" % (data.get('job_id'), data.get('database')))
+
+    wakeup = request.app.get('scheduler_wakeup')
+    if wakeup:
+        wakeup.set()
+
+    return web.json_response({"status": "ok"})
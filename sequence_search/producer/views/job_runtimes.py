@@ -0,0 +1,52 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from aiohttp import web
+from aiojobs.aiohttp import atomic
+
+from ...db import DatabaseConnectionError
+from ...db.job_chunks import get_job_runtimes
+
+
+@atomic
+async def job_runtimes(request):
+    """
+    Compares the predicted runtime of each job chunk of a job with its actual runtime.
+
+    ---
+    tags:
+    - Dashboard
+    summary: Shows the predicted and actual runtimes of the chunks of a job
+    parameters:
+    - name: job_id
+      in: path
+      description: Unique job identification
+      type: string
+      required: true
+    responses:
+      200:
+        description: Ok
+      404:
+        description: Not found (probably, job with this job_id doesn't exist)
+    """
+    job_id = request.match_info['job_id']
+
+    try:
+        chunks = await get_job_runtimes(request.app['engine'], job_id)
+    except DatabaseConnectionError as e:
+        raise web.HTTPServerError() from e
+
+    if not chunks:
+        raise web.HTTPNotFound(text="Job '%s' not found" % job_id)
+
+    return web.json_response({"job_id": job_id, "chunks": chunks})
@@ -0,0 +1,31 @@
+"""
+Copyright [2009-present] EMBL-European Bioinformatics Institute
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from aiohttp import web
+
+
+async def runtime_model(request):
+    """
+    Shows the coefficients of the runtime model of the job chunks, see producer/runtime_model.py
+
+    ---
+    tags:
+    - Dashboard
+    summary: Shows the predicted runtime of each database file
+    parameters: []
+    responses:
+      200:
+        description: Ok
+    """
+    model = request.app.get('runtime_model')
+    return web.json_response(model.to_json() if model else {})
@@ -11,21 +11,26 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import math
 import re
 
 from aiohttp import web
 from aiojobs.aiohttp import atomic
-from datetime import datetime
+from datetime import datetime, timedelta
 from urllib.parse import urlparse
 
-from sequence_search.db.models import JOB_CHUNK_STATUS_CHOICES
-from sequence_search.producer.settings import MIN_QUERY_LENGTH, MAX_QUERY_LENGTH
-from ...db.consumers import delegate_job_chunk_to_consumer, find_available_consumers, delegate_infernal_job_to_consumer
-from ...db.jobs import find_highest_priority_jobs, save_job, sequence_exists, database_used_in_search
-from ...db.job_chunks import save_job_chunk, set_job_chunk_status
-from ...db.infernal_job import save_infernal_job
-from ...db.statistic import create_statistic, get_statistic, update_statistic
-from ...consumer.rnacentral_databases import producer_validator, producer_to_consumers_databases
+from sequence_search.producer.settings import MIN_QUERY_LENGTH, MAX_QUERY_LENGTH, CHUNK_SKETCH_SKIP, \
+    CHUNK_RESULTS_REUSE, DISPATCH_MODE, RUNTIME_ORDER
+from ..admission import estimate_wait, get_queue_state, retry_after
+from ..chunk_sketches import rank_databases
+from ..dispatch import dispatch
+from ..placement import get_cached_databases, place_jobs
+from ...db.consumers import find_available_consumer_slots
+from ...db import SQLError
+from ...db.jobs import find_highest_priority_jobs, create_job, find_reusable_job
+from ...db.job_chunks import find_reusable_job_chunks, requeue_job_chunks
+from ...consumer.rnacentral_databases import producer_validator, producer_to_consumers_databases, \
+    database_release
 
 
 def serialize(request, data):
@@ -104,13 +109,16 @@ async def submit_job(request):
            - databases
     responses:
       201:
-        description: Created
+        description: Created, with the estimated start time of a new job
       400:
         description: Bad request (either query is not a nucleotide sequence, or the database is not in RNAcentral)
+      429:
+        description: Too many requests, try again after the number of seconds in the Retry-After header
       500:
         description: Internal server error
     """
     data = await request.json()
+    estimate = {}
 
     # converts all uppercase characters to lowercase.
     if data['databases']:
@@ -124,17 +132,11 @@ async def submit_job(request):
     # database that the user wants to use to perform the search
     databases = producer_to_consumers_databases(data['databases'])
 
-    # check if this query has already been searched
-    job_list = await sequence_exists(request.app['engine'], data['query'])
+    # fingerprints of the database files, the results of a job or a job_chunk can only be reused while they don't change
+    releases = {database: database_release(database) for database in databases}
 
-    job_id = None
-    if job_list:
-        # check the database used in each job_id.
-        # set job_id if the database used is the same as in "databases"
-        for job in job_list:
-            if await database_used_in_search(request.app['engine'], job, databases):
-                job_id = job
-                break
+    # check if this query has already been searched against the same releases of the same databases
+    job_id = await find_reusable_job(request.app['engine'], data['query'], releases)
 
     # do the search if the data is not in the database
     if not job_id:
@@ -183,91 +185,95 @@ async def submit_job(request):
             else:
                 source = 'API'
 
+        # estimate when the job will start, and turn away low priority API jobs while the queue is too long
+        depth, slots = await get_queue_state(request.app)
+        wait = estimate_wait(depth, slots, priority)
+        retry = retry_after(depth, wait, priority, source) if data["description"] != "sequence-search-test" else None
+        if retry is not None:
+            raise web.HTTPTooManyRequests(
+                headers={"Retry-After": str(retry)},
+                text="Too many searches are waiting, please try again in %s seconds.\n" % retry
+            )
+        if wait is not None:
+            estimate = {
+                "estimated_start": str(datetime.now() + timedelta(seconds=wait)),
+                "estimated_wait": int(math.ceil(wait))
+            }
+
         if data["description"] == "sequence-search-test":
             priority = "db-seq-test"
         else:
-            period = datetime.today().strftime('%Y-%m')
-            statistic = await get_statistic(request.app['engine'], source, period)
+            # counted in memory, saved to the statistic table by flush_statistics
+            request.app['statistics'].add(source, datetime.today().strftime('%Y-%m'))
+
+        # order the job_chunks by the expected density of hits, so that the most promising ones start first
+        ranked = rank_databases(request.app.get('chunk_sketches', {}), data['query'], databases)
+        ordered = [database for database, score in ranked]
+
+        # start the job_chunks that are predicted to take longest first, so that the whole job finishes sooner
+        runtime_model = request.app.get('runtime_model')
+        if runtime_model and RUNTIME_ORDER:
+            ordered = runtime_model.order(ordered, len(data['query']))
+
+        job_chunks = [
+            {
+                'database': database,
+                'rank': rank,
+                'release': releases[database],
+                'predicted_runtime': runtime_model.predict(database, len(data['query'])) if runtime_model else None,
+                'timeout': runtime_model.timeout(database, len(data['query'])) if runtime_model else None
+            } for rank, database in enumerate(ordered)
+        ]
 
-            if statistic:
-                await update_statistic(
-                    request.app['engine'], statistic['statistic_id'], statistic['statistic_total'] + 1
-                )
-            else:
-                await create_statistic(request.app['engine'], source, period)
-
-        # save metadata about this job to the database
-        job_id = await save_job(request.app['engine'], data['query'], data['description'], url, priority)
-
-        # save metadata about job_chunks to the database
-        # TODO: what if Job was saved and JobChunk was not? Need transactions?
-        for database in databases:
-            # save job_chunk with "created" status. This prevents the check_chunks_and_consumers function,
-            # which runs every 5 seconds, from executing the same job_chunk again.
-            await save_job_chunk(request.app['engine'], job_id, database)
-
-        # save metadata about infernal_job to the database
-        # TODO: what if Job was saved and InfernalJob was not? Need transactions?
-        await save_infernal_job(request.app['engine'], job_id, priority)
-
-        # if there are unfinished jobs, change the status of each new job_chunk to pending;
-        # otherwise try starting the job
-        if unfinished_job:
-            for database in databases:
-                try:
-                    await set_job_chunk_status(
-                        request.app['engine'],
-                        job_id,
-                        database,
-                        status=JOB_CHUNK_STATUS_CHOICES.pending
-                    )
-                except Exception as e:
-                    return web.HTTPBadGateway(text=str(e))
-        else:
-            # check for available consumers
-            consumers = await find_available_consumers(request.app['engine'])
-
-            # if consumers are available, delegate to infernal_job first
-            if consumers:
-                consumer = consumers.pop(0)
-
-                try:
-                    await delegate_infernal_job_to_consumer(
-                        engine=request.app['engine'],
-                        consumer_ip=consumer.ip,
-                        consumer_port=consumer.port,
-                        job_id=job_id,
-                        query=data['query'],
-                        consumer_client=request.app['consumer_client']
-                    )
-                except Exception as e:
-                    return web.HTTPBadGateway(text=str(e))
-
-            # after infernal_job, delegate consumers to job_chunks
-            for index in range(min(len(consumers), len(databases))):
-                try:
-                    await delegate_job_chunk_to_consumer(
-                        engine=request.app['engine'],
-                        consumer_ip=consumers[index].ip,
-                        consumer_port=consumers[index].port,
-                        job_id=job_id,
-                        database=databases[index],
-                        query=data['query'],
-                        consumer_client=request.app['consumer_client']
-                    )
-                except Exception as e:
-                    return web.HTTPBadGateway(text=str(e))
-
-            # if no consumer is available, change the status of the remaining job_chunks to pending
-            for index in range(len(consumers), len(databases)):
-                try:
-                    await set_job_chunk_status(
-                        request.app['engine'],
-                        job_id,
-                        databases[index],
-                        status=JOB_CHUNK_STATUS_CHOICES.pending
-                    )
-                except Exception as e:
-                    return web.HTTPBadGateway(text=str(e))
-
-    return web.json_response({"job_id": job_id}, status=201)
+        # copy the results of the job_chunks that other jobs have already searched with this query
+        reusable = {}
+        if CHUNK_RESULTS_REUSE:
+            reusable = await find_reusable_job_chunks(request.app['engine'], data['query'], releases)
+
+        # job_chunks of database files that share no k-mers with the query are unlikely to have hits, skip them
+        skipped = []
+        if CHUNK_SKETCH_SKIP:
+            skipped = [database for database, score in ranked if score == 0 and database not in reusable]
+
+        # if there are unfinished jobs, or if the consumers claim their work themselves, the new job_chunks are
+        # pending right away; otherwise they are created, so that check_chunks_and_consumers doesn't run them
+        # while this request tries starting the job
+        queued = bool(unfinished_job) or DISPATCH_MODE == 'pull'
+
+        # save the job, its job_chunks and its infernal_job to the database at once
+        try:
+            job_id = await create_job(
+                request.app['engine'], data['query'], data['description'], url, priority, databases, source,
+                job_chunks, reused=reusable, skipped=skipped, queued=queued
+            )
+        except SQLError:
+            # the same query has just been submitted by another request
+            job_id = await find_reusable_job(request.app['engine'], data['query'], releases)
+            if job_id:
+                return web.json_response({"job_id": job_id}, status=201)
+            raise
+
+        databases = [database for database in ordered if database not in reusable and database not in skipped]
+
+        if not queued:
+            # check for free slots of the available consumers
+            consumers = await find_available_consumer_slots(request.app['engine'])
+
+            # if consumers are available, delegate to infernal_job first, then to job_chunks;
+            # job_chunks may wait for a consumer that has their database file in cache
+            now = datetime.now()
+            jobs = [(job_id, priority, now, None)] + [(job_id, priority, now, database) for database in databases]
+            cached = await get_cached_databases(request.app['engine'])
+            assignments = place_jobs(jobs, consumers, cached, now)
+
+            try:
+                await dispatch(request.app, assignments, queries={job_id: data['query']})
+
+                # change the status of the job_chunks that didn't get a consumer slot to pending
+                assigned = set(database for consumer, job, database in assignments)
+                remaining = [(job_id, database) for database in databases if database not in assigned]
+                await requeue_job_chunks(request.app['engine'], remaining)
+            except Exception as e:
+                return web.HTTPBadGateway(text=str(e))
+
+    return web.json_response({"job_id": job_id, **estimate}, status=201)